@@ -1,22 +1,106 @@
-import io
+import hmac
 import json
 import logging
+import os
+import threading
+import time
+
+import numpy as np
 
 # Imports for the REST API
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 
 # Imports for image procesing
 from PIL import Image
 
 # Imports for prediction
-from predict import initialize, predict_image, predict_url
-from predict_aqi import initialize_aqi_model, predict_aqi, validate_pollution_data
+from model_registry import UnknownModel
+from predict import InputShapeError, get_batching_stats, get_cache_stats, get_fetch_stats, get_input_shape, get_load_state, get_models_info, get_pool_stats, initialize, predict_image, predict_image_bytes, predict_image_bytes_batch, predict_image_raw, predict_url, predict_url_batch, reload_models
+import aqi_shadow
+import metrics
+import timeseries
+from aqi_categories import CATEGORY_LABELS
+from encoding import ARROW_STREAM_TYPES, MSGPACK_TYPES, OCTET_STREAM, InvalidBody, UnsupportedFormat, arrow_read_columns, arrow_write_columns, install_json_provider, msgpack_dumps, msgpack_loads, pack_float32_rows, unpack_float32_rows
+from predict_aqi import REQUIRED_FEATURES, get_cache_stats as get_aqi_cache_stats, get_load_state as get_aqi_load_state, initialize_aqi_model, is_model_loaded as is_aqi_model_loaded, parse_reading, predict_aqi, predict_aqi_batch, predict_aqi_matrix
 
 app = Flask(__name__)
 
+# Encodeur des réponses JSON (JSON_ENCODER=fast: orjson si installé)
+install_json_provider(app)
+
 # 4MB Max image size limit
 app.config['MAX_CONTENT_LENGTH'] = 4 * 1024 * 1024
 
+# Nombre maximum de relevés acceptés par /predict-aqi/batch
+MAX_AQI_BATCH_SIZE = 10000
+
+# Maximum number of URLs accepted by /url/batch
+MAX_URL_BATCH_SIZE = 32
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+
+_ACCEPTED_CONTENT_TYPES = ['application/json', OCTET_STREAM, MSGPACK_TYPES[0], ARROW_STREAM_TYPES[0]]
+
+# Réponses AQI compactes (sans l'écho des valeurs d'entrée) par défaut; ?compact=0|1 l'emporte
+AQI_COMPACT_RESPONSES = os.environ.get('AQI_COMPACT_RESPONSES', '0') == '1'
+
+# Chargement des modèles:
+#   'eager'      - avant d'accepter des requêtes (défaut)
+#   'background' - dans un thread au démarrage; les routes de prédiction répondent 503 d'ici là
+#   'lazy'       - à la première requête de prédiction
+MODEL_LOADING = os.environ.get('MODEL_LOADING', 'eager')
+
+# Après un échec de chargement en mode background ou lazy, nouvelle tentative après
+# MODEL_LOAD_BACKOFF secondes, délai doublé à chaque échec jusqu'à MODEL_LOAD_BACKOFF_MAX.
+# MODEL_LOAD_RETRIES limite le nombre de nouvelles tentatives (-1: sans limite).
+MODEL_LOAD_RETRIES = int(os.environ.get('MODEL_LOAD_RETRIES', '-1'))
+MODEL_LOAD_BACKOFF = float(os.environ.get('MODEL_LOAD_BACKOFF', '1'))
+MODEL_LOAD_BACKOFF_MAX = float(os.environ.get('MODEL_LOAD_BACKOFF_MAX', '60'))
+
+# Rechargement des modèles d'images par POST /admin/models/reload, avec l'en-tête
+# Authorization: Bearer <ADMIN_TOKEN>. Sans ADMIN_TOKEN, la route est désactivée.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Routes qui ont besoin des modèles chargés
+MODEL_ENDPOINTS = (
+    'predict_aqi_handler', 'predict_aqi_batch_handler',
+    'predict_image_handler', 'predict_image_batch_handler', 'predict_image_raw_handler',
+    'predict_url_handler', 'predict_url_batch_handler',
+    'aqi_history_cities_handler', 'aqi_history_readings_handler', 'aqi_history_aggregate_handler'
+)
+
+models_loaded = threading.Event()
+_models_lock = threading.Lock()
+# Tentatives de chargement et échéance (time.monotonic) de la prochaine, None si aucune
+model_load = {'attempts': 0, 'retry_at': None}
+
+# Métriques par route: enregistré avant require_models pour compter aussi les réponses 503
+@app.before_request
+def start_request_metrics():
+    if metrics.METRICS_ENABLED:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.request_tracker = metrics.RequestTracker(route, request.method)
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    tracker = g.pop('request_tracker', None)
+    if tracker is not None:
+        tracker.done(g.pop('response_status', 500))
+
+# Tant que les modèles ne sont pas prêts, les routes de prédiction répondent 503
+@app.before_request
+def require_models():
+    if request.endpoint not in MODEL_ENDPOINTS or ensure_models_loaded():
+        return None
+    response = jsonify({'error': 'Models are loading, retry later'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 # CORS headers pour permettre les requêtes depuis le navigateur
 @app.after_request
 def after_request(response):
@@ -33,8 +117,20 @@ def index():
     <p>Available endpoints:</p>
     <ul>
         <li><strong>POST /image</strong> - Classify air quality from sky images</li>
+        <li><strong>POST /image/batch</strong> - Classify several sky images (multiple imageData parts)</li>
+        <li><strong>POST /image/raw</strong> - Classify a frame already at the model input size (raw RGB uint8 bytes, or PNG/JPEG of that size)</li>
         <li><strong>POST /predict-aqi</strong> - Predict AQI from pollution data</li>
+        <li><strong>POST /predict-aqi/batch</strong> - Predict AQI for a JSON array, NDJSON stream, packed float32 rows, MessagePack or Arrow IPC stream of readings</li>
         <li><strong>POST /url</strong> - Classify air quality from image URL</li>
+        <li><strong>POST /url/batch</strong> - Classify several image URLs, downloaded concurrently</li>
+        <li><strong>GET /aqi/history</strong> - Cities in the AQI history index</li>
+        <li><strong>GET /aqi/history/&lt;city&gt;/aggregate?window=24h&amp;window=7d</strong> - Rolling AQI mean, max and category counts</li>
+        <li><strong>GET /models</strong> - Image model versions published in the registry</li>
+        <li><strong>POST /admin/models/reload</strong> - Reload image models from disk (requires ADMIN_TOKEN)</li>
+        <li><strong>GET /aqi/shadow</strong> - Shadow evaluation of a secondary AQI model: disagreement and latency per model</li>
+        <li><strong>GET /ready</strong> - Readiness: model load status and load time</li>
+        <li><strong>GET /metrics</strong> - Prometheus metrics: per-route latency, per-stage timings, model load</li>
+        <li><strong>GET /stats</strong> - Serving statistics (micro-batching, interpreter pool, prediction caches)</li>
     </ul>
     '''
 
@@ -44,13 +140,20 @@ def index():
 def predict_aqi_handler():
     """
     Endpoint pour prédire l'AQI à partir de données de pollution
-    Attend un JSON avec les champs: co, no, no2, o3, so2, pm2_5, pm10, nh3
+    Attend un JSON (ou MessagePack) avec les champs: co, no, no2, o3, so2, pm2_5, pm10, nh3,
+    ou une ligne float32 packée (application/octet-stream) / un flux Arrow IPC d'une ligne
     """
     try:
+        if request.mimetype == OCTET_STREAM or request.mimetype in ARROW_STREAM_TYPES:
+            return _predict_aqi_columnar(single=True)
+
         # Vérifier le Content-Type
-        if not request.is_json:
+        if request.mimetype in MSGPACK_TYPES:
+            pollution_data = msgpack_loads(request.get_data())
+        elif not request.is_json:
             return jsonify({
                 'error': 'Content-Type must be application/json',
+                'accepted_content_types': _ACCEPTED_CONTENT_TYPES,
                 'expected_format': {
                     'co': 'number',
                     'no': 'number', 
@@ -62,14 +165,22 @@ def predict_aqi_handler():
                     'nh3': 'number'
                 }
             }), 400
-
-        pollution_data = request.get_json()
+        else:
+            pollution_data = request.get_json()
         
         if not pollution_data:
             return jsonify({'error': 'No JSON data provided'}), 400
+        if not isinstance(pollution_data, dict):
+            return jsonify({'error': 'Expected a JSON object with the pollution data'}), 400
 
-        # Validation des données
-        validation_errors = validate_pollution_data(pollution_data)
+        # Validation et conversion en vecteur de features, en une passe
+        with metrics.aqi_stage('validate'):
+            values, validation_errors = parse_reading(pollution_data)
+            try:
+                # Avec un champ city (et date optionnelle), le relevé est ajouté à l'historique
+                timestamp = timeseries.reading_timestamp(pollution_data)
+            except ValueError as e:
+                validation_errors.append(str(e))
         if validation_errors:
             return jsonify({
                 'error': 'Invalid input data',
@@ -77,13 +188,24 @@ def predict_aqi_handler():
             }), 400
 
         # Prédiction
-        results = predict_aqi(pollution_data)
+        start = time.perf_counter()
+        results = predict_aqi(pollution_data, values=values, compact=_compact_requested())
+        # Copie échantillonnée pour le modèle en ombre, notée hors du chemin de la réponse
+        aqi_shadow.submit(values, results['predicted_aqi'], time.perf_counter() - start)
+        if timestamp is not None:
+            # False quand l'enregistrement est désactivé: le relevé n'est pas perdu en silence
+            results['history_recorded'] = timeseries.record_reading(pollution_data, results, timestamp)
         
         # Log de la prédiction réussie
         app.logger.info(f"AQI prediction successful: AQI={results['predicted_aqi']}, Category={results['aqi_category']}")
         
-        return jsonify(results)
+        with metrics.aqi_stage('serialize'):
+            return _document_response(results)
         
+    except UnsupportedFormat as e:
+        return jsonify({'error': str(e)}), 415
+    except InvalidBody as e:
+        return jsonify({'error': 'Invalid input data', 'message': str(e)}), 400
     except Exception as e:
         app.logger.error(f'Error in AQI prediction: {str(e)}')
         return jsonify({
@@ -91,6 +213,193 @@ def predict_aqi_handler():
             'message': str(e)
         }), 500
 
+def _document_response(payload):
+    """Réponse dans le format de la requête: MessagePack si le corps l'était, JSON sinon"""
+    if request.mimetype in MSGPACK_TYPES:
+        return Response(msgpack_dumps(payload), mimetype=request.mimetype)
+    return jsonify(payload)
+
+def _predict_aqi_columnar(single):
+    """
+    Relevés en lignes float32 packées (colonnes dans l'ordre de REQUIRED_FEATURES) ou en Arrow IPC:
+    lus sans copie ni objet Python par relevé, scorés en un appel vectorisé, sans historique ni cache.
+    Réponse dans le même format: lignes float32 [predicted_aqi, code de catégorie], ou colonnes
+    Arrow predicted_aqi et aqi_category. Un relevé invalide reçoit NaN (null en Arrow).
+    """
+    with metrics.aqi_stage('validate'):
+        body = request.get_data()
+        if request.mimetype == OCTET_STREAM:
+            X = unpack_float32_rows(body, len(REQUIRED_FEATURES))
+        else:
+            X = arrow_read_columns(body, REQUIRED_FEATURES)
+    if len(X) == 0:
+        return jsonify({'error': 'No readings provided'}), 400
+    if single and len(X) != 1:
+        return jsonify({'error': f'Expected exactly one reading, got {len(X)} (use /predict-aqi/batch)'}), 400
+
+    aqi_values, codes = predict_aqi_matrix(X)
+    invalid = int(np.isnan(aqi_values).sum())
+
+    with metrics.aqi_stage('serialize'):
+        if request.mimetype == OCTET_STREAM:
+            body = pack_float32_rows([aqi_values, codes])
+        else:
+            labels = np.where(np.isnan(aqi_values), None, CATEGORY_LABELS[codes])
+            body = arrow_write_columns({'predicted_aqi': aqi_values, 'aqi_category': labels})
+    response = Response(body, mimetype=request.mimetype)
+    response.headers['X-AQI-Readings'] = str(len(X))
+    response.headers['X-AQI-Invalid-Readings'] = str(invalid)
+    return response
+
+def _compact_requested():
+    """Réponse compacte demandée par ?compact=1 (défaut: AQI_COMPACT_RESPONSES)"""
+    compact = request.args.get('compact')
+    if compact is None:
+        return AQI_COMPACT_RESPONSES
+    return compact.lower() in ('1', 'true', 'yes')
+
+def _parse_ndjson_readings(body):
+    """Découpe un corps NDJSON en relevés; les lignes invalides deviennent des erreurs par élément"""
+    readings = []
+    parse_errors = {}
+    for line in body.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            readings.append(json.loads(line))
+        except ValueError as e:
+            parse_errors[len(readings)] = f'Invalid JSON line: {str(e)}'
+            readings.append(None)
+    return readings, parse_errors
+
+# Prédiction AQI par lot: un seul passage scaler + modèle pour tous les relevés
+@app.route('/predict-aqi/batch', methods=['POST'])
+def predict_aqi_batch_handler():
+    """
+    Endpoint pour prédire l'AQI sur un lot de relevés
+    Attend un tableau JSON (ou MessagePack) d'objets, un flux NDJSON (un objet par ligne),
+    des lignes float32 packées (application/octet-stream) ou un flux Arrow IPC
+    Les erreurs sont rapportées par relevé sans faire échouer le lot
+    """
+    try:
+        if request.mimetype == OCTET_STREAM or request.mimetype in ARROW_STREAM_TYPES:
+            return _predict_aqi_columnar(single=False)
+
+        parse_errors = {}
+        if request.mimetype in MSGPACK_TYPES:
+            readings = msgpack_loads(request.get_data())
+        elif request.mimetype in NDJSON_CONTENT_TYPES:
+            readings, parse_errors = _parse_ndjson_readings(request.get_data().decode('utf-8'))
+        elif request.is_json:
+            readings = request.get_json()
+        else:
+            return jsonify({
+                'error': 'Content-Type must be application/json or application/x-ndjson',
+                'accepted_content_types': _ACCEPTED_CONTENT_TYPES,
+                'expected_format': '[{"co": number, "no": number, ...}, ...]'
+            }), 400
+
+        if not isinstance(readings, list):
+            return jsonify({'error': 'Expected a JSON array of readings'}), 400
+
+        if not readings:
+            return jsonify({'error': 'No readings provided'}), 400
+
+        if len(readings) > MAX_AQI_BATCH_SIZE:
+            return jsonify({
+                'error': f'Too many readings in batch (max {MAX_AQI_BATCH_SIZE})'
+            }), 413
+
+        results = predict_aqi_batch(readings, compact=_compact_requested())
+
+        # Les relevés avec une ville sont ajoutés à l'historique; une date invalide est une erreur du relevé
+        for i, (reading, result) in enumerate(zip(readings, results)):
+            if 'error' in result:
+                continue
+            try:
+                timestamp = timeseries.reading_timestamp(reading)
+            except ValueError as e:
+                results[i] = {'index': i, 'error': 'Invalid input data', 'validation_errors': [str(e)]}
+                continue
+            if timestamp is not None:
+                result['history_recorded'] = timeseries.record_reading(reading, result, timestamp)
+
+        # Les lignes NDJSON illisibles gardent leur erreur de parsing
+        for i, message in parse_errors.items():
+            results[i] = {'index': i, 'error': message}
+
+        failed = sum(1 for result in results if 'error' in result)
+        app.logger.info(f"AQI batch prediction: {len(results) - failed} succeeded, {failed} failed")
+
+        with metrics.aqi_stage('serialize'):
+            return _document_response({
+                'count': len(results),
+                'succeeded': len(results) - failed,
+                'failed': failed,
+                'results': results
+            })
+
+    except UnsupportedFormat as e:
+        return jsonify({'error': str(e)}), 415
+    except InvalidBody as e:
+        return jsonify({'error': 'Invalid input data', 'message': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f'Error in AQI batch prediction: {str(e)}')
+        return jsonify({
+            'error': 'Error processing pollution data',
+            'message': str(e)
+        }), 500
+
+# Historique par ville: relevés du dataset et relevés reçus par /predict-aqi
+@app.route('/aqi/history', methods=['GET'])
+def aqi_history_cities_handler():
+    timeseries.ensure_history_loaded()
+    cities = timeseries.history_index.cities()
+    return jsonify({'count': len(cities), 'recording': timeseries.recording_enabled(), 'cities': cities})
+
+def _history_time_arg(name):
+    value = request.args.get(name)
+    return timeseries.parse_timestamp(value) if value else None
+
+@app.route('/aqi/history/<city>', methods=['GET'])
+def aqi_history_readings_handler(city):
+    """Relevés d'une ville entre start et end (exclu, inclus), au plus limit (les plus récents)"""
+    try:
+        start = _history_time_arg('start')
+        end = _history_time_arg('end')
+        limit = int(request.args.get('limit', '1000'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    timeseries.ensure_history_loaded()
+    readings = timeseries.history_index.readings(city, start=start, end=end, limit=max(limit, 0))
+    if readings is None:
+        return jsonify({'error': f'Unknown city: {city}'}), 404
+    return jsonify({'city': city, 'count': len(readings), 'readings': readings})
+
+@app.route('/aqi/history/<city>/aggregate', methods=['GET'])
+def aqi_history_aggregate_handler(city):
+    """
+    Agrégats glissants (moyenne, maximum, comptes par catégorie) sur une ou plusieurs fenêtres
+    ?window=24h&window=7d, se terminant à end (défaut: dernier relevé de la ville)
+    """
+    timeseries.ensure_history_loaded()
+    try:
+        windows = request.args.getlist('window') or list(timeseries.DEFAULT_WINDOWS)
+        aggregates = timeseries.history_index.aggregate(city, windows, end=_history_time_arg('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if aggregates is None:
+        return jsonify({'error': f'Unknown city: {city}'}), 404
+    return jsonify(aggregates)
+
+# Évaluation en ombre: écart entre le modèle secondaire et le modèle principal, latence par modèle
+@app.route('/aqi/shadow', methods=['GET'])
+def aqi_shadow_handler():
+    return jsonify(aqi_shadow.get_shadow_report())
+
 # Route pour obtenir des informations sur les modèles
 @app.route('/models/info', methods=['GET'])
 def models_info():
@@ -101,13 +410,15 @@ def models_info():
                 'description': 'Classifies air quality from sky images',
                 'input': 'Image file (jpg, png, etc.)',
                 'output': 'Air quality classification (GOOD, MODERATE, etc.)',
-                'endpoint': '/image'
+                'endpoint': '/image',
+                'batch_endpoint': '/image/batch'
             },
             'aqi_predictor': {
                 'description': 'Predicts AQI from pollution measurements',
                 'input': 'JSON with pollution data (co, no, no2, o3, so2, pm2_5, pm10, nh3)',
                 'output': 'Numerical AQI value and category',
-                'endpoint': '/predict-aqi'
+                'endpoint': '/predict-aqi',
+                'batch_endpoint': '/predict-aqi/batch'
             }
         },
         'pollution_parameters': {
@@ -122,6 +433,81 @@ def models_info():
         }
     })
 
+# Versions des modèles d'images publiées dans le registre
+@app.route('/models', methods=['GET'])
+def models_registry_handler():
+    return jsonify(get_models_info())
+
+# Rechargement atomique d'un modèle publié (ou de tous) depuis le disque: les requêtes en cours
+# terminent sur l'ancienne version. Avec plusieurs workers, seul celui qui reçoit la requête
+# recharge; MODEL_WATCH_INTERVAL recharge dans chaque worker.
+@app.route('/admin/models/reload', methods=['POST'])
+@app.route('/admin/models/<name>/reload', methods=['POST'])
+def reload_models_handler(name=None):
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled (set ADMIN_TOKEN)'}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {ADMIN_TOKEN}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not models_loaded.is_set():
+        return jsonify({'error': 'Models are loading, retry later'}), 503
+
+    try:
+        reloaded = reload_models(name)
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        # Le modèle en service reste en place
+        app.logger.error(f"Model reload failed: {e}")
+        return jsonify({'error': f'Reload failed: {e}', 'registry': get_models_info()}), 500
+    return jsonify({'reloaded': reloaded, 'registry': get_models_info()})
+
+# Readiness probe: 200 once both models are loaded, 503 before (and while either one failed)
+@app.route('/ready', methods=['GET'])
+def ready():
+    image_state = get_load_state()
+    aqi_state = get_aqi_load_state()
+    if MODEL_LOADING == 'lazy' and not models_loaded.is_set():
+        # Chargés à la première requête: le serveur peut déjà recevoir du trafic
+        is_ready = 'failed' not in (image_state['status'], aqi_state['status'])
+    else:
+        is_ready = models_loaded.is_set() and image_state['status'] == aqi_state['status'] == 'ready'
+    retry_at = model_load['retry_at']
+    return jsonify({
+        'ready': is_ready,
+        'model_loading': MODEL_LOADING,
+        'load_attempts': model_load['attempts'],
+        'next_retry_seconds': None if retry_at is None else round(max(retry_at - time.monotonic(), 0), 3),
+        'models': {
+            'image_classifier': image_state,
+            'aqi_predictor': aqi_state
+        }
+    }), 200 if is_ready else 503
+
+# Runtime statistics of the serving pipeline
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'image_batching': get_batching_stats(),
+        'predictor_pool': get_pool_stats(),
+        'image_cache': get_cache_stats(),
+        'aqi_cache': get_aqi_cache_stats(),
+        'url_fetch': get_fetch_stats(),
+        'aqi_history': timeseries.history_index.stats()
+    })
+
+def _collect_model_metrics():
+    for model, state in (('image_classifier', get_load_state()), ('aqi_predictor', get_aqi_load_state())):
+        metrics.MODEL_READY.labels(model).set(1 if state['status'] == 'ready' else 0)
+        if state['load_seconds'] is not None:
+            metrics.MODEL_LOAD_SECONDS.labels(model).set(state['load_seconds'])
+
+metrics.REGISTRY.add_collector(_collect_model_metrics)
+
+# Prometheus: latence et nombre de requêtes par route, durée de chaque étape, chargement des modèles
+@app.route('/metrics', methods=['GET'])
+def metrics_handler():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # Like the CustomVision.ai Prediction service /image route handles either
 #     - octet-stream image file
 #     - a multipart/form-data with files in the imageData parameter
@@ -134,19 +520,69 @@ def models_info():
 @app.route('/<project>/detect/iterations/<publishedName>/image/nostore', methods=['POST'])
 def predict_image_handler(project=None, publishedName=None):
     try:
-        imageData = None
+        # Raw bytes go through the prediction cache, keyed by their hash
         if ('imageData' in request.files):
-            imageData = request.files['imageData']
+            results = predict_image_bytes(request.files['imageData'].read(), publishedName)
         elif ('imageData' in request.form):
-            imageData = request.form['imageData']
+            img = Image.open(request.form['imageData'])
+            results = predict_image(img, publishedName)
+        else:
+            results = predict_image_bytes(request.get_data(), publishedName)
+
+        with metrics.image_stage('serialize'):
+            return jsonify(results)
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        app.logger.error(f'Error in image prediction: {str(e)}')
+        return 'Error processing image', 500
+
+
+# Pre-resized variant of the /image route for clients that already produce
+# frames at the model input size: either input_size x input_size x 3 raw RGB
+# uint8 bytes, or a PNG/JPEG of exactly that size. EXIF handling, resize and
+# crop are skipped; any other size is rejected with the expected shape.
+@app.route('/image/raw', methods=['POST'])
+@app.route('/<project>/classify/iterations/<publishedName>/image/raw', methods=['POST'])
+def predict_image_raw_handler(project=None, publishedName=None):
+    try:
+        if ('imageData' in request.files):
+            results = predict_image_raw(request.files['imageData'].read(), publishedName)
         else:
-            imageData = io.BytesIO(request.get_data())
+            results = predict_image_raw(request.get_data(), publishedName)
 
-        img = Image.open(imageData)
-        results = predict_image(img)
-        return jsonify(results)
+        with metrics.image_stage('serialize'):
+            return jsonify(results)
+    except InputShapeError as e:
+        return jsonify({'error': str(e), 'expected_shape': get_input_shape(publishedName)}), 400
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
-        print('EXCEPTION:', str(e))
+        app.logger.error(f'Error in raw image prediction: {str(e)}')
+        return 'Error processing image', 500
+
+
+# Batch variant of the /image route: a multipart/form-data request with
+# several files in the imageData parameter, classified together
+@app.route('/image/batch', methods=['POST'])
+@app.route('/<project>/classify/iterations/<publishedName>/image/batch', methods=['POST'])
+def predict_image_batch_handler(project=None, publishedName=None):
+    try:
+        files = request.files.getlist('imageData')
+        if not files:
+            return jsonify({'error': 'Expected one or more imageData files'}), 400
+
+        # Images that cannot be decoded are reported without failing the batch
+        results = predict_image_bytes_batch([imageData.read() for imageData in files], publishedName)
+        for i, result in enumerate(results):
+            result['index'] = i
+
+        with metrics.image_stage('serialize'):
+            return jsonify({'count': len(results), 'results': results})
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        app.logger.error(f'Error in image batch prediction: {str(e)}')
         return 'Error processing image', 500
 
 
@@ -163,25 +599,130 @@ def predict_image_handler(project=None, publishedName=None):
 def predict_url_handler(project=None, publishedName=None):
     try:
         image_url = json.loads(request.get_data().decode('utf-8'))['url']
-        results = predict_url(image_url)
-        return jsonify(results)
+        results = predict_url(image_url, publishedName)
+        with metrics.image_stage('serialize'):
+            return jsonify(results)
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
-        print('EXCEPTION:', str(e))
+        app.logger.error(f'Error in URL prediction: {str(e)}')
         return 'Error processing image'
 
 
+# Batch variant of the /url route, with a body of the form:
+#     { 'urls': ['<http url>', ...] }
+# The images are downloaded concurrently, then classified together
+@app.route('/url/batch', methods=['POST'])
+@app.route('/<project>/classify/iterations/<publishedName>/url/batch', methods=['POST'])
+def predict_url_batch_handler(project=None, publishedName=None):
+    try:
+        image_urls = json.loads(request.get_data().decode('utf-8')).get('urls')
+        if not isinstance(image_urls, list) or not image_urls or not all(isinstance(url, str) for url in image_urls):
+            return jsonify({'error': 'Expected a JSON object with a non-empty "urls" array'}), 400
+        if len(image_urls) > MAX_URL_BATCH_SIZE:
+            return jsonify({'error': f'Too many URLs in batch (max {MAX_URL_BATCH_SIZE})'}), 413
+
+        # URLs that cannot be fetched or decoded are reported without failing the batch
+        results = predict_url_batch(image_urls, publishedName)
+        for i, result in enumerate(results):
+            result['index'] = i
+
+        with metrics.image_stage('serialize'):
+            return jsonify({'count': len(results), 'results': results})
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        app.logger.error(f'Error in URL batch prediction: {str(e)}')
+        return 'Error processing image', 500
+
+
+def initialize_models():
+    """
+    Charge les modèles dans le processus courant. Avec un serveur pre-fork, à appeler
+    dans chaque worker après le fork: les interpréteurs TFLite et les threads du
+    micro-batching ne survivent pas à un fork. Un modèle AQI déjà chargé avant le fork
+    (preload) est conservé, ses pages restent partagées en copy-on-write.
+    """
+    # Load and intialize the image classification model (kept if only the AQI model failed last time)
+    if get_load_state()['status'] != 'ready':
+        initialize()
+
+    # Load and initialize the AQI prediction model; a failure is retried like any other (_load_models_once)
+    aqi_model_loaded = is_aqi_model_loaded() or initialize_aqi_model()
+    if not aqi_model_loaded:
+        raise RuntimeError(f"AQI model could not be loaded: {get_aqi_load_state()['error']}")
+    logging.info("AQI model loaded successfully")
+
+    # Évaluation en ombre d'un modèle AQI secondaire (AQI_SHADOW_MODEL_PATH), threads propres au worker
+    aqi_shadow.initialize_shadow()
+
+    # Historique par ville, scoré par le modèle AQI dans un thread: ni le démarrage ni la première
+    # prédiction ne l'attendent, seules les routes /aqi/history (timeseries.ensure_history_loaded)
+    timeseries.start_history_loading()
+    return True
+
+
+def _load_models_once(raise_errors=True):
+    """
+    Charge les modèles s'ils ne le sont pas encore. Sans raise_errors (modes background et
+    lazy), un échec est journalisé et la tentative suivante planifiée: d'ici là, False.
+    """
+    with _models_lock:
+        if models_loaded.is_set():
+            return True
+        retry_at = model_load['retry_at']
+        if model_load['attempts'] and (retry_at is None or time.monotonic() < retry_at):
+            return False
+        model_load['attempts'] += 1
+        try:
+            initialize_models()
+        except Exception as e:
+            _schedule_model_retry(e)
+            if raise_errors:
+                raise
+            return False
+        model_load['retry_at'] = None
+        models_loaded.set()
+        return True
+
+
+def _schedule_model_retry(error):
+    attempts = model_load['attempts']
+    if 0 <= MODEL_LOAD_RETRIES < attempts:
+        model_load['retry_at'] = None
+        app.logger.error(f"Model loading failed after {attempts} attempts, giving up: {error}")
+        return
+    delay = min(MODEL_LOAD_BACKOFF * 2 ** (attempts - 1), MODEL_LOAD_BACKOFF_MAX)
+    model_load['retry_at'] = time.monotonic() + delay
+    app.logger.error(f"Model loading failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+
+
+def _load_models_in_background():
+    while not _load_models_once(raise_errors=False) and model_load['retry_at'] is not None:
+        time.sleep(max(model_load['retry_at'] - time.monotonic(), 0))
+
+
+def ensure_models_loaded():
+    """True si les modèles sont prêts; en mode lazy, les charge au premier appel (puis après chaque délai de reprise)"""
+    if models_loaded.is_set():
+        return True
+    if MODEL_LOADING == 'lazy':
+        _load_models_once(raise_errors=False)
+    return models_loaded.is_set()
+
+
+def start_model_loading():
+    """Point d'entrée du démarrage (par processus): charge les modèles selon MODEL_LOADING"""
+    if MODEL_LOADING == 'background':
+        threading.Thread(target=_load_models_in_background, name='model-loader', daemon=True).start()
+    elif MODEL_LOADING != 'lazy':
+        _load_models_once()
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
 
-    # Load and intialize the image classification model
-    initialize()
-    
-    # Load and initialize the AQI prediction model
-    aqi_model_loaded = initialize_aqi_model()
-    if not aqi_model_loaded:
-        logging.warning("AQI model could not be loaded. AQI prediction will not be available.")
-    else:
-        logging.info("AQI model loaded successfully")
+    start_model_loading()
 
-    # Run the server
-    app.run(host='0.0.0.0', port=80)
\ No newline at end of file
+    # Run the development server (see gunicorn.conf.py and asgi.py for production serving)
+    app.run(host='0.0.0.0', port=80)
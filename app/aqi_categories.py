@@ -0,0 +1,66 @@
+import bisect
+
+import numpy as np
+
+# Catégories AQI, de la meilleure à la pire. Une valeur appartient à la première catégorie
+# dont la borne supérieure (incluse) est >= à la valeur: 50 est GOOD, 50.5 est MODERATE.
+CATEGORY_NAMES = ('GOOD', 'MODERATE', 'UNHEALTHY_SENSITIVE_GROUP', 'UNHEALTHY', 'VERY_UNHEALTHY', 'SEVERE')
+CATEGORY_UPPER_BOUNDS = (50.0, 100.0, 150.0, 200.0, 300.0)
+
+# Valeur négative ou NaN
+UNKNOWN = 'UNKNOWN'
+UNKNOWN_CODE = len(CATEGORY_NAMES)
+
+# Tous les libellés, indexés par code (le code UNKNOWN en dernier)
+CATEGORY_LABELS = np.array(CATEGORY_NAMES + (UNKNOWN,), dtype=object)
+CATEGORY_CODES = {name: code for code, name in enumerate(CATEGORY_LABELS)}
+
+_BOUNDS = np.array(CATEGORY_UPPER_BOUNDS)
+
+# Sous-indices par polluant: concentration * facteur, bornée à [0, SUB_INDEX_MAX].
+# L'AQI estimé est le maximum des sous-indices (comme dans le vrai calcul AQI).
+SUB_INDEX_FACTORS = {'pm2_5': 2.0, 'pm10': 1.5, 'no2': 2.0, 'o3': 1.2}
+SUB_INDEX_MAX = 300.0
+
+
+def category_codes(values):
+    """Code de catégorie (int8) de chaque valeur AQI, par recherche dichotomique dans les bornes"""
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.searchsorted(_BOUNDS, values, side='left').astype(np.int8)
+    codes[~(values >= 0)] = UNKNOWN_CODE
+    return codes
+
+
+def categories(values):
+    """Libellé de catégorie de chaque valeur AQI (tableau d'objets str)"""
+    return CATEGORY_LABELS[category_codes(values)]
+
+
+def category(value):
+    """Libellé de catégorie d'une seule valeur AQI (sans passer par NumPy)"""
+    value = float(value)
+    if not value >= 0:
+        return UNKNOWN
+    return CATEGORY_NAMES[bisect.bisect_left(CATEGORY_UPPER_BOUNDS, value)]
+
+
+def sub_indices(X, feature_names):
+    """
+    Sous-indices par polluant pour une matrice de relevés (une colonne par feature, dans
+    l'ordre de feature_names): matrice float64 (n_lignes, len(SUB_INDEX_FACTORS))
+    """
+    X = np.asarray(X)
+    columns = [feature_names.index(feature) for feature in SUB_INDEX_FACTORS]
+    factors = np.array(list(SUB_INDEX_FACTORS.values()))
+    return np.clip(X[:, columns].astype(np.float64) * factors, 0, SUB_INDEX_MAX)
+
+
+def estimated_aqi(X, feature_names):
+    """AQI estimé de chaque relevé: le maximum de ses sous-indices"""
+    return sub_indices(X, feature_names).max(axis=1)
+
+
+def dominant_pollutants(X, feature_names):
+    """Polluant dont le sous-indice détermine l'AQI estimé, pour chaque relevé"""
+    names = np.array(list(SUB_INDEX_FACTORS), dtype=object)
+    return names[sub_indices(X, feature_names).argmax(axis=1)]
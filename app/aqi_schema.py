@@ -0,0 +1,75 @@
+import collections
+import math
+
+import numpy as np
+
+# Règles de validation des relevés, déclarées comme données: bornes incluses, None pour
+# « sans borne ». label est le nom utilisé dans le message « ... value seems too high ».
+Rule = collections.namedtuple('Rule', ('minimum', 'maximum', 'label'))
+
+FEATURE_RULES = {
+    'co': Rule(0.0, 10000.0, 'CO'),
+    'no': Rule(0.0, None, 'no'),
+    'no2': Rule(0.0, None, 'no2'),
+    'o3': Rule(0.0, None, 'o3'),
+    'so2': Rule(0.0, None, 'so2'),
+    'pm2_5': Rule(0.0, 1000.0, 'pm2_5'),
+    'pm10': Rule(0.0, 1000.0, 'pm10'),
+    'nh3': Rule(0.0, None, 'nh3'),
+}
+
+
+class ReadingSchema:
+    """
+    Schéma compilé pour un ordre de features: convertit un relevé JSON en vecteur de floats
+    dans l'ordre du modèle et vérifie les bornes, en une seule passe. Les messages d'erreur
+    détaillés ne sont construits que pour les relevés rejetés.
+    """
+
+    def __init__(self, feature_names, rules=FEATURE_RULES):
+        self.feature_names = tuple(feature_names)
+        self.rules = tuple(rules[feature] for feature in self.feature_names)
+        self._bounds = tuple(
+            (rule.minimum if rule.minimum is not None else -math.inf,
+             rule.maximum if rule.maximum is not None else math.inf)
+            for rule in self.rules
+        )
+        self.minimums = np.array([low for low, _ in self._bounds])
+        self.maximums = np.array([high for _, high in self._bounds])
+
+    def parse(self, data):
+        """(valeurs, []) pour un relevé valide, (None, erreurs) sinon"""
+        try:
+            values = [float(data[feature]) for feature in self.feature_names]
+        except (KeyError, IndexError, TypeError, ValueError):
+            return None, self.errors(data)
+        for value, (low, high) in zip(values, self._bounds):
+            # NaN échoue à la comparaison; l'infini est rejeté aussi pour les features sans borne
+            if not low <= value <= high or value in (math.inf, -math.inf):
+                return None, self.errors(data)
+        return values, []
+
+    def errors(self, data):
+        """Tous les messages d'erreur d'un relevé (liste vide s'il est valide)"""
+        errors = []
+        for feature, rule in zip(self.feature_names, self.rules):
+            if feature not in data:
+                errors.append(f"Missing feature: {feature}")
+                continue
+            try:
+                value = float(data[feature])
+            except (ValueError, TypeError):
+                errors.append(f"Invalid numeric value for {feature}: {data[feature]}")
+                continue
+            if not math.isfinite(value):
+                errors.append(f"Invalid numeric value for {feature}: {value}")
+            elif rule.minimum is not None and value < rule.minimum:
+                errors.append(f"Negative value for {feature}: {value}" if rule.minimum == 0
+                              else f"{rule.label} value below {rule.minimum}: {value}")
+            elif rule.maximum is not None and value > rule.maximum:
+                errors.append(f"{rule.label} value seems too high: {value}")
+        return errors
+
+    def invalid_rows(self, X):
+        """Masque des lignes d'une matrice (colonnes dans l'ordre du schéma) que parse rejetterait: hors bornes, NaN ou infini"""
+        return (~np.isfinite(X) | (X < self.minimums) | (X > self.maximums)).any(axis=1)
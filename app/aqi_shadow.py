@@ -0,0 +1,329 @@
+"""
+Évaluation en ombre d'un modèle AQI secondaire sur le trafic réel de /predict-aqi.
+
+Une fraction des relevés (AQI_SHADOW_SAMPLE_RATE) est copiée, avec l'AQI renvoyé par le modèle
+principal, dans une file bornée. Des threads en arrière-plan les notent par lots avec le modèle
+secondaire et enregistrent l'écart entre les deux AQI, l'accord des catégories et la latence de
+chaque modèle. Sur le chemin de la réponse, il ne reste qu'un tirage aléatoire et un put_nowait:
+file pleine, le relevé est abandonné (et compté), jamais attendu.
+
+Le modèle secondaire est un fichier joblib/pickle:
+  - un model.pkl AutoML, appelé comme run() de aqi_model/scoring_file_v_2_0_0.py (predict sur un
+    DataFrame aux colonnes co..nh3); son chargement demande les paquets azureml du conda_env;
+  - ou un artefact simple_model.pkl de train_aqi.py (modèle + scaler), pour comparer deux
+    RandomForest.
+"""
+
+import collections
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import aqi_categories
+import metrics
+import predict_aqi
+
+logger = logging.getLogger(__name__)
+
+AQI_SHADOW_MODEL_PATH = os.environ.get('AQI_SHADOW_MODEL_PATH', '')
+AQI_SHADOW_SAMPLE_RATE = float(os.environ.get('AQI_SHADOW_SAMPLE_RATE', '0.1'))
+AQI_SHADOW_WORKERS = int(os.environ.get('AQI_SHADOW_WORKERS', '1'))
+AQI_SHADOW_QUEUE_SIZE = int(os.environ.get('AQI_SHADOW_QUEUE_SIZE', '1000'))
+# Relevés notés ensemble par le modèle secondaire: un lot part à AQI_SHADOW_BATCH_SIZE relevés, ou
+# AQI_SHADOW_MAX_WAIT_MS après son premier relevé. Peu de réveils, et le coût fixe d'un appel au
+# modèle (validation sklearn, DataFrame) est partagé par tout le lot au lieu d'être payé par relevé.
+AQI_SHADOW_BATCH_SIZE = int(os.environ.get('AQI_SHADOW_BATCH_SIZE', '64'))
+AQI_SHADOW_MAX_WAIT_MS = float(os.environ.get('AQI_SHADOW_MAX_WAIT_MS', '250'))
+# Écarts récents conservés pour les quantiles du rapport
+AQI_SHADOW_WINDOW = int(os.environ.get('AQI_SHADOW_WINDOW', '10000'))
+# Priorité (nice) des threads d'ombre sous Linux: le planificateur sert d'abord les requêtes
+AQI_SHADOW_NICE = int(os.environ.get('AQI_SHADOW_NICE', '10'))
+
+# Ordre et types des colonnes de l'exemple d'entrée du scoring AutoML
+AUTOML_COLUMNS = ('co', 'no', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3')
+AUTOML_DTYPES = {'co': np.float64, **{column: np.float32 for column in AUTOML_COLUMNS[1:]}}
+
+shadow_scorer = None
+load_error = None
+
+
+class AutoMLModel:
+    """Modèle AutoML (model.pkl): predict sur un DataFrame typé comme data_sample du scoring"""
+
+    def __init__(self, model, name='automl'):
+        self.model = model
+        self.name = name
+
+    def predict(self, X):
+        df = pd.DataFrame({column: X[:, i].astype(AUTOML_DTYPES[column]) for i, column in enumerate(AUTOML_COLUMNS)})
+        result = self.model.predict(df)
+        if isinstance(result, pd.DataFrame):
+            result = result.values
+        return np.asarray(result, dtype=np.float64).ravel()
+
+
+class SimpleModel:
+    """Artefact de train_aqi.py (dict modèle + scaler + feature_names)"""
+
+    def __init__(self, model_data, name='simple_model'):
+        self.model = model_data['model']
+        # Pas de pool de threads joblib par appel: les lots sont petits et déjà hors du chemin de la réponse
+        self.model.n_jobs = 1
+        self.scaler = model_data['scaler']
+        self.columns = [AUTOML_COLUMNS.index(feature) for feature in model_data.get('feature_names', AUTOML_COLUMNS)]
+        self.name = name
+
+    def predict(self, X):
+        X = X[:, self.columns]
+        return np.asarray(self.model.predict((X - self.scaler.mean_) / self.scaler.scale_), dtype=np.float64)
+
+
+def load_secondary_model(path, name=None):
+    """Charge un modèle secondaire et l'adapte à predict(X float64, colonnes AUTOML_COLUMNS)"""
+    model = joblib.load(path)
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    if isinstance(model, dict) and 'model' in model and 'scaler' in model:
+        return SimpleModel(model, name)
+    return AutoMLModel(model, name)
+
+
+class ShadowScorer:
+    """
+    Note en arrière-plan une copie échantillonnée des relevés avec un modèle secondaire
+    et agrège l'écart avec le modèle principal
+    """
+
+    def __init__(self, secondary, sample_rate=0.1, workers=1, queue_size=1000, batch_size=64, max_wait_ms=250.0,
+                 window=10000, primary_name='primary', nice=0, seed=None):
+        self.secondary = secondary
+        self.nice = nice
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.primary_name = primary_name
+        self._random = random.Random(seed).random
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+        self._differences = collections.deque(maxlen=window)
+        self._primary_seconds = collections.deque(maxlen=window)
+        self._secondary_seconds = collections.deque(maxlen=window)
+        self._sum_difference = 0.0
+        self._sum_abs_difference = 0.0
+        self._max_abs_difference = 0.0
+        self._category_matches = 0
+        self._latency = {
+            role: metrics.AQI_MODEL_SECONDS.labels(model_name, role)
+            for role, model_name in (('primary', primary_name), ('shadow', secondary.name))
+        }
+        self._disagreement = metrics.AQI_SHADOW_ABS_DIFFERENCE.labels(secondary.name)
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, name=f'aqi-shadow-{i}', daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, values, feature_names, primary_aqi, primary_seconds):
+        """
+        Sur le chemin de la réponse: tirage, puis mise en file sans attente.
+        values: relevé validé, dans l'ordre de feature_names. Renvoie True si le relevé est mis en file
+        """
+        if self._random() >= self.sample_rate:
+            return False
+        try:
+            self._queue.put_nowait((values, feature_names, primary_aqi, primary_seconds))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('sampled')
+        return True
+
+    def _count(self, outcome, amount=1):
+        with self._lock:
+            self._counts[outcome] += amount
+        metrics.AQI_SHADOW_SAMPLES.labels(self.secondary.name, outcome).inc(amount)
+
+    def _next_batch(self):
+        # Comme MicroBatcher._collect: jusqu'à batch_size relevés ou max_wait après le premier
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        if self.nice:
+            try:
+                # Sous Linux, setpriority sur l'identifiant natif d'un thread ne vise que ce thread
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+            except (AttributeError, OSError) as e:
+                logger.debug(f"Could not lower shadow thread priority: {e}")
+        while True:
+            batch = self._next_batch()
+            # None: arrêt demandé par close(), après les relevés déjà en file
+            readings = [item for item in batch if item is not None]
+            if readings:
+                try:
+                    self._score(readings)
+                except Exception as e:
+                    logger.error(f"Shadow scoring with {self.secondary.name} failed: {e}")
+                    self._count('failed', len(readings))
+            if len(readings) < len(batch):
+                return
+
+    def _score(self, batch):
+        X = np.array(
+            [[values[feature_names.index(column)] for column in AUTOML_COLUMNS] for values, feature_names, _, _ in batch],
+            dtype=np.float64
+        )
+        primary = np.array([primary_aqi for _, _, primary_aqi, _ in batch])
+
+        start = time.perf_counter()
+        shadow = np.clip(self.secondary.predict(X), 0, 500)
+        per_reading = (time.perf_counter() - start) / len(batch)
+
+        differences = shadow - primary
+        matches = int((aqi_categories.category_codes(shadow) == aqi_categories.category_codes(primary)).sum())
+        with self._lock:
+            self._counts['scored'] += len(batch)
+            self._differences.extend(differences.tolist())
+            self._secondary_seconds.append(per_reading)
+            self._primary_seconds.extend(primary_seconds for _, _, _, primary_seconds in batch)
+            self._sum_difference += float(differences.sum())
+            self._sum_abs_difference += float(np.abs(differences).sum())
+            self._max_abs_difference = max(self._max_abs_difference, float(np.abs(differences).max()))
+            self._category_matches += matches
+
+        metrics.AQI_SHADOW_SAMPLES.labels(self.secondary.name, 'scored').inc(len(batch))
+        for difference in np.abs(differences).tolist():
+            self._disagreement.observe(difference)
+        for _, _, _, primary_seconds in batch:
+            self._latency['primary'].observe(primary_seconds)
+        self._latency['shadow'].observe(per_reading)
+
+    def drain(self, timeout=10.0):
+        """Attend que la file soit vide et les lots en cours notés (tests, benchmarks)"""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            with self._lock:
+                done = self._counts['scored'] + self._counts['failed'] >= self._counts['sampled']
+            if done:
+                return True
+            time.sleep(0.001)
+        return False
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    @staticmethod
+    def _latency_summary(seconds):
+        if not seconds:
+            return {'samples': 0}
+        values = np.array(seconds) * 1e6
+        return {
+            'samples': len(values),
+            'mean_us': round(float(values.mean()), 2),
+            'p50_us': round(float(np.percentile(values, 50)), 2),
+            'p95_us': round(float(np.percentile(values, 95)), 2),
+            'p99_us': round(float(np.percentile(values, 99)), 2),
+        }
+
+    def report(self):
+        with self._lock:
+            counts = dict(self._counts)
+            differences = np.array(self._differences)
+            primary_seconds = list(self._primary_seconds)
+            secondary_seconds = list(self._secondary_seconds)
+            scored = counts.get('scored', 0)
+            sums = (self._sum_difference, self._sum_abs_difference, self._max_abs_difference, self._category_matches)
+
+        disagreement = {'readings': scored}
+        if scored:
+            abs_differences = np.abs(differences)
+            disagreement.update({
+                'mean_difference': round(sums[0] / scored, 4),
+                'mean_abs_difference': round(sums[1] / scored, 4),
+                'max_abs_difference': round(sums[2], 4),
+                'category_agreement': round(sums[3] / scored, 4),
+                # Sur les AQI_SHADOW_WINDOW derniers relevés notés
+                'abs_difference_quantiles': {
+                    f'p{q}': round(float(np.percentile(abs_differences, q)), 4) for q in (50, 90, 95, 99)
+                },
+                'abs_difference_histogram': dict(zip(
+                    [f'<={bound:g}' for bound in metrics.AQI_SHADOW_DIFFERENCE_BUCKETS] + ['+Inf'],
+                    np.bincount(np.searchsorted(metrics.AQI_SHADOW_DIFFERENCE_BUCKETS, abs_differences),
+                                minlength=len(metrics.AQI_SHADOW_DIFFERENCE_BUCKETS) + 1).tolist()
+                )),
+            })
+        return {
+            'enabled': True,
+            'sample_rate': self.sample_rate,
+            'queue': {'size': self._queue.qsize(), 'capacity': self._queue.maxsize},
+            'readings': {outcome: counts.get(outcome, 0) for outcome in ('sampled', 'scored', 'dropped', 'failed')},
+            'disagreement': disagreement,
+            'latency': {
+                self.primary_name: {'role': 'primary', **self._latency_summary(primary_seconds)},
+                self.secondary.name: {'role': 'shadow', 'per_reading': True, **self._latency_summary(secondary_seconds)},
+            },
+        }
+
+
+def initialize_shadow(path=None, primary_name='random_forest'):
+    """Démarre l'évaluation en ombre si AQI_SHADOW_MODEL_PATH (ou path) désigne un modèle chargeable"""
+    global shadow_scorer, load_error
+    path = path or AQI_SHADOW_MODEL_PATH
+    if shadow_scorer is not None:
+        shadow_scorer.close()
+        shadow_scorer = None
+    if not path or AQI_SHADOW_SAMPLE_RATE <= 0:
+        return None
+    try:
+        secondary = load_secondary_model(path)
+    except Exception as e:
+        # Typiquement un model.pkl AutoML sans les paquets azureml installés
+        load_error = f"Could not load shadow model {path}: {e}"
+        logger.warning(load_error)
+        return None
+    load_error = None
+    shadow_scorer = ShadowScorer(
+        secondary,
+        sample_rate=AQI_SHADOW_SAMPLE_RATE,
+        workers=AQI_SHADOW_WORKERS,
+        queue_size=AQI_SHADOW_QUEUE_SIZE,
+        batch_size=AQI_SHADOW_BATCH_SIZE,
+        max_wait_ms=AQI_SHADOW_MAX_WAIT_MS,
+        window=AQI_SHADOW_WINDOW,
+        primary_name=primary_name,
+        nice=AQI_SHADOW_NICE
+    )
+    logger.info(f"Shadow scoring {AQI_SHADOW_SAMPLE_RATE:.0%} of /predict-aqi readings with {secondary.name}")
+    return shadow_scorer
+
+
+def submit(values, primary_aqi, primary_seconds):
+    """Chemin de la réponse de /predict-aqi (values: sortie de parse_reading); sans effet si l'ombre est désactivée"""
+    scorer = shadow_scorer
+    if scorer is not None:
+        scorer.submit(values, predict_aqi.reading_schema.feature_names, primary_aqi, primary_seconds)
+
+
+def get_shadow_report():
+    if shadow_scorer is None:
+        return {'enabled': False, 'error': load_error}
+    return shadow_scorer.report()
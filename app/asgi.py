@@ -0,0 +1,275 @@
+"""
+ASGI entry point for I/O-bound traffic:
+    WEB_CONCURRENCY=2 uvicorn asgi:app --host 0.0.0.0 --port 80    (or: python asgi.py)
+
+The worker count is given through WEB_CONCURRENCY (or SERVER_WORKERS for
+python asgi.py) rather than --workers, so the app can tell whether it runs
+in a single process (see timeseries.AQI_HISTORY_RECORD). With several
+workers, set METRICS_MULTIPROC_DIR to an empty directory so /metrics merges
+the counters of all of them, and AQI_HISTORY_JOURNAL to a file so every
+worker sees the readings recorded by the others (python asgi.py sets both).
+
+The /url routes run on the event loop: a slow remote host holds a coroutine
+instead of a server thread. Only decoding and inference go to the thread
+pool. Every other route is handed to the Flask app, called as a WSGI app in
+the same pool.
+"""
+
+import asyncio
+import functools
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import predict
+from app import MAX_URL_BATCH_SIZE, app as flask_app, ensure_models_loaded, models_loaded, start_model_loading
+from fetch import AsyncHTTPFetcher
+from model_registry import UnknownModel
+
+logger = logging.getLogger(__name__)
+fetcher = None
+
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', '2'))
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', '4'))
+
+# Same paths as the Flask /url routes; 'published' is the model's published name
+URL_ROUTE = re.compile(r'^(?:/[^/]+(?:/(?:classify|detect)/iterations/(?P<published>[^/]+))?)?/url(?:/nostore)?$')
+URL_BATCH_ROUTE = re.compile(r'^(?:/[^/]+/classify/iterations/(?P<published>[^/]+))?/url/batch$')
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type,Authorization'),
+    (b'access-control-allow-methods', b'GET,PUT,POST,DELETE,OPTIONS'),
+]
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    # Same limit as Flask's MAX_CONTENT_LENGTH, enforced before the whole body is buffered
+    body = await _read_body(scope, receive, flask_app.config.get('MAX_CONTENT_LENGTH'))
+    if body is None:
+        status, headers, payload = _json_response(413, {'error': 'Request body too large'})
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': payload})
+        return
+
+    path = scope['path']
+    loop = asyncio.get_running_loop()
+    url_route = scope['method'] == 'POST' and (URL_BATCH_ROUTE.match(path) or URL_ROUTE.match(path))
+    # The Flask routes record their own metrics
+    tracker = None
+    if url_route and metrics.METRICS_ENABLED:
+        tracker = metrics.RequestTracker('/url/batch' if URL_BATCH_ROUTE.match(path) else '/url', scope['method'])
+
+    if url_route and not models_loaded.is_set() and not await loop.run_in_executor(None, ensure_models_loaded):
+        status, headers, payload = _json_response(503, {'error': 'Models are loading, retry later'})
+        headers.append((b'retry-after', b'1'))
+    elif scope['method'] == 'POST' and URL_BATCH_ROUTE.match(path):
+        status, headers, payload = await _predict_url_batch_handler(body, URL_BATCH_ROUTE.match(path).group('published'))
+    elif scope['method'] == 'POST' and URL_ROUTE.match(path):
+        status, headers, payload = await _predict_url_handler(body, URL_ROUTE.match(path).group('published'))
+    else:
+        status, headers, payload = await loop.run_in_executor(None, _call_wsgi, scope, body)
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': payload})
+    if tracker is not None:
+        tracker.done(status)
+
+
+async def _lifespan(receive, send):
+    global fetcher
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            loop = asyncio.get_running_loop()
+            # Decoding, inference and the Flask routes share this pool
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=SERVER_THREADS, thread_name_prefix='asgi'))
+            await loop.run_in_executor(None, start_model_loading)
+            metrics.start_snapshots()
+            fetcher = AsyncHTTPFetcher(
+                connect_timeout=predict.URL_FETCH_CONNECT_TIMEOUT,
+                read_timeout=predict.URL_FETCH_READ_TIMEOUT,
+                total_timeout=predict.URL_FETCH_TOTAL_TIMEOUT,
+                max_bytes=predict.URL_FETCH_MAX_BYTES,
+                max_connections_per_host=predict.URL_FETCH_CONNECTIONS_PER_HOST
+            )
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if fetcher is not None:
+                fetcher.close()
+            if metrics.METRICS_MULTIPROC_DIR:
+                metrics.write_snapshot()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _read_body(scope, receive, max_bytes=None):
+    """The request body, or None as soon as it is known to exceed max_bytes"""
+    if max_bytes is not None:
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'content-length' and value.isdigit() and int(value) > max_bytes:
+                return None
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def _json_response(status, payload):
+    headers = [(b'content-type', b'application/json')] + CORS_HEADERS
+    return status, headers, json.dumps(payload).encode('utf-8')
+
+
+def _text_response(status, text):
+    headers = [(b'content-type', b'text/html; charset=utf-8')] + CORS_HEADERS
+    return status, headers, text.encode('utf-8')
+
+
+async def _fetch_url(image_url, model_name=None):
+    """Same contract as predict._fetch_url, without holding a thread during the download"""
+    headers, known_etag = predict.conditional_headers(image_url, model_name)
+    async with fetcher.open(image_url, headers) as response:
+        if response.status == 304:
+            await response.read()
+            etag = known_etag
+        else:
+            etag = response.headers.get('ETag')
+        cached = predict.predict_cached_url(image_url, etag, model_name)
+        if cached is not None:
+            return cached
+        if response.status != 304:
+            return image_url, etag, await response.read()
+    async with fetcher.open(image_url) as response:
+        return image_url, response.headers.get('ETag'), await response.read()
+
+
+async def predict_url_async(image_url, model_name=None):
+    logger.info(f"Predicting image from {image_url}")
+    fetched = await _fetch_url(image_url, model_name)
+    if isinstance(fetched, dict):
+        return fetched
+    loop = asyncio.get_running_loop()
+    return (await loop.run_in_executor(None, predict.predict_fetched_urls, [fetched], model_name))[0]
+
+
+async def predict_url_batch_async(image_urls, model_name=None):
+    logger.info(f"Predicting {len(image_urls)} images from URLs")
+    fetched = await fetcher.fetch_many(functools.partial(_fetch_url, model_name=model_name), image_urls)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, predict.predict_fetched_urls, fetched, model_name)
+
+
+async def _predict_url_handler(body, model_name=None):
+    try:
+        image_url = json.loads(body.decode('utf-8'))['url']
+        results = await predict_url_async(image_url, model_name)
+        if 'error' in results:
+            raise Exception(results['error'])
+        with metrics.image_stage('serialize'):
+            return _json_response(200, results)
+    except UnknownModel as e:
+        return _json_response(404, {'error': str(e)})
+    except Exception as e:
+        logger.error(f'Error in URL prediction: {str(e)}')
+        return _text_response(200, 'Error processing image')
+
+
+async def _predict_url_batch_handler(body, model_name=None):
+    try:
+        image_urls = json.loads(body.decode('utf-8')).get('urls')
+        if not isinstance(image_urls, list) or not image_urls or not all(isinstance(url, str) for url in image_urls):
+            return _json_response(400, {'error': 'Expected a JSON object with a non-empty "urls" array'})
+        if len(image_urls) > MAX_URL_BATCH_SIZE:
+            return _json_response(413, {'error': f'Too many URLs in batch (max {MAX_URL_BATCH_SIZE})'})
+
+        results = await predict_url_batch_async(image_urls, model_name)
+        for i, result in enumerate(results):
+            result['index'] = i
+
+        with metrics.image_stage('serialize'):
+            return _json_response(200, {'count': len(results), 'results': results})
+    except UnknownModel as e:
+        return _json_response(404, {'error': str(e)})
+    except Exception as e:
+        logger.error(f'Error in URL batch prediction: {str(e)}')
+        return _text_response(500, 'Error processing image')
+
+
+def _call_wsgi(scope, body):
+    """Run the Flask app on one request; returns (status, headers, body)"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return chunks.append
+
+    chunks = []
+    result = flask_app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], b''.join(chunks)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    # Inherited by the worker processes (timeseries.recording_enabled, metrics)
+    os.environ['SERVER_WORKERS'] = str(SERVER_WORKERS)
+    if SERVER_WORKERS > 1 and not metrics.METRICS_MULTIPROC_DIR:
+        os.environ['METRICS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+    elif metrics.METRICS_MULTIPROC_DIR:
+        metrics.clear_snapshots()
+    if SERVER_WORKERS > 1 and not os.environ.get('AQI_HISTORY_JOURNAL'):
+        os.environ['AQI_HISTORY_JOURNAL'] = os.path.join(tempfile.mkdtemp(prefix='aqi-history-'), 'readings.jsonl')
+    uvicorn.run('asgi:app', host='0.0.0.0', port=int(os.environ.get('PORT', '80')), workers=SERVER_WORKERS)
@@ -0,0 +1,135 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Coalesces items submitted concurrently from request threads into batches.
+
+    A worker thread takes the first queued item. If nothing else is queued
+    behind it, it is dispatched at once: a lone request at low load does not
+    wait for company. Otherwise the worker keeps collecting until either
+    max_batch_size items are gathered or max_wait_ms has elapsed since that
+    first item was queued. The whole batch is passed to
+    process_batch(items), which must return one output per item; each output is
+    handed back to the thread that submitted it, or raised there if it is an
+    exception (an item that failed on its own). With several workers, several
+    batches can be processed at once (process_batch must then be thread safe).
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=5.0, name='micro-batcher', workers=1):
+        assert max_batch_size >= 1
+        self._process_batch = process_batch
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+
+        self._stats_lock = threading.Lock()
+        self._batch_count = 0
+        self._item_count = 0
+        self._batch_size_counts = {}
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+        self._threads = [
+            threading.Thread(target=self._run, name=f'{name}-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def max_batch_size(self):
+        return self._max_batch_size
+
+    @property
+    def max_wait_ms(self):
+        return self._max_wait * 1000.0
+
+    def submit_async(self, item):
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def submit(self, item, timeout=None):
+        return self.submit_async(item).result(timeout)
+
+    def close(self):
+        # The stop marker is re-queued by each worker that sees it
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'max_batch_size': self._max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'workers': len(self._threads),
+                'batches': self._batch_count,
+                'items': self._item_count,
+                'queued': self._queue.qsize(),
+                'mean_batch_size': self._item_count / self._batch_count if self._batch_count else 0.0,
+                'batch_size_counts': dict(sorted(self._batch_size_counts.items())),
+                'mean_queue_wait_ms': 1000.0 * self._queue_wait_total / self._item_count if self._item_count else 0.0,
+                'max_queue_wait_ms': 1000.0 * self._queue_wait_max
+            }
+
+    def _collect(self, first):
+        batch = [first]
+        if self._queue.empty():
+            return batch
+        deadline = first[2] + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Past the deadline, still take whatever is already waiting
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.put(None)
+                return
+
+            batch = self._collect(first)
+            dispatched = time.perf_counter()
+            items = [item for item, _, _ in batch]
+
+            try:
+                outputs = self._process_batch(items)
+                assert len(outputs) == len(items)
+            except Exception as e:
+                logger.error(f"Batch of {len(items)} failed: {str(e)}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future, _), output in zip(batch, outputs):
+                    if isinstance(output, Exception):
+                        future.set_exception(output)
+                    else:
+                        future.set_result(output)
+
+            self._record(batch, dispatched)
+
+    def _record(self, batch, dispatched):
+        queue_waits = [dispatched - queued for _, _, queued in batch]
+        with self._stats_lock:
+            self._batch_count += 1
+            self._item_count += len(batch)
+            self._batch_size_counts[len(batch)] = self._batch_size_counts.get(len(batch), 0) + 1
+            self._queue_wait_total += sum(queue_waits)
+            self._queue_wait_max = max(self._queue_wait_max, max(queue_waits))
@@ -0,0 +1,103 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(key, value):
+    """Approximate memory held by a cache entry (key + value, one level deep for lists/tuples/dicts)"""
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with optional TTL, entry count and memory budget.
+
+    Entries are evicted oldest-use first when either max_entries or max_bytes
+    would be exceeded; an entry older than ttl_seconds is treated as a miss and
+    dropped. A limit of None disables it.
+    """
+
+    def __init__(self, max_bytes=None, max_entries=None, ttl_seconds=None, sizeof=estimate_size, clock=time.monotonic):
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._sizeof = sizeof
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, stored_at)
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+
+            value, size, stored_at = entry
+            if self._ttl is not None and self._clock() - stored_at > self._ttl:
+                del self._entries[key]
+                self._bytes -= size
+                self._expirations += 1
+                self._misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self._sizeof(key, value)
+        with self._lock:
+            if self._max_bytes is not None and size > self._max_bytes:
+                return
+
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+
+            self._entries[key] = (value, size, self._clock())
+            self._bytes += size
+
+            while self._entries and (
+                (self._max_bytes is not None and self._bytes > self._max_bytes)
+                or (self._max_entries is not None and len(self._entries) > self._max_entries)
+            ):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self._max_bytes,
+                'max_entries': self._max_entries,
+                'ttl_seconds': self._ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations
+            }
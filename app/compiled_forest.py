@@ -0,0 +1,121 @@
+import numpy as np
+
+# Tableaux de la forêt, tels qu'écrits dans le modèle plat (voir model_format)
+FOREST_ARRAYS = ('feature', 'threshold', 'children', 'value', 'roots')
+
+# Nombre de lignes évaluées à la fois: borne la mémoire des matrices (n_arbres, n_lignes)
+CHUNK_ROWS = 4096
+
+
+class CompiledForest:
+    """
+    Forêt de régression aplatie dans des tableaux NumPy contigus partagés par tous les arbres.
+
+    Les noeuds de tous les arbres sont concaténés; les indices des enfants sont
+    globaux. Une feuille pointe sur elle-même (enfant gauche = enfant droit = feuille),
+    ce qui permet de parcourir tous les arbres pour tout un lot, niveau par niveau,
+    en un nombre fixe d'itérations vectorisées (la profondeur maximale).
+
+    Les tableaux déjà au bon type sont utilisés tels quels, sans copie: ils peuvent
+    être des vues en lecture seule sur un fichier projeté en mémoire.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth):
+        self.feature = np.ascontiguousarray(feature, dtype=np.int32)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        # Enfants entrelacés [gauche, droite] par noeud: enfant = children[2 * noeud + va_a_droite]
+        self.children = np.ascontiguousarray(children, dtype=np.int32)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.int32)
+        self.max_depth = int(max_depth)
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def children_left(self):
+        return self.children[0::2]
+
+    @property
+    def children_right(self):
+        return self.children[1::2]
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Aplatit les `tree_` d'un RandomForestRegressor entraîné (une seule sortie)"""
+        if model.n_outputs_ != 1:
+            raise ValueError("Only single-output forests can be compiled")
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count) + offset
+            is_leaf = tree.children_left == -1
+
+            # Les feuilles bouclent sur elles-mêmes avec une feature valide (0)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+            values.append(tree.value[:, 0, 0])
+            roots.append(offset)
+
+            max_depth = max(max_depth, tree.max_depth)
+            offset += tree.node_count
+
+        return cls(
+            np.concatenate(features),
+            np.concatenate(thresholds),
+            np.stack([np.concatenate(lefts), np.concatenate(rights)], axis=1).ravel(),
+            np.concatenate(values),
+            np.array(roots),
+            max_depth
+        )
+
+    def to_arrays(self):
+        """Tableaux de la forêt, à écrire avec model_format.write_flat (max_depth va dans l'en-tête)"""
+        return {name: getattr(self, name) for name in FOREST_ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays, max_depth):
+        return cls(max_depth=max_depth, **{name: arrays[name] for name in FOREST_ARRAYS})
+
+    def apply(self, X):
+        """Renvoie l'indice (global) de la feuille atteinte, de forme (n_arbres, n_lignes)"""
+        # Même précision que sklearn: X en float32, comparé à des seuils float64
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+
+        # Position du début de chaque ligne dans X aplati
+        row_offsets = (np.arange(n_rows, dtype=np.int32) * n_features)[np.newaxis, :]
+
+        nodes = np.repeat(self.roots[:, np.newaxis], n_rows, axis=1)
+        for _ in range(self.max_depth):
+            x_values = np.take(flat_X, row_offsets + np.take(self.feature, nodes))
+            go_right = ~(x_values <= np.take(self.threshold, nodes))
+            nodes = np.take(self.children, 2 * nodes + go_right)
+        return nodes
+
+    def predict(self, X):
+        """Moyenne des prédictions des arbres, identique à RandomForestRegressor.predict"""
+        X = np.asarray(X)
+        y_hat = np.empty(X.shape[0], dtype=np.float64)
+
+        for start in range(0, X.shape[0], CHUNK_ROWS):
+            leaf_values = np.take(self.value, self.apply(X[start:start + CHUNK_ROWS]))
+
+            # Accumulation séquentielle arbre par arbre, dans le même ordre que sklearn
+            # (cumsum évite la sommation par paires de np.sum, qui change les arrondis)
+            y_hat[start:start + CHUNK_ROWS] = np.cumsum(leaf_values, axis=0)[-1]
+
+        y_hat /= self.n_estimators
+        return y_hat
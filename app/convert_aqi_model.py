@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Conversion d'un modèle AQI existant (simple_model.pkl) au format plat projetable en mémoire
+Usage: python convert_aqi_model.py --model aqi_model/simple_model.pkl --output aqi_model/simple_model.bin
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+import predict_aqi
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=str(predict_aqi.MODEL_PATH))
+    parser.add_argument('--output', default=None, help='Défaut: à côté du pickle, extension .bin')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    predict_aqi.MODEL_PATH = Path(args.model)
+    if not predict_aqi.MODEL_PATH.exists():
+        logging.error(f"Model {predict_aqi.MODEL_PATH} not found")
+        return 1
+
+    output = predict_aqi.convert_pickle_model(Path(args.output) if args.output else None)
+    print(f"{output} ({output.stat().st_size} bytes, version {predict_aqi.model_metadata.get('version', 'unknown')})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
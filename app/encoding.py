@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+# Response encoding for jsonify():
+#   'flask' - Flask's default provider (sorted keys, stdlib json)
+#   'fast'  - orjson when installed, else a compact stdlib encoder without key sorting
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'flask')
+
+# Binary request bodies, answered in the same format:
+#   octet-stream - packed little-endian float32 rows, in a fixed column order
+#   msgpack      - the same documents as JSON, MessagePack-encoded (needs msgpack)
+#   Arrow IPC    - a record batch stream with one column per feature (needs pyarrow)
+OCTET_STREAM = 'application/octet-stream'
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+ARROW_STREAM_TYPES = ('application/vnd.apache.arrow.stream',)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class UnsupportedFormat(RuntimeError):
+    """The body format needs an optional dependency that is not installed"""
+
+
+class InvalidBody(ValueError):
+    """The request body cannot be decoded in its declared format"""
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify() and request.get_json() with orjson when available. Keys keep their insertion
+    order; the output is compact in debug mode too. Anything orjson cannot encode goes
+    through Flask's default().
+    """
+    sort_keys = False
+
+    # Non-string keys (e.g. the int batch sizes of /stats) become strings, as with the stdlib encoder
+    _orjson_options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def __init__(self, app):
+        super().__init__(app)
+        # One encoder built once, instead of a json.dumps(**kwargs) setup per response
+        self._encoder = json.JSONEncoder(separators=(',', ':'), default=self.default)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        if orjson is not None:
+            return orjson.dumps(obj, default=self.default, option=self._orjson_options).decode('utf-8')
+        return self._encoder.encode(obj)
+
+    def loads(self, s, **kwargs):
+        # request.get_json() lands here; orjson rejects the non-standard NaN/Infinity literals
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is not None:
+            body = orjson.dumps(obj, default=self.default, option=self._orjson_options | orjson.OPT_APPEND_NEWLINE)
+        else:
+            body = self._encoder.encode(obj) + '\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def install_json_provider(app, encoder=None):
+    """Switch app.json to the configured encoder (JSON_ENCODER by default)"""
+    encoder = encoder or JSON_ENCODER
+    if encoder == 'fast':
+        app.json = FastJSONProvider(app)
+        logger.info(f"JSON responses encoded with {'orjson' if orjson is not None else 'the compact stdlib encoder'}")
+    elif encoder == 'flask':
+        app.json = DefaultJSONProvider(app)
+    else:
+        raise ValueError(f"Unknown JSON encoder: {encoder}")
+
+
+def unpack_float32_rows(body, n_columns):
+    """Read-only (n, n_columns) view of a packed little-endian float32 body, without copying it"""
+    row_bytes = 4 * n_columns
+    if len(body) % row_bytes:
+        raise InvalidBody(f"Body length {len(body)} is not a multiple of {row_bytes} bytes ({n_columns} float32 per row)")
+    return np.frombuffer(body, dtype='<f4').reshape(-1, n_columns)
+
+
+def pack_float32_rows(columns):
+    """Pack equal-length columns as little-endian float32 rows"""
+    rows = np.empty((len(columns[0]), len(columns)), dtype='<f4')
+    for i, column in enumerate(columns):
+        rows[:, i] = column
+    return rows.tobytes()
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedFormat("MessagePack bodies require msgpack (pip install msgpack)")
+    return msgpack
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise UnsupportedFormat("Arrow IPC bodies require pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def msgpack_loads(body):
+    msgpack = _import_msgpack()
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise InvalidBody(f"Invalid MessagePack body: {e}")
+
+
+def msgpack_dumps(obj):
+    return _import_msgpack().packb(obj, use_bin_type=True)
+
+
+def arrow_read_columns(body, names):
+    """(n, len(names)) float64 matrix from an Arrow IPC stream with (at least) these columns"""
+    pyarrow = _import_pyarrow()
+    try:
+        table = pyarrow.ipc.open_stream(pyarrow.py_buffer(body)).read_all()
+        missing = [name for name in names if name not in table.column_names]
+        if missing:
+            raise InvalidBody(f"Missing columns: {', '.join(missing)}")
+        X = np.empty((table.num_rows, len(names)), dtype=np.float64)
+        for i, name in enumerate(names):
+            # Nulls become NaN, rejected like missing values
+            X[:, i] = table.column(name).cast(pyarrow.float64()).to_numpy(zero_copy_only=False)
+    except pyarrow.ArrowException as e:
+        raise InvalidBody(f"Invalid Arrow IPC stream: {e}")
+    return X
+
+
+def arrow_write_columns(columns):
+    """Arrow IPC stream of a {name: array} table (NaN floats and None values written as nulls)"""
+    pyarrow = _import_pyarrow()
+    table = pyarrow.table({name: pyarrow.array(values, from_pandas=True) for name, values in columns.items()})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,581 @@
+import asyncio
+import contextlib
+import http.client
+import io
+import logging
+import re
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# Errors a reused keep-alive connection raises when the server already closed it
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError, ConnectionResetError)
+
+
+class FetchError(Exception):
+    """The URL could not be fetched (bad URL, HTTP error, network failure)"""
+
+
+class FetchTimeout(FetchError):
+    """Connecting to the host, reading from it or the whole download took longer than allowed"""
+
+
+class ResponseTooLarge(FetchError):
+    """The response body is larger than the configured byte cap"""
+
+
+# Whitespace, control characters and non-ASCII: the request line is written from the URL as is
+UNSAFE_URL_CHARACTERS = re.compile(r'[^\x21-\x7e]')
+
+
+def _check_url(url):
+    if UNSAFE_URL_CHARACTERS.search(url):
+        raise FetchError(f"Unsupported URL (whitespace, control or non-ASCII characters): {url!r}")
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise FetchError(f"Unsupported URL: {url}")
+    path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+    return parts, path
+
+
+def _check_headers(headers):
+    """Extra request headers (e.g. If-None-Match from a previous response) must fit on one line"""
+    for name, value in (headers or {}).items():
+        if UNSAFE_URL_CHARACTERS.search(name) or re.search(r'[^\x20-\x7e]', value):
+            raise FetchError(f"Invalid request header {name}: {value!r}")
+    return headers or {}
+
+
+def _remaining(deadline, url):
+    """Seconds left before the download deadline; FetchTimeout once it has passed"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise FetchTimeout(f"Timed out downloading {url}")
+    return remaining
+
+
+class Response:
+    """
+    A response whose headers are available before the body is read.
+
+    read() streams the body up to the fetcher's byte cap; once the body has
+    been read completely the connection goes back to the pool.
+    """
+
+    def __init__(self, fetcher, key, connection, response, url, deadline):
+        self._fetcher = fetcher
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._deadline = deadline
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+
+    def read(self):
+        max_bytes = self._fetcher.max_bytes
+        content_length = self._response.getheader('Content-Length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            self.close()
+            raise ResponseTooLarge(f"Response from {self.url} is {content_length} bytes (max {max_bytes})")
+
+        chunks = []
+        total = 0
+        try:
+            while True:
+                # Each read waits at most read_timeout, and never past the download deadline
+                self._connection.sock.settimeout(min(self._fetcher.read_timeout, _remaining(self._deadline, self.url)))
+                chunk = self._response.read1(self._fetcher.chunk_size)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise ResponseTooLarge(f"Response from {self.url} exceeds {max_bytes} bytes")
+                chunks.append(chunk)
+        except FetchError:
+            self.close()
+            raise
+        except socket.timeout as e:
+            self.close()
+            raise FetchTimeout(f"Timed out reading {self.url}") from e
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            raise FetchError(f"Error reading {self.url}: {str(e)}") from e
+
+        self._release()
+        return b''.join(chunks)
+
+    def close(self):
+        """Drop the connection without reading the rest of the body"""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _release(self):
+        if self._connection is None:
+            return
+        if self._response.will_close:
+            self.close()
+        else:
+            # The connection only accepts a new request once the response is closed
+            self._response.close()
+            self._connection.sock.settimeout(self._fetcher.read_timeout)
+            self._fetcher._checkin(self._key, self._connection)
+            self._connection = None
+
+
+class HTTPFetcher:
+    """
+    Fetches http(s) URLs over keep-alive connections pooled per host.
+
+    Connecting is bounded by connect_timeout, every socket read by
+    read_timeout and the whole download, redirects included, by total_timeout,
+    so a host that drips bytes cannot hold a worker; bodies larger than
+    max_bytes are rejected while streaming, without being buffered. Up to max_connections_per_host idle connections
+    are kept per (scheme, host, port). fetch_many() downloads several URLs
+    concurrently on a pool of `workers` threads.
+    """
+
+    def __init__(self, connect_timeout=3.0, read_timeout=10.0, max_bytes=4 * 1024 * 1024,
+                 max_connections_per_host=4, max_redirects=5, workers=8, chunk_size=64 * 1024, total_timeout=30.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+        self.max_connections_per_host = max_connections_per_host
+        self.max_redirects = max_redirects
+        self.chunk_size = chunk_size
+        self._workers = workers
+
+        self._lock = threading.Lock()
+        self._idle = {}  # (scheme, host, port) -> [HTTPConnection]
+        self._executor = None
+        self._connections_opened = 0
+        self._connections_reused = 0
+        self._requests = 0
+
+    @contextlib.contextmanager
+    def open(self, url, headers=None):
+        """
+        Context manager yielding a Response once the headers are in (redirects followed).
+        headers: extra request headers, e.g. If-None-Match for a conditional GET (304 is returned as is)
+        """
+        response = self._open(url, headers)
+        try:
+            yield response
+        finally:
+            response.close()
+
+    def fetch(self, url):
+        """Download a URL and return its body"""
+        with self.open(url) as response:
+            return response.read()
+
+    def fetch_many(self, fn, urls):
+        """
+        Run fn(url) for each URL on the worker threads, typically opening the URL
+        with open() or fetch(). Returns the results in order, with the exception
+        in place of the result for URLs that failed.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='url-fetch')
+        futures = [self._executor.submit(fn, url) for url in urls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def close(self):
+        with self._lock:
+            idle = [connection for connections in self._idle.values() for connection in connections]
+            self._idle.clear()
+            executor, self._executor = self._executor, None
+        for connection in idle:
+            connection.close()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connect_timeout': self.connect_timeout,
+                'read_timeout': self.read_timeout,
+                'total_timeout': self.total_timeout,
+                'max_bytes': self.max_bytes,
+                'requests': self._requests,
+                'connections_opened': self._connections_opened,
+                'connections_reused': self._connections_reused,
+                'idle_connections': sum(len(connections) for connections in self._idle.values())
+            }
+
+    def _open(self, url, headers=None):
+        headers = _check_headers(headers)
+        deadline = time.monotonic() + self.total_timeout
+        for _ in range(self.max_redirects + 1):
+            response = self._request(url, headers, deadline)
+            if response.status not in REDIRECT_STATUSES:
+                break
+            location = response.headers.get('Location')
+            response.close()
+            if not location:
+                raise FetchError(f"Redirect from {url} without a Location header")
+            url = urllib.parse.urljoin(url, location)
+        else:
+            raise FetchError(f"Too many redirects fetching {url}")
+
+        if response.status >= 400:
+            response.close()
+            raise FetchError(f"HTTP {response.status} fetching {url}")
+        return response
+
+    def _request(self, url, extra_headers, deadline):
+        parts, path = _check_url(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        headers = {'User-Agent': 'aqi-image-classifier', 'Accept': '*/*', **extra_headers}
+
+        with self._lock:
+            self._requests += 1
+
+        connection, reused = self._checkout(key)
+        try:
+            try:
+                connection.sock.settimeout(min(self.read_timeout, _remaining(deadline, url)))
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # The server closed the idle connection: retry once on a fresh one
+                connection.close()
+                connection, reused = self._connect(key), False
+                connection.sock.settimeout(min(self.read_timeout, _remaining(deadline, url)))
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+        except FetchError:
+            connection.close()
+            raise
+        except socket.timeout as e:
+            connection.close()
+            raise FetchTimeout(f"Timed out fetching {url}") from e
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise FetchError(f"Error fetching {url}: {str(e)}") from e
+
+        return Response(self, key, connection, response, url, deadline)
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self._connections_reused += 1
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_connections_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _connect(self, key):
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(host, port, timeout=self.connect_timeout)
+        try:
+            connection.connect()
+        except socket.timeout as e:
+            connection.close()
+            raise FetchTimeout(f"Timed out connecting to {host}") from e
+        except OSError as e:
+            connection.close()
+            raise FetchError(f"Error connecting to {host}: {str(e)}") from e
+        # The connect timeout only bounds the handshake; reads use their own
+        connection.sock.settimeout(self.read_timeout)
+        with self._lock:
+            self._connections_opened += 1
+        return connection
+
+
+class AsyncResponse:
+    """asyncio counterpart of Response: headers first, then a capped read()"""
+
+    def __init__(self, fetcher, key, reader, writer, url, status, headers, will_close, deadline):
+        self._fetcher = fetcher
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self._deadline = deadline
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._will_close = will_close
+
+    async def read(self):
+        max_bytes = self._fetcher.max_bytes
+        content_length = self.headers.get('Content-Length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            self.close()
+            raise ResponseTooLarge(f"Response from {self.url} is {content_length} bytes (max {max_bytes})")
+
+        try:
+            if self.status in (204, 304):
+                body = b''
+            elif 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+                body = await self._read_chunked(max_bytes)
+            elif content_length is not None and content_length.isdigit():
+                body = await self._timed(self._reader.readexactly(int(content_length)))
+            else:
+                body = await self._read_to_eof(max_bytes)
+        except FetchError:
+            self.close()
+            raise
+        except asyncio.TimeoutError as e:
+            self.close()
+            raise FetchTimeout(f"Timed out reading {self.url}") from e
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            self.close()
+            raise FetchError(f"Error reading {self.url}: {str(e)}") from e
+
+        self._release()
+        return body
+
+    def close(self):
+        """Drop the connection without reading the rest of the body"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _timed(self, awaitable):
+        return await self._fetcher._timed(awaitable, self._deadline, self.url)
+
+    async def _read_chunked(self, max_bytes):
+        chunks = []
+        total = 0
+        while True:
+            size_line = await self._timed(self._reader.readline())
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # Skip trailers up to the blank line ending the message
+                while (await self._timed(self._reader.readline())) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            total += size
+            if total > max_bytes:
+                raise ResponseTooLarge(f"Response from {self.url} exceeds {max_bytes} bytes")
+            chunks.append(await self._timed(self._reader.readexactly(size)))
+            await self._timed(self._reader.readline())
+
+    async def _read_to_eof(self, max_bytes):
+        self._will_close = True
+        chunks = []
+        total = 0
+        while True:
+            chunk = await self._timed(self._reader.read(self._fetcher.chunk_size))
+            if not chunk:
+                return b''.join(chunks)
+            total += len(chunk)
+            if total > max_bytes:
+                raise ResponseTooLarge(f"Response from {self.url} exceeds {max_bytes} bytes")
+            chunks.append(chunk)
+
+    def _release(self):
+        if self._writer is None:
+            return
+        if self._will_close:
+            self.close()
+        else:
+            self._fetcher._checkin(self._key, (self._reader, self._writer))
+            self._writer = None
+
+
+class AsyncHTTPFetcher:
+    """
+    asyncio counterpart of HTTPFetcher, for serving /url from an event loop.
+
+    Same pooling per (scheme, host, port), timeouts, download deadline and byte cap; a slow host
+    only holds a coroutine, not a thread. fetch_many() runs fn(url) for all
+    URLs concurrently. Must be used from a single event loop.
+    """
+
+    def __init__(self, connect_timeout=3.0, read_timeout=10.0, max_bytes=4 * 1024 * 1024,
+                 max_connections_per_host=4, max_redirects=5, chunk_size=64 * 1024, total_timeout=30.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+        self.max_connections_per_host = max_connections_per_host
+        self.max_redirects = max_redirects
+        self.chunk_size = chunk_size
+
+        self._idle = {}  # (scheme, host, port) -> [(StreamReader, StreamWriter)]
+        self._ssl_context = None
+        self._connections_opened = 0
+        self._connections_reused = 0
+        self._requests = 0
+
+    @contextlib.asynccontextmanager
+    async def open(self, url, headers=None):
+        response = await self._open(url, headers)
+        try:
+            yield response
+        finally:
+            response.close()
+
+    async def fetch(self, url):
+        async with self.open(url) as response:
+            return await response.read()
+
+    async def fetch_many(self, fn, urls):
+        """Await fn(url) for all URLs concurrently; exceptions are returned in place of results"""
+        results = await asyncio.gather(*(fn(url) for url in urls), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+        return results
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    def stats(self):
+        return {
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'total_timeout': self.total_timeout,
+            'max_bytes': self.max_bytes,
+            'requests': self._requests,
+            'connections_opened': self._connections_opened,
+            'connections_reused': self._connections_reused,
+            'idle_connections': sum(len(connections) for connections in self._idle.values())
+        }
+
+    async def _open(self, url, headers=None):
+        headers = _check_headers(headers)
+        deadline = time.monotonic() + self.total_timeout
+        for _ in range(self.max_redirects + 1):
+            response = await self._request(url, headers, deadline)
+            if response.status not in REDIRECT_STATUSES:
+                break
+            location = response.headers.get('Location')
+            response.close()
+            if not location:
+                raise FetchError(f"Redirect from {url} without a Location header")
+            url = urllib.parse.urljoin(url, location)
+        else:
+            raise FetchError(f"Too many redirects fetching {url}")
+
+        if response.status >= 400:
+            response.close()
+            raise FetchError(f"HTTP {response.status} fetching {url}")
+        return response
+
+    async def _request(self, url, extra_headers, deadline):
+        parts, path = _check_url(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        host = parts.netloc.rsplit('@', 1)[-1]
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            "User-Agent: aqi-image-classifier\r\n"
+            "Accept: */*\r\n"
+            + ''.join(f"{name}: {value}\r\n" for name, value in extra_headers.items())
+            + "\r\n"
+        ).encode('latin-1')
+        self._requests += 1
+
+        (reader, writer), reused = await self._checkout(key)
+        try:
+            try:
+                head = await self._send(reader, writer, request, deadline, url)
+            except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server closed the idle connection: retry once on a fresh one
+                writer.close()
+                (reader, writer), reused = await self._connect(key), False
+                head = await self._send(reader, writer, request, deadline, url)
+        except FetchError:
+            writer.close()
+            raise
+        except asyncio.TimeoutError as e:
+            writer.close()
+            raise FetchTimeout(f"Timed out fetching {url}") from e
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            writer.close()
+            raise FetchError(f"Error fetching {url}: {str(e)}") from e
+
+        status_line, _, header_block = head.partition(b'\r\n')
+        try:
+            version, status = status_line.decode('latin-1').split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            writer.close()
+            raise FetchError(f"Bad status line from {url}: {status_line!r}")
+        headers = http.client.parse_headers(io.BytesIO(header_block))
+
+        connection = headers.get('Connection', '').lower()
+        will_close = connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive')
+        return AsyncResponse(self, key, reader, writer, url, status, headers, will_close, deadline)
+
+    async def _timed(self, awaitable, deadline, url):
+        """Await one read or write for at most read_timeout, and never past the download deadline"""
+        try:
+            remaining = _remaining(deadline, url)
+        except FetchTimeout:
+            awaitable.close()
+            raise
+        return await asyncio.wait_for(awaitable, min(self.read_timeout, remaining))
+
+    async def _send(self, reader, writer, request, deadline, url):
+        writer.write(request)
+        await self._timed(writer.drain(), deadline, url)
+        return await self._timed(reader.readuntil(b'\r\n\r\n'), deadline, url)
+
+    async def _checkout(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                self._connections_reused += 1
+                return (reader, writer), True
+            writer.close()
+        return await self._connect(key), False
+
+    def _checkin(self, key, connection):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.max_connections_per_host:
+            idle.append(connection)
+        else:
+            connection[1].close()
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        port = port or (443 if scheme == 'https' else 80)
+        try:
+            connection = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=ssl_context), self.connect_timeout)
+        except asyncio.TimeoutError as e:
+            raise FetchTimeout(f"Timed out connecting to {host}") from e
+        except OSError as e:
+            raise FetchError(f"Error connecting to {host}: {str(e)}") from e
+        self._connections_opened += 1
+        return connection
@@ -0,0 +1,65 @@
+# Configuration du serveur de production pre-fork:
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# Le master importe l'application et charge le modèle AQI une seule fois; les workers forkés
+# partagent ces pages en copy-on-write. L'historique par ville est scoré dans chaque worker, en
+# arrière-plan après le chargement des modèles; les relevés reçus ensuite par /predict-aqi passent
+# d'un worker à l'autre par AQI_HISTORY_JOURNAL (voir timeseries.py). Chaque worker
+# crée ensuite ses propres interpréteurs TFLite et threads (post_fork), qui ne peuvent pas
+# être hérités d'un fork.
+# model.tflite est mappé en mémoire par l'interpréteur: ses pages sont partagées
+# entre workers par le cache du système de fichiers. Avec plus d'un worker, les métriques
+# de chaque worker sont écrites dans METRICS_MULTIPROC_DIR et fusionnées par /metrics.
+import gc
+import logging
+import os
+import tempfile
+
+logging.basicConfig(level=logging.INFO)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '80')}"
+workers = int(os.environ.get('SERVER_WORKERS', '2'))
+# Lu par l'application (timeseries.recording_enabled), importée après cette configuration
+os.environ['SERVER_WORKERS'] = str(workers)
+if workers > 1 and not os.environ.get('METRICS_MULTIPROC_DIR'):
+    os.environ['METRICS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+if workers > 1 and not os.environ.get('AQI_HISTORY_JOURNAL'):
+    os.environ['AQI_HISTORY_JOURNAL'] = os.path.join(tempfile.mkdtemp(prefix='aqi-history-'), 'readings.jsonl')
+threads = int(os.environ.get('SERVER_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('SERVER_TIMEOUT', '60'))
+preload_app = os.environ.get('SERVER_PRELOAD', '1') == '1'
+accesslog = '-'
+
+
+def on_starting(server):
+    """Dans le master, au démarrage: les métriques d'une exécution précédente sont effacées"""
+    import metrics
+    if metrics.METRICS_MULTIPROC_DIR:
+        metrics.clear_snapshots()
+
+
+def when_ready(server):
+    """Dans le master, avant le premier fork"""
+    if not preload_app:
+        return
+    from predict_aqi import initialize_aqi_model
+    initialize_aqi_model()
+    # Les objets déjà chargés ne sont plus parcourus par le GC, qui sinon
+    # réécrirait leurs en-têtes et dupliquerait les pages dans chaque worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Dans chaque worker, juste après le fork"""
+    import metrics
+    from app import start_model_loading
+    start_model_loading()
+    metrics.start_snapshots()
+
+
+def worker_exit(server, worker):
+    """Dans le worker qui s'arrête: ses derniers compteurs restent dans les totaux de /metrics"""
+    import metrics
+    if metrics.METRICS_MULTIPROC_DIR:
+        metrics.write_snapshot()
@@ -0,0 +1,428 @@
+import bisect
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+# Counters, gauges and histograms rendered in the Prometheus text exposition format.
+# Each labelled series is a small object with its own lock: an observation is one
+# perf_counter() pair, a bisect over the buckets and a few additions.
+# METRICS_ENABLED=0 turns every timer into a no-op.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# A scrape reaches a single worker process. With several workers, METRICS_MULTIPROC_DIR
+# names a directory shared by them (emptied by the server at startup): each process
+# writes a snapshot of its series there every METRICS_SNAPSHOT_INTERVAL seconds and
+# /metrics renders them merged. Counters and histograms are summed, exited workers
+# included so totals never go down; gauges only count live processes.
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+METRICS_SNAPSHOT_INTERVAL = float(os.environ.get('METRICS_SNAPSHOT_INTERVAL', '1'))
+
+SNAPSHOT_FILE = re.compile(r'metrics-(\d+)\.json')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from sub-millisecond stages (tensor write, AQI scaling) to slow /url downloads
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_TIMER = contextlib.nullcontext()
+
+logger = logging.getLogger(__name__)
+_snapshot_thread = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._unlabelled = self.labels()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        """The series for these label values, created on first use"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def snapshot(self):
+        """[label values, value] of every series, as written to the multiprocess directory"""
+        with self._lock:
+            children = list(self._children.items())
+        return [[list(values), child.snapshot()] for values, child in children]
+
+    def merge(self, snapshots):
+        """Series summed over the (pid, live, snapshot) of each process"""
+        merged = {}
+        for _, _, series in snapshots:
+            for values, value in series:
+                child = merged.get(tuple(values))
+                if child is None:
+                    child = merged[tuple(values)] = self._new_child()
+                child.merge(value)
+        return merged
+
+    def render(self, children=None, labelnames=None):
+        children = self._children if children is None else children
+        labelnames = self.labelnames if labelnames is None else labelnames
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for values, child in sorted(children.items()):
+            lines.extend(child.render(self.name, labelnames, values))
+        return lines
+
+    def render_merged(self, snapshots):
+        return self.render(self.merge(snapshots))
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+    def merge(self, value):
+        self.inc(value)
+
+    def render(self, name, labelnames, values):
+        return [f'{name}{_format_labels(labelnames, values)} {_format_value(self._value)}']
+
+
+class Counter(_Metric):
+    """Monotonically increasing total"""
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self._unlabelled.inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = float(value)
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down. multiprocess_mode tells how the values of the live
+    processes are merged: 'all' (one series per process, with a pid label), 'sum',
+    'min' or 'max'.
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, multiprocess_mode='all'):
+        if multiprocess_mode not in ('all', 'sum', 'min', 'max'):
+            raise ValueError(f"Unknown multiprocess_mode {multiprocess_mode!r} for {name}")
+        self.multiprocess_mode = multiprocess_mode
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def merge(self, snapshots):
+        merged = {}
+        for pid, live, series in snapshots:
+            if not live:
+                continue
+            for values, value in series:
+                key = tuple(values) + ((str(pid),) if self.multiprocess_mode == 'all' else ())
+                child = merged.get(key)
+                if child is None:
+                    child = merged[key] = self._new_child()
+                    child.set(value)
+                elif self.multiprocess_mode == 'sum':
+                    child.inc(value)
+                else:
+                    child.set((min if self.multiprocess_mode == 'min' else max)(child.get(), value))
+        return merged
+
+    def render_merged(self, snapshots):
+        labelnames = self.labelnames + (('pid',) if self.multiprocess_mode == 'all' else ())
+        return self.render(self.merge(snapshots), labelnames)
+
+    def set(self, value):
+        self._unlabelled.set(value)
+
+
+class _Timer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # last slot: above the largest bucket
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block, in seconds"""
+        return _Timer(self) if METRICS_ENABLED else _NULL_TIMER
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def snapshot(self):
+        with self._lock:
+            return [list(self._counts), self._sum]
+
+    def merge(self, value):
+        counts, total = value
+        with self._lock:
+            self._counts = [a + b for a, b in zip(self._counts, counts)]
+            self._sum += total
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labelnames, values, [("le", _format_value(bound))])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labelnames, values)} {cumulative}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets (upper bounds, inclusive)"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(float(bound) for bound in sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._unlabelled.observe(value)
+
+    def time(self):
+        return self._unlabelled.time()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def add_collector(self, collect):
+        """collect() is called before each render, to refresh gauges read from elsewhere"""
+        self._collectors.append(collect)
+
+    def collect(self):
+        for collect in self._collectors:
+            collect()
+
+    def render(self):
+        self.collect()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Values of every metric of this process, by metric name"""
+        self.collect()
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render_merged(self, snapshots):
+        """Exposition text of the snapshots of several processes, see read_snapshots()"""
+        lines = []
+        for metric in self._metrics:
+            series = [(pid, live, snapshot.get(metric.name, [])) for pid, live, snapshot in snapshots]
+            lines.extend(metric.render_merged(series))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests served', ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'HTTP request latency', ('route', 'method'))
+HTTP_IN_PROGRESS = Gauge('http_requests_in_progress', 'HTTP requests being served', ('route',), multiprocess_mode='sum')
+
+# Stages of /image (and /url after the download): decode, exif, resize, tensor_write, invoke, serialize
+IMAGE_STAGE_SECONDS = Histogram('image_stage_duration_seconds', 'Time spent in each image classification stage', ('stage',))
+# Stages of /predict-aqi: validate, scale, predict, serialize
+AQI_STAGE_SECONDS = Histogram('aqi_stage_duration_seconds', 'Time spent in each AQI prediction stage', ('stage',))
+
+# Shadow evaluation of a secondary AQI model (aqi_shadow.py): latency per model and role
+# (primary: on the response path, shadow: per reading of a background batch), absolute AQI
+# difference between the two models, and sampled readings by outcome
+AQI_SHADOW_DIFFERENCE_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+AQI_MODEL_SECONDS = Histogram('aqi_model_prediction_seconds', 'AQI prediction latency per reading, by model', ('model', 'role'))
+AQI_SHADOW_ABS_DIFFERENCE = Histogram('aqi_shadow_abs_difference', 'Absolute AQI difference between the shadow and primary models', ('model',), buckets=AQI_SHADOW_DIFFERENCE_BUCKETS)
+AQI_SHADOW_SAMPLES = Counter('aqi_shadow_readings_total', 'Readings copied to the shadow model, by outcome', ('model', 'outcome'))
+
+MODEL_LOAD_SECONDS = Gauge('model_load_seconds', 'Duration of the last model load', ('model',), multiprocess_mode='max')
+# 1 only once every worker serves the model
+MODEL_READY = Gauge('model_ready', '1 when the model is loaded and serving', ('model',), multiprocess_mode='min')
+
+
+def image_stage(stage):
+    return IMAGE_STAGE_SECONDS.labels(stage).time()
+
+
+def aqi_stage(stage):
+    return AQI_STAGE_SECONDS.labels(stage).time()
+
+
+class RequestTracker:
+    """Counts a request as in progress from creation until done(status) records its latency and status"""
+    __slots__ = ('_route', '_method', '_start', '_in_progress')
+
+    def __init__(self, route, method):
+        self._route = route
+        self._method = method
+        self._in_progress = HTTP_IN_PROGRESS.labels(route)
+        self._in_progress.inc()
+        self._start = time.perf_counter()
+
+    def done(self, status):
+        HTTP_REQUEST_SECONDS.labels(self._route, self._method).observe(time.perf_counter() - self._start)
+        HTTP_REQUESTS.labels(self._route, self._method, status).inc()
+        self._in_progress.dec()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def write_snapshot(directory=None, registry=REGISTRY, pid=None):
+    """Write the snapshot of this process; replaced atomically, so readers never see a partial file"""
+    path = os.path.join(directory or METRICS_MULTIPROC_DIR, f'metrics-{pid or os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_snapshots(directory=None):
+    """(pid, live, snapshot) of every process that wrote to the multiprocess directory"""
+    directory = directory or METRICS_MULTIPROC_DIR
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        match = SNAPSHOT_FILE.fullmatch(name)
+        if match is None:
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping metrics snapshot {name}: {e}")
+            continue
+        pid = int(match.group(1))
+        snapshots.append((pid, _process_alive(pid), snapshot))
+    return snapshots
+
+
+def clear_snapshots(directory=None):
+    """Remove the snapshots of a previous run; called once by the server before starting its workers"""
+    directory = directory or METRICS_MULTIPROC_DIR
+    for name in os.listdir(directory):
+        if SNAPSHOT_FILE.fullmatch(name) or name.endswith('.json.tmp'):
+            os.remove(os.path.join(directory, name))
+
+
+def start_snapshots():
+    """Write this process's snapshot every METRICS_SNAPSHOT_INTERVAL seconds (once per worker, after the fork)"""
+    global _snapshot_thread
+    if not METRICS_MULTIPROC_DIR or _snapshot_thread is not None:
+        return
+
+    def write_periodically():
+        while True:
+            try:
+                write_snapshot()
+            except OSError as e:
+                logger.warning(f"Could not write the metrics snapshot: {e}")
+            time.sleep(METRICS_SNAPSHOT_INTERVAL)
+
+    _snapshot_thread = threading.Thread(target=write_periodically, name='metrics-snapshot', daemon=True)
+    _snapshot_thread.start()
+
+
+def render():
+    if not METRICS_MULTIPROC_DIR:
+        return REGISTRY.render()
+    # This process's own series are current; the other workers' are at most METRICS_SNAPSHOT_INTERVAL old
+    write_snapshot()
+    return REGISTRY.render_merged(read_snapshots())
@@ -0,0 +1,74 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# Format binaire plat d'un modèle, projetable en mémoire (mmap) en lecture seule:
+#
+#   MAGIC (8 octets) | version (uint32) | taille de l'en-tête (uint32) | en-tête JSON | tableaux
+#
+# L'en-tête décrit chaque tableau (dtype little-endian, forme, position) et porte les
+# métadonnées du modèle. Chaque tableau commence sur une frontière de ALIGNMENT octets,
+# pour être lu directement depuis les pages du fichier, sans copie ni désérialisation:
+# plusieurs processus qui projettent le même fichier partagent ces pages via le cache du système.
+MAGIC = b'AQIMODEL'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct('<8sII')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_flat(path, arrays, header=None):
+    """
+    Écrit des tableaux NumPy et un en-tête JSON dans un fichier plat.
+    Le fichier est écrit à côté puis renommé: les processus qui projettent déjà
+    l'ancienne version ne voient jamais un fichier à moitié écrit.
+    """
+    arrays = {name: np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder('<')) for name, array in arrays.items()}
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps({**(header or {}), 'arrays': layout}).encode('utf-8')
+    data_start = _align(PREAMBLE.size + len(header_bytes))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_flat(path):
+    """
+    Projette un fichier plat en mémoire: renvoie (tableaux, en-tête).
+    Les tableaux sont des vues en lecture seule sur le fichier; aucune donnée n'est copiée.
+    """
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    magic, version, header_size = PREAMBLE.unpack(buffer[:PREAMBLE.size].tobytes())
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a flat model file")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported flat model format version {version} in {path}")
+
+    header = json.loads(buffer[PREAMBLE.size:PREAMBLE.size + header_size].tobytes())
+    data_start = _align(PREAMBLE.size + header_size)
+
+    arrays = {}
+    for name, spec in header.pop('arrays').items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        start = data_start + spec['offset']
+        arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+    return arrays, header
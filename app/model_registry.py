@@ -0,0 +1,299 @@
+"""
+Several model iterations loaded side by side, addressed by their published name.
+
+Each iteration comes from a Custom Vision export: a model file, a labels file and
+optionally a cvexport.manifest whose ModelFileSHA1 is checked before the model is
+loaded. A reload builds the new version completely, then swaps it in under a lock;
+requests that acquired the previous version keep it until they release it, and the
+previous version is closed once the last of them is done.
+"""
+
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import pathlib
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'cvexport.manifest'
+
+# Where a published name is loaded from; manifest_path may be None
+ModelSource = namedtuple('ModelSource', ['name', 'model_path', 'labels_path', 'manifest_path'])
+
+
+class ModelChecksumError(RuntimeError):
+    """The model file does not match the ModelFileSHA1 of its manifest"""
+
+
+class UnknownModel(LookupError):
+    """No model is published under this name"""
+
+
+def read_manifest(manifest_path):
+    if manifest_path is None or not pathlib.Path(manifest_path).exists():
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8-sig') as f:
+        return json.load(f)
+
+
+def file_sha1(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_checksum(model_path, manifest, strict=True):
+    """
+    SHA1 of the model file. When the manifest declares another one, raises
+    ModelChecksumError, or only logs a warning if strict is false.
+    """
+    sha1 = file_sha1(model_path)
+    expected = manifest.get('ModelFileSHA1')
+    if expected and sha1.lower() != expected.lower():
+        message = f"{model_path} has SHA1 {sha1}, the manifest expects {expected}"
+        if strict:
+            raise ModelChecksumError(message)
+        logger.warning(f"{message}; loading it anyway")
+    return sha1
+
+
+def source_from_directory(name, directory):
+    """ModelSource of an export directory, using the file names declared in its manifest"""
+    directory = pathlib.Path(directory)
+    manifest_path = directory / MANIFEST_NAME
+    manifest = read_manifest(manifest_path)
+    return ModelSource(
+        name,
+        directory / manifest.get('ModelFileName', 'model.tflite'),
+        directory / manifest.get('LabelFileName', 'labels.txt'),
+        manifest_path if manifest_path.exists() else None
+    )
+
+
+def _signature(source):
+    """Changes whenever one of the source files is replaced or rewritten"""
+    signature = []
+    for path in (source.model_path, source.labels_path, source.manifest_path):
+        try:
+            stat = pathlib.Path(path).stat() if path is not None else None
+        except FileNotFoundError:
+            stat = None
+        signature.append((stat.st_mtime_ns, stat.st_size) if stat is not None else None)
+    return tuple(signature)
+
+
+class ModelVersion:
+    """One loaded iteration of a published model, reference counted by the requests using it"""
+
+    def __init__(self, source, served, manifest, sha1, version):
+        self.source = source
+        self.served = served
+        self.manifest = manifest
+        self.sha1 = sha1
+        self.version = version
+        self.loaded_at = datetime.datetime.utcnow().isoformat()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._retired = False
+        self._closed = False
+
+    @property
+    def name(self):
+        return self.source.name
+
+    @property
+    def iteration_id(self):
+        return self.manifest.get('IterationId')
+
+    def _acquire(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            close = self._retired and self._in_flight == 0 and not self._closed
+            self._closed = self._closed or close
+        if close:
+            self._close()
+
+    def retire(self):
+        """No new request gets this version; it is closed when the last one in flight is done"""
+        with self._lock:
+            self._retired = True
+            close = self._in_flight == 0 and not self._closed
+            self._closed = self._closed or close
+        if close:
+            self._close()
+
+    def _close(self):
+        logger.info(f"Closing model {self.name} version {self.version}")
+        self.served.close()
+
+    def info(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'iteration_id': self.iteration_id,
+            'sha1': self.sha1,
+            'loaded_at': self.loaded_at,
+            'in_flight': self._in_flight,
+        }
+
+
+class ModelRegistry:
+    """
+    Published name -> current ModelVersion.
+
+    load_model(model_path, labels_path) builds the served object of a version (anything
+    with a close() method). Names that are not published resolve to the default model,
+    unless strict is set. verify_sha1 is True (a model file that does not match its
+    manifest is not loaded), 'warn' (it is loaded with a warning) or False.
+    """
+
+    def __init__(self, load_model, default_name, verify_sha1=True, strict=False):
+        self._load_model = load_model
+        self._default_name = default_name
+        self._verify_sha1 = verify_sha1
+        self._strict = strict
+        self._lock = threading.Lock()
+        # Serializes loads, so two reloads of one name never race to publish
+        self._load_lock = threading.Lock()
+        self._models = {}
+        self._sources = {}
+        self._signatures = {}
+        self._errors = {}
+        self._versions = 0
+        self._watch_directory = None
+        self._watcher = None
+        self._stop_watching = threading.Event()
+
+    @property
+    def default_name(self):
+        return self._default_name
+
+    def load(self, source):
+        """Load a source and publish it under its name; on failure the current version keeps serving"""
+        with self._load_lock:
+            signature = _signature(source)
+            try:
+                manifest = read_manifest(source.manifest_path)
+                sha1 = (verify_checksum(source.model_path, manifest, strict=self._verify_sha1 != 'warn')
+                        if self._verify_sha1 else None)
+                served = self._load_model(source.model_path, source.labels_path)
+            except Exception as e:
+                with self._lock:
+                    self._sources.setdefault(source.name, source)
+                    self._signatures[source.name] = signature
+                    self._errors[source.name] = str(e)
+                raise
+
+            with self._lock:
+                self._versions += 1
+                version = ModelVersion(source, served, manifest, sha1, self._versions)
+                previous = self._models.get(source.name)
+                self._models[source.name] = version
+                self._sources[source.name] = source
+                self._signatures[source.name] = signature
+                self._errors.pop(source.name, None)
+
+        logger.info(f"Published model {source.name} version {version.version} (iteration {version.iteration_id})")
+        if previous is not None:
+            previous.retire()
+        return version
+
+    def reload(self, name=None):
+        """Reload one published name, or all of them; returns the new versions"""
+        with self._lock:
+            names = [name] if name is not None else list(self._sources)
+            if name is not None and name not in self._sources:
+                raise UnknownModel(f"Unknown model: {name}")
+            sources = [self._sources[name] for name in names]
+        return [self.load(source) for source in sources]
+
+    def _resolve(self, name):
+        if name is not None:
+            version = self._models.get(name)
+            if version is not None:
+                return version
+            for version in self._models.values():
+                if version.iteration_id == name:
+                    return version
+            if self._strict:
+                raise UnknownModel(f"Unknown model: {name}")
+        version = self._models.get(self._default_name)
+        if version is None:
+            raise UnknownModel(f"Default model {self._default_name} is not loaded")
+        return version
+
+    @contextlib.contextmanager
+    def acquire(self, name=None):
+        """The current version for name, kept open until the block exits even if it is replaced meanwhile"""
+        with self._lock:
+            version = self._resolve(name)
+            version._acquire()
+        try:
+            yield version
+        finally:
+            version._release()
+
+    def get(self, name=None):
+        """The current version, without holding it (for stats)"""
+        with self._lock:
+            return self._resolve(name)
+
+    def scan(self):
+        """Reload sources whose files changed, and load new export directories; returns the new versions"""
+        loaded = []
+        with self._lock:
+            sources = dict(self._sources)
+            changed = [source for name, source in sources.items() if _signature(source) != self._signatures.get(name)]
+        if self._watch_directory is not None:
+            for directory in sorted(pathlib.Path(self._watch_directory).iterdir()):
+                if directory.is_dir() and directory.name not in sources:
+                    source = source_from_directory(directory.name, directory)
+                    if pathlib.Path(source.model_path).exists():
+                        changed.append(source)
+        for source in changed:
+            try:
+                loaded.append(self.load(source))
+            except Exception as e:
+                logger.error(f"Could not load model {source.name}: {e}")
+        return loaded
+
+    def load_directory(self, directory):
+        """Load every export directory found in directory, each published under its directory name"""
+        self._watch_directory = pathlib.Path(directory)
+        return self.scan()
+
+    def start_watching(self, interval):
+        """Poll the source files every interval seconds and reload the ones that changed"""
+        def watch():
+            while not self._stop_watching.wait(interval):
+                self.scan()
+
+        self._watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching model files every {interval}s")
+
+    def close(self):
+        self._stop_watching.set()
+        with self._lock:
+            versions = list(self._models.values())
+            self._models.clear()
+        for version in versions:
+            version.retire()
+
+    def info(self):
+        with self._lock:
+            return {
+                'default': self._default_name,
+                'models': [version.info() for version in self._models.values()],
+                'errors': dict(self._errors),
+            }
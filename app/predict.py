@@ -1,7 +1,13 @@
+import contextlib
 import datetime
+import functools
+import hashlib
+import io
 import logging
+import os
 import pathlib
-import urllib.request
+import queue
+import time
 import numpy as np
 import PIL.Image
 try:
@@ -9,17 +15,82 @@ try:
 except ImportError:
     import tensorflow.lite as tflite
 
+from batching import MicroBatcher
+from cache import LRUCache
+from fetch import HTTPFetcher
+from metrics import image_stage
+from model_registry import ModelRegistry, ModelSource, UnknownModel
+
 logger = logging.getLogger(__name__)
-global_predictor = None
+model_registry = None
+global_fetcher = None
 MODEL_PATH = pathlib.Path('model.tflite')
 LABELS_PATH = pathlib.Path('labels.txt')
+MANIFEST_PATH = pathlib.Path('cvexport.manifest')
 IS_BGR = False
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+
+# Model load status, reported by /ready
+load_state = {'status': 'not_loaded', 'load_seconds': None, 'loaded_at': None, 'error': None}
+
+# Model registry: MODEL_PATH is published as MODEL_PUBLISHED_NAME (the default model), and
+# each export directory in MODEL_REGISTRY_DIR under its directory name, routed by the
+# publishedName of /<project>/classify/iterations/<publishedName>/... Unknown names get the
+# default model unless MODEL_ROUTING_STRICT=1. MODEL_WATCH_INTERVAL > 0 polls the files
+# and reloads changed models. MODEL_VERIFY_SHA1 compares the model file with ModelFileSHA1
+# of its manifest: '1' (default) refuses to load a model that does not match, 'warn' logs
+# the mismatch and loads it anyway, '0' skips the check.
+MODEL_PUBLISHED_NAME = os.environ.get('MODEL_PUBLISHED_NAME', 'default')
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', '')
+MODEL_ROUTING_STRICT = os.environ.get('MODEL_ROUTING_STRICT', '0') == '1'
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '0'))
+MODEL_VERIFY_SHA1 = {'0': False, 'warn': 'warn'}.get(os.environ.get('MODEL_VERIFY_SHA1', '1'), True)
+
+# Batch sizes the interpreter is resized to. A batch is padded up to the next
+# size, so only a handful of tensor allocations are ever made and then reused.
+BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+
+# Micro-batching of concurrent /image requests: requests queued within
+# MICRO_BATCH_MAX_WAIT_MS of each other share one interpreter invocation
+MICRO_BATCHING = os.environ.get('MICRO_BATCHING', '1') == '1'
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', '8'))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', '5'))
+
+# Number of independently allocated interpreters, and intra-op threads of each
+PREDICTOR_POOL_SIZE = int(os.environ.get('PREDICTOR_POOL_SIZE', '1'))
+INTERPRETER_NUM_THREADS = int(os.environ['INTERPRETER_NUM_THREADS']) if os.environ.get('INTERPRETER_NUM_THREADS') else None
+
+# 'standard' or 'fast' (decode-time downscaling, see Preprocessor)
+PREPROCESS_MODE = os.environ.get('PREPROCESS_MODE', 'standard')
+
+# Prediction cache keyed by a hash of the raw image bytes (and by URL + ETag for /url).
+# IMAGE_CACHE_MAX_BYTES=0 disables it.
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+IMAGE_CACHE_TTL_SECONDS = float(os.environ.get('IMAGE_CACHE_TTL_SECONDS', '600'))
+
+# Image downloads for /url: keep-alive connections pooled per host, strict timeouts,
+# and the same 4MB cap as uploaded images (app.config['MAX_CONTENT_LENGTH'])
+URL_FETCH_CONNECT_TIMEOUT = float(os.environ.get('URL_FETCH_CONNECT_TIMEOUT', '3'))
+URL_FETCH_READ_TIMEOUT = float(os.environ.get('URL_FETCH_READ_TIMEOUT', '10'))
+# Whole download, redirects included: a host sending a byte every few seconds is cut off too
+URL_FETCH_TOTAL_TIMEOUT = float(os.environ.get('URL_FETCH_TOTAL_TIMEOUT', '30'))
+URL_FETCH_MAX_BYTES = int(os.environ.get('URL_FETCH_MAX_BYTES', str(4 * 1024 * 1024)))
+URL_FETCH_CONNECTIONS_PER_HOST = int(os.environ.get('URL_FETCH_CONNECTIONS_PER_HOST', '4'))
+URL_FETCH_WORKERS = int(os.environ.get('URL_FETCH_WORKERS', '8'))
+
+
+class InputShapeError(ValueError):
+    """A pre-resized input does not match the model's input tensor"""
+
 
 class Predictor:
-    def __init__(self, model_path, labels_path):
+    def __init__(self, model_path, labels_path, num_threads=None):
         logger.debug(f"Loading model from {model_path}")
-        self._interpreter = tflite.Interpreter(model_path=str(model_path))
+        self._model_path = model_path
+        self._num_threads = num_threads
+        self._interpreter = tflite.Interpreter(model_path=str(model_path), num_threads=num_threads)
         self._interpreter.allocate_tensors()
 
         input_details = self._interpreter.get_input_details()
@@ -28,10 +99,17 @@ class Predictor:
         assert len(output_details) == 1
         self._input_index = input_details[0]['index']
         self._output_index = output_details[0]['index']
+        # (height, width, channels) of one image, as declared by the model
+        self._input_shape = tuple(int(dim) for dim in input_details[0]['shape'][1:])
 
         input_size = int(input_details[0]['shape'][1])
         logger.debug(f"Model input size: {input_size}")
-        self._preprocessor = Preprocessor(input_size, is_bgr=IS_BGR)
+        self._input_size = input_size
+        self._preprocessor = Preprocessor(input_size, is_bgr=IS_BGR, fast=PREPROCESS_MODE == 'fast')
+
+        # Interpreters resized to a given batch size
+        self._batch_interpreters = {}
+        self._batch_supported = True
 
         self._labels = [label.strip() for label in labels_path.read_text().splitlines()]
         logger.debug(f"Model labels: {self._labels}")
@@ -40,52 +118,301 @@ class Predictor:
     def labels(self):
         return self._labels
 
+    @property
+    def input_size(self):
+        return self._input_size
+
+    @property
+    def input_shape(self):
+        return self._input_shape
+
+    def preprocess(self, image: PIL.Image.Image):
+        return self._preprocessor.preprocess(image)
+
+    def raw_pixels(self, data):
+        """
+        uint8 pixels of a frame already at the model input size: raw RGB bytes (viewed in place,
+        without a copy) or a PNG/JPEG decoded as is. No EXIF handling, resize or crop.
+        """
+        height, width, channels = self._input_shape
+        if len(data) == height * width * channels:
+            pixels = np.frombuffer(data, dtype=np.uint8).reshape(self._input_shape)
+        elif data[:8] == PNG_SIGNATURE or data[:3] == JPEG_SIGNATURE:
+            with image_stage('decode'):
+                image = PIL.Image.open(io.BytesIO(data))
+                if image.size != (width, height):
+                    raise InputShapeError(f"Image is {image.size[0]}x{image.size[1]}, the model expects {width}x{height}")
+                pixels = np.asarray(image.convert('RGB') if image.mode != 'RGB' else image)
+        else:
+            raise InputShapeError(
+                f"Raw input is {len(data)} bytes, the model expects {height}x{width}x{channels} uint8 "
+                f"({height * width * channels} bytes) or a {width}x{height} PNG/JPEG"
+            )
+        if IS_BGR:
+            pixels = pixels[:, :, ::-1]
+        return pixels
+
     def predict(self, image: PIL.Image.Image):
-        input_array = self._preprocessor.preprocess(image)
-        input_array = input_array[np.newaxis, :, :, :]
+        # Preprocess straight into the interpreter's own input tensor
+        return self._run_chunk([image], self._preprocessor.preprocess_into)[0]
+
+    def predict_batch(self, images, return_exceptions=False):
+        """
+        Classify several images with one interpreter invocation per batch of up to max(BATCH_SIZES).
+        With return_exceptions, an image that fails to decode gets the exception instead of outputs.
+        """
+        return self._run(images, self._preprocessor.preprocess_into, return_exceptions)
+
+    def predict_arrays(self, input_arrays):
+        """Classify already preprocessed input arrays, batching the interpreter invocations"""
+        return self._run(input_arrays, _copy_into)
+
+    def predict_inputs(self, items, return_exceptions=False):
+        """
+        Classify a mix of images, preprocessed straight into the input tensor, and
+        arrays already at the input size (raw pixels), copied into it
+        """
+        return self._run(items, self._write_input, return_exceptions)
+
+    def _write_input(self, item, out):
+        if isinstance(item, np.ndarray):
+            _copy_into(item, out)
+        else:
+            self._preprocessor.preprocess_into(item, out)
+
+    def _run(self, items, write_input, return_exceptions=False):
+        outputs = []
+        max_batch_size = BATCH_SIZES[-1] if self._batch_supported else 1
+        for start in range(0, len(items), max_batch_size):
+            outputs.extend(self._run_chunk(items[start:start + max_batch_size], write_input, return_exceptions))
+        return outputs
+
+    def _run_chunk(self, items, write_input, return_exceptions=False):
+        count = len(items)
+        batch_size = next(size for size in BATCH_SIZES if size >= count)
+        interpreter = self._get_interpreter(batch_size)
+        if interpreter is None:
+            # Model that cannot be resized: one invocation per item
+            return [output for item in items for output in self._run_chunk([item], write_input, return_exceptions)]
 
-        self._interpreter.set_tensor(self._input_index, input_array)
-        self._interpreter.invoke()
+        # write_input(item, out) fills each slot of the interpreter's input buffer in place.
+        # Views into tensor memory must be released before invoke(), which refuses to run
+        # while any are alive. Padding slots keep whatever they held, and so do the slots of
+        # failed items; their outputs are discarded.
+        failed = {}
+        input_view = interpreter.tensor(self._input_index)()
+        try:
+            for i, item in enumerate(items):
+                try:
+                    write_input(item, input_view[i])
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    # The traceback's frames hold views of the input tensor
+                    failed[i] = e.with_traceback(None)
+        finally:
+            del input_view
+        if len(failed) == count:
+            return [failed[i] for i in range(count)]
 
-        outputs = self._interpreter.get_tensor(self._output_index)
-        assert len(outputs) == 1
-        return outputs[0].tolist()
+        with image_stage('invoke'):
+            interpreter.invoke()
+
+        output_view = interpreter.tensor(self._output_index)()
+        outputs = output_view[:count].tolist()
+        del output_view
+        for i, e in failed.items():
+            outputs[i] = e
+        return outputs
+
+    def _get_interpreter(self, batch_size):
+        if batch_size == 1:
+            return self._interpreter
+
+        if batch_size not in self._batch_interpreters:
+            logger.debug(f"Allocating interpreter for batch size {batch_size}")
+            interpreter = tflite.Interpreter(model_path=str(self._model_path), num_threads=self._num_threads)
+            try:
+                interpreter.resize_tensor_input(self._input_index, [batch_size, self._input_size, self._input_size, 3])
+                interpreter.allocate_tensors()
+            except (RuntimeError, ValueError) as e:
+                # Models with a hard-coded batch dimension (e.g. a fixed RESHAPE) cannot be resized
+                logger.warning(f"Model does not support batch size {batch_size}, falling back to one image per invocation: {e}")
+                self._batch_supported = False
+                return None
+            self._batch_interpreters[batch_size] = interpreter
+        return self._batch_interpreters[batch_size]
+
+
+class PredictorPool:
+    """
+    A fixed set of independently allocated Predictors.
+
+    A tflite Interpreter must not be used by two threads at once, so each call
+    checks out a whole Predictor and preprocesses while holding it, straight into
+    the interpreter's input tensor.
+    """
+
+    def __init__(self, model_path, labels_path, size, num_threads=None):
+        assert size >= 1
+        logger.info(f"Allocating {size} interpreter(s) with num_threads={num_threads}")
+        self._predictors = [Predictor(model_path, labels_path, num_threads=num_threads) for _ in range(size)]
+        self._available = queue.Queue()
+        for predictor in self._predictors:
+            self._available.put(predictor)
+
+    @property
+    def size(self):
+        return len(self._predictors)
+
+    @property
+    def labels(self):
+        return self._predictors[0].labels
+
+    @property
+    def input_size(self):
+        return self._predictors[0].input_size
+
+    @contextlib.contextmanager
+    def checkout(self):
+        predictor = self._available.get()
+        try:
+            yield predictor
+        finally:
+            self._available.put(predictor)
+
+    @property
+    def input_shape(self):
+        return self._predictors[0].input_shape
+
+    def preprocess(self, image: PIL.Image.Image):
+        # Preprocessor holds no per-call state, so any pooled one can be shared
+        return self._predictors[0].preprocess(image)
+
+    def raw_pixels(self, data):
+        return self._predictors[0].raw_pixels(data)
+
+    def predict(self, image: PIL.Image.Image):
+        with self.checkout() as predictor:
+            return predictor.predict(image)
+
+    def predict_batch(self, images, return_exceptions=False):
+        with self.checkout() as predictor:
+            return predictor.predict_batch(images, return_exceptions)
+
+    def predict_arrays(self, input_arrays):
+        with self.checkout() as predictor:
+            return predictor.predict_arrays(input_arrays)
+
+    def predict_inputs(self, items, return_exceptions=False):
+        with self.checkout() as predictor:
+            return predictor.predict_inputs(items, return_exceptions)
+
+    def stats(self):
+        return {'size': self.size, 'available': self._available.qsize()}
+
+
+def _copy_into(input_array, out):
+    with image_stage('tensor_write'):
+        out[...] = input_array
 
 
 class Preprocessor:
-    def __init__(self, input_size: int, is_bgr: bool):
+    """
+    Resizes the shorter side to input_size, center-crops a square and returns float32 pixels.
+
+    In fast mode, JPEGs are decoded directly at reduced scale (Image.draft) to
+    just above the size needed, and resize and crop are merged into a single
+    resize(box=...) call. The result is close to, but not bit-identical with,
+    the standard pipeline.
+    """
+
+    def __init__(self, input_size: int, is_bgr: bool, fast: bool = False):
         self._input_size = input_size
         self._is_bgr = is_bgr
+        self._fast = fast
 
     def preprocess(self, image: PIL.Image.Image):
-        image = self._update_orientation(image)
-        image = self._resize_keep_aspect_ratio(image)
-        image = self._crop_center(image)
+        np_array = np.empty((self._input_size, self._input_size, 3), dtype=np.float32)
+        return self.preprocess_into(image, np_array)
+
+    def preprocess_into(self, image: PIL.Image.Image, out: np.ndarray):
+        """Preprocess image and write the float32 pixels into the preallocated out array"""
+        if self._fast:
+            image = self._fast_resize_crop(image)
+        else:
+            with image_stage('exif'):
+                orientation = self._get_orientation(image)
+            with image_stage('decode'):
+                image.load()
+            with image_stage('resize'):
+                image = self._apply_orientation(image, orientation)
+                image = self._resize_keep_aspect_ratio(image)
+                image = self._crop_center(image)
+
+        with image_stage('tensor_write'):
+            image = image.convert('RGB') if image.mode != 'RGB' else image
+            pixels = np.asarray(image)
+            if self._is_bgr:
+                pixels = pixels[:, :, (2, 1, 0)]
+            out[...] = pixels
+        return out
 
-        image = image.convert('RGB') if image.mode != 'RGB' else image
-        np_array = np.array(image, dtype=np.float32)
-        if self._is_bgr:
-            np_array = np_array[:, :, (2, 1, 0)]
-        return np_array
+    def _fast_resize_crop(self, image: PIL.Image.Image):
+        with image_stage('exif'):
+            orientation = self._get_orientation(image)
+        width, height = image.size
+        if orientation >= 4:
+            width, height = height, width
+
+        # Crop box in (oriented) full-resolution coordinates, same geometry as the standard pipeline
+        new_width, new_height = self._resized_size(width, height)
+        left = (new_width - self._input_size) // 2
+        top = (new_height - self._input_size) // 2
+        scale_x = width / new_width
+        scale_y = height / new_height
+
+        # Let the JPEG decoder skip detail we would throw away (DCT scaling by 1/2, 1/4 or 1/8)
+        draft_size = (new_height, new_width) if orientation >= 4 else (new_width, new_height)
+        image.draft('RGB', draft_size)
+        with image_stage('decode'):
+            image.load()
+        with image_stage('resize'):
+            image = self._apply_orientation(image, orientation)
 
-    def _update_orientation(self, image: PIL.Image.Image):
+        # The decoded image may be smaller than the original: rescale the box accordingly
+        draft_x = image.size[0] / width
+        draft_y = image.size[1] / height
+        box = (
+            left * scale_x * draft_x,
+            top * scale_y * draft_y,
+            (left + self._input_size) * scale_x * draft_x,
+            (top + self._input_size) * scale_y * draft_y
+        )
+        with image_stage('resize'):
+            return image.resize((self._input_size, self._input_size), PIL.Image.BILINEAR, box=box, reducing_gap=3.0)
+
+    def _get_orientation(self, image: PIL.Image.Image):
+        """0-based EXIF orientation (0 when absent)"""
         exif_orientation_tag = 0x0112
         if hasattr(image, '_getexif'):
             exif = image._getexif()
             if exif is not None and exif_orientation_tag in exif:
-                orientation = exif.get(exif_orientation_tag, 1)
-                # orientation is 1 based, shift to zero based and flip/transpose based on 0-based values
-                orientation -= 1
-                if orientation >= 4:
-                    image = image.transpose(PIL.Image.TRANSPOSE)
-                if orientation in [2, 3, 6, 7]:
-                    image = image.transpose(PIL.Image.FLIP_TOP_BOTTOM)
-                if orientation in [1, 2, 5, 6]:
-                    image = image.transpose(PIL.Image.FLIP_LEFT_RIGHT)
+                # orientation is 1 based, shift to zero based
+                return exif.get(exif_orientation_tag, 1) - 1
+        return 0
+
+    def _apply_orientation(self, image: PIL.Image.Image, orientation: int):
+        # flip/transpose based on 0-based orientation values
+        if orientation >= 4:
+            image = image.transpose(PIL.Image.TRANSPOSE)
+        if orientation in [2, 3, 6, 7]:
+            image = image.transpose(PIL.Image.FLIP_TOP_BOTTOM)
+        if orientation in [1, 2, 5, 6]:
+            image = image.transpose(PIL.Image.FLIP_LEFT_RIGHT)
         return image
 
-    def _resize_keep_aspect_ratio(self, image: PIL.Image.Image):
-        width, height = image.size
+    def _resized_size(self, width: int, height: int):
         aspect_ratio = width / height
         if width < height:
             new_width = self._input_size
@@ -93,6 +420,10 @@ class Preprocessor:
         else:
             new_height = self._input_size
             new_width = round(new_height * aspect_ratio)
+        return new_width, new_height
+
+    def _resize_keep_aspect_ratio(self, image: PIL.Image.Image):
+        new_width, new_height = self._resized_size(*image.size)
         return image.resize((new_width, new_height), PIL.Image.BILINEAR)
 
     def _crop_center(self, image: PIL.Image.Image):
@@ -104,24 +435,363 @@ class Preprocessor:
         return image.crop((left, top, right, bottom))
 
 
+class ServedModel:
+    """One model iteration as served: its interpreter pool, micro-batcher and prediction cache"""
+
+    def __init__(self, model_path, labels_path):
+        self.predictor = PredictorPool(model_path, labels_path, PREDICTOR_POOL_SIZE, num_threads=INTERPRETER_NUM_THREADS)
+
+        # Cached outputs belong to this model only
+        self.cache = LRUCache(max_bytes=IMAGE_CACHE_MAX_BYTES, ttl_seconds=IMAGE_CACHE_TTL_SECONDS) if IMAGE_CACHE_MAX_BYTES > 0 else None
+
+        self.batcher = None
+        if MICRO_BATCHING:
+            # One batcher worker per pooled interpreter, so batches run in parallel. Images are
+            # queued undecoded and preprocessed by the worker straight into the tensor slots;
+            # an image that fails to decode only fails its own request.
+            self.batcher = MicroBatcher(
+                functools.partial(self.predictor.predict_inputs, return_exceptions=True),
+                MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS, name='image-batcher', workers=self.predictor.size
+            )
+            logger.info(f"Micro-batching enabled (max batch size {MICRO_BATCH_MAX_SIZE}, max wait {MICRO_BATCH_MAX_WAIT_MS} ms)")
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+
+
 def initialize():
-    global global_predictor
-    global_predictor = Predictor(MODEL_PATH, LABELS_PATH)
+    start = time.perf_counter()
+    load_state.update(status='loading', error=None)
+    try:
+        _initialize()
+    except Exception as e:
+        load_state.update(status='failed', error=str(e))
+        raise
+    finally:
+        load_state.update(load_seconds=time.perf_counter() - start, loaded_at=datetime.datetime.utcnow().isoformat())
+    load_state['status'] = 'ready'
+
+
+def _initialize():
+    global model_registry, global_fetcher
+    if model_registry is not None:
+        model_registry.close()
+    model_registry = ModelRegistry(ServedModel, MODEL_PUBLISHED_NAME, verify_sha1=MODEL_VERIFY_SHA1, strict=MODEL_ROUTING_STRICT)
+    model_registry.load(ModelSource(MODEL_PUBLISHED_NAME, MODEL_PATH, LABELS_PATH, MANIFEST_PATH if MANIFEST_PATH.exists() else None))
+    if MODEL_REGISTRY_DIR:
+        model_registry.load_directory(MODEL_REGISTRY_DIR)
+    if MODEL_WATCH_INTERVAL > 0:
+        model_registry.start_watching(MODEL_WATCH_INTERVAL)
+
+    if global_fetcher is not None:
+        global_fetcher.close()
+    global_fetcher = HTTPFetcher(
+        connect_timeout=URL_FETCH_CONNECT_TIMEOUT,
+        read_timeout=URL_FETCH_READ_TIMEOUT,
+        total_timeout=URL_FETCH_TOTAL_TIMEOUT,
+        max_bytes=URL_FETCH_MAX_BYTES,
+        max_connections_per_host=URL_FETCH_CONNECTIONS_PER_HOST,
+        workers=URL_FETCH_WORKERS
+    )
+
+
+def reload_models(name=None):
+    """Reload one published model (or all of them) from disk; requests in flight finish on the old version"""
+    assert model_registry is not None
+    return [version.info() for version in model_registry.reload(name)]
+
+
+def get_models_info():
+    if model_registry is None:
+        return {'default': MODEL_PUBLISHED_NAME, 'models': [], 'errors': {}}
+    return model_registry.info()
+
+
+def get_load_state():
+    return dict(load_state)
+
+
+def _default_served():
+    if model_registry is None:
+        return None
+    try:
+        return model_registry.get().served
+    except UnknownModel:
+        return None
+
+
+def get_pool_stats():
+    served = _default_served()
+    if served is None:
+        return {'size': 0, 'available': 0}
+    return served.predictor.stats()
+
+
+def get_batching_stats():
+    served = _default_served()
+    if served is None or served.batcher is None:
+        return {'enabled': False}
+    return {'enabled': True, **served.batcher.stats()}
+
+
+def get_cache_stats():
+    served = _default_served()
+    if served is None or served.cache is None:
+        return {'enabled': False}
+    return {'enabled': True, **served.cache.stats()}
 
 
-def predict_image(pil_image):
+def get_fetch_stats():
+    if global_fetcher is None:
+        return {'enabled': False}
+    return {'enabled': True, **global_fetcher.stats()}
+
+
+@contextlib.contextmanager
+def _using_model(model_name):
+    """The served model for a published name (None: the default), held until the block exits"""
+    assert model_registry is not None
+    with model_registry.acquire(model_name) as version:
+        yield version.served
+
+
+def _build_response(served, outputs):
+    predictions = [{'tagName': label, 'probability': round(p, 8), 'tagId': '', 'boundingBox': None} for label, p in zip(served.predictor.labels, outputs)]
+    return {'id': '', 'project': '', 'iteration': '', 'created': datetime.datetime.utcnow().isoformat(), 'predictions': predictions}
+
+
+def _predict_outputs(served, pil_image):
+    if served.batcher is not None:
+        # Preprocessed by the batcher into its slot of a shared batch
+        return served.batcher.submit(pil_image)
+    return served.predictor.predict(pil_image)
+
+
+def _predict_outputs_batch(served, pil_images, return_exceptions=False):
+    """Outputs for each image; with return_exceptions, an image that fails to decode gets the exception"""
+    if served.batcher is None:
+        return served.predictor.predict_batch(pil_images, return_exceptions)
+    futures = [served.batcher.submit_async(pil_image) for pil_image in pil_images]
+    if return_exceptions:
+        return [future.exception() or future.result() for future in futures]
+    return [future.result() for future in futures]
+
+
+def _content_key(image_bytes, person=b''):
+    # person separates key spaces: the same bytes read as raw pixels or as an encoded image differ
+    return hashlib.blake2b(image_bytes, digest_size=16, person=person).digest()
+
+
+def _cache_get(served, key):
+    return served.cache.get(key) if served.cache is not None else None
+
+
+def _cache_put(served, key, outputs):
+    if served.cache is not None:
+        served.cache.put(key, outputs)
+
+
+def predict_image(pil_image, model_name=None):
     assert isinstance(pil_image, PIL.Image.Image)
-    global global_predictor
-    assert global_predictor is not None
-    outputs = global_predictor.predict(pil_image)
-    predictions = [{'tagName': label, 'probability': round(p, 8), 'tagId': '', 'boundingBox': None} for label, p in zip(global_predictor.labels, outputs)]
-    response = {'id': '', 'project': '', 'iteration': '', 'created': datetime.datetime.utcnow().isoformat(), 'predictions': predictions}
+    with _using_model(model_name) as served:
+        outputs = _predict_outputs(served, pil_image)
+        response = _build_response(served, outputs)
 
     return response
 
 
-def predict_url(image_url):
+def predict_image_batch(pil_images, model_name=None):
+    assert all(isinstance(pil_image, PIL.Image.Image) for pil_image in pil_images)
+    with _using_model(model_name) as served:
+        outputs = _predict_outputs_batch(served, pil_images)
+        return [_build_response(served, output) for output in outputs]
+
+
+def _predict_bytes_outputs(served, image_bytes):
+    key = _content_key(image_bytes)
+    outputs = _cache_get(served, key)
+    if outputs is None:
+        outputs = _predict_outputs(served, PIL.Image.open(io.BytesIO(image_bytes)))
+        _cache_put(served, key, outputs)
+    return outputs
+
+
+def predict_image_bytes(image_bytes, model_name=None):
+    """Classify an encoded image; a cache hit skips decode, preprocessing and inference"""
+    with _using_model(model_name) as served:
+        return _build_response(served, _predict_bytes_outputs(served, image_bytes))
+
+
+def predict_image_raw(data, model_name=None):
+    """
+    Classify a frame already at the model input size (raw RGB uint8 bytes, or a PNG/JPEG of exactly
+    that size): the pixels are copied straight into the input tensor, skipping EXIF handling,
+    resize and crop. Raises InputShapeError when the input does not match the model.
+    """
+    with _using_model(model_name) as served:
+        key = _content_key(data, person=b'raw')
+        outputs = _cache_get(served, key)
+        if outputs is None:
+            pixels = served.predictor.raw_pixels(data)
+            if served.batcher is not None:
+                outputs = served.batcher.submit(pixels)
+            else:
+                outputs = served.predictor.predict_arrays([pixels])[0]
+            _cache_put(served, key, outputs)
+        return _build_response(served, outputs)
+
+
+def get_input_shape(model_name=None):
+    if model_registry is None:
+        return None
+    return list(model_registry.get(model_name).served.predictor.input_shape)
+
+
+def _predict_bytes_outputs_batch(served, image_bytes_list):
+    """Outputs for each encoded image, or the exception raised while decoding it"""
+    results = [None] * len(image_bytes_list)
+    pending = []
+    for i, image_bytes in enumerate(image_bytes_list):
+        key = _content_key(image_bytes)
+        outputs = _cache_get(served, key)
+        if outputs is not None:
+            results[i] = outputs
+            continue
+        try:
+            pending.append((i, key, PIL.Image.open(io.BytesIO(image_bytes))))
+        except Exception as e:
+            results[i] = e
+
+    if pending:
+        # The pixels are only decoded while preprocessing: a truncated image fails there, on its own
+        for (i, key, _), outputs in zip(pending, _predict_outputs_batch(served, [image for _, _, image in pending], return_exceptions=True)):
+            if not isinstance(outputs, Exception):
+                _cache_put(served, key, outputs)
+            results[i] = outputs
+    return results
+
+
+def predict_image_bytes_batch(image_bytes_list, model_name=None):
+    """Classify several encoded images; images that cannot be decoded get an 'error' entry"""
+    with _using_model(model_name) as served:
+        return [
+            {'error': f'Error processing image: {str(outputs)}'} if isinstance(outputs, Exception) else _build_response(served, outputs)
+            for outputs in _predict_bytes_outputs_batch(served, image_bytes_list)
+        ]
+
+
+def _url_key(image_url, etag):
+    # Same URL and ETag means same content: the download can be skipped too
+    return ('url', image_url, etag) if etag else None
+
+
+def _remember_url(served, image_url, etag, outputs):
+    """Cache the outputs for the URL's ETag, and the ETag itself for the next conditional GET"""
+    url_key = _url_key(image_url, etag)
+    if url_key:
+        _cache_put(served, url_key, outputs)
+        _cache_put(served, ('url-etag', image_url), etag)
+
+
+def _known_etag(served, image_url):
+    return _cache_get(served, ('url-etag', image_url))
+
+
+def conditional_headers(image_url, model_name=None):
+    """If-None-Match for a URL already classified, so an unchanged image comes back as a bodiless 304"""
+    with _using_model(model_name) as served:
+        etag = _known_etag(served, image_url)
+    return ({'If-None-Match': etag} if etag else {}), etag
+
+
+def _cached_url_response(served, image_url, etag):
+    url_key = _url_key(image_url, etag)
+    outputs = _cache_get(served, url_key) if url_key else None
+    return _build_response(served, outputs) if outputs is not None else None
+
+
+def predict_cached_url(image_url, etag, model_name=None):
+    """Response for a URL already classified with the same ETag, or None"""
+    with _using_model(model_name) as served:
+        return _cached_url_response(served, image_url, etag)
+
+
+def _fetch_url(served, image_url):
+    """
+    Cached response for the URL's ETag if any, else the download: (image_url, etag, image_bytes).
+    A URL already classified is fetched with If-None-Match: the 304 has no body to skip, so the
+    keep-alive connection goes back to the pool.
+    """
+    known_etag = _known_etag(served, image_url)
+    headers = {'If-None-Match': known_etag} if known_etag else None
+    with global_fetcher.open(image_url, headers) as response:
+        if response.status == 304:
+            response.read()
+            etag = known_etag
+        else:
+            etag = response.headers.get('ETag')
+        cached = _cached_url_response(served, image_url, etag)
+        if cached is not None:
+            return cached
+        if response.status != 304:
+            return image_url, etag, response.read()
+    # The outputs were evicted since the ETag was sent: download again
+    return _download_url(image_url)
+
+
+def _download_url(image_url):
+    with global_fetcher.open(image_url) as response:
+        return image_url, response.headers.get('ETag'), response.read()
+
+
+def predict_url(image_url, model_name=None):
     logger.info(f"Predicting image from {image_url}")
-    with urllib.request.urlopen(image_url) as f:
-        image = PIL.Image.open(f)
-        return predict_image(image)
+    with _using_model(model_name) as served:
+        fetched = _fetch_url(served, image_url)
+        if isinstance(fetched, dict):
+            return fetched
+
+        image_url, etag, image_bytes = fetched
+        outputs = _predict_bytes_outputs(served, image_bytes)
+        _remember_url(served, image_url, etag, outputs)
+        return _build_response(served, outputs)
+
+
+def _predict_fetched(served, fetched):
+    results = [None] * len(fetched)
+    pending = []
+    for i, result in enumerate(fetched):
+        if isinstance(result, Exception):
+            results[i] = {'error': f'Error fetching image: {str(result)}'}
+        elif isinstance(result, dict):
+            results[i] = result
+        else:
+            pending.append((i, result))
+
+    if pending:
+        for (i, (image_url, etag, _)), outputs in zip(pending, _predict_bytes_outputs_batch(served, [download[2] for _, download in pending])):
+            if isinstance(outputs, Exception):
+                results[i] = {'error': f'Error processing image: {str(outputs)}'}
+                continue
+            _remember_url(served, image_url, etag, outputs)
+            results[i] = _build_response(served, outputs)
+    return results
+
+
+def predict_fetched_urls(fetched, model_name=None):
+    """
+    Classify the results of fetching several URLs together. Each entry is a cached
+    response, a download (image_url, etag, image_bytes) or the exception raised
+    while fetching; failed fetches and undecodable images get an 'error' entry
+    """
+    with _using_model(model_name) as served:
+        return _predict_fetched(served, fetched)
+
+
+def predict_url_batch(image_urls, model_name=None):
+    """Download several URLs concurrently, then classify the images together"""
+    logger.info(f"Predicting {len(image_urls)} images from URLs")
+    with _using_model(model_name) as served:
+        fetched = global_fetcher.fetch_many(lambda image_url: _fetch_url(served, image_url), image_urls)
+        return _predict_fetched(served, fetched)
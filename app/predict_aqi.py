@@ -1,78 +1,137 @@
+import datetime
+import hashlib
+import json
 import os
 import pickle
 import logging
+import time
 import pandas as pd
 import numpy as np
+import sklearn
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from pathlib import Path
+import aqi_categories
+from aqi_schema import ReadingSchema
+from cache import LRUCache
+from compiled_forest import CompiledForest
+from metrics import aqi_stage
+from model_format import read_flat, write_flat
 
 logger = logging.getLogger(__name__)
 aqi_model = None
 scaler = None
-MODEL_PATH = Path('aqi_model/simple_model.pkl')
-
-# Mapping des valeurs AQI vers les catégories
-AQI_CATEGORIES = {
-    (0, 50): "GOOD",
-    (51, 100): "MODERATE", 
-    (101, 150): "UNHEALTHY_SENSITIVE_GROUP",
-    (151, 200): "UNHEALTHY",
-    (201, 300): "VERY_UNHEALTHY",
-    (301, float('inf')): "SEVERE"
-}
+compiled_forest = None
+model_metadata = {}
+MODEL_PATH = Path(os.environ.get('AQI_MODEL_PATH', 'aqi_model/simple_model.pkl'))
+DATASET_PATH = Path(os.environ.get('AQI_DATASET_PATH', 'air_pollution_data.csv'))
+
+# Le modèle est produit hors ligne (train_aqi.py, pendant le build de l'image).
+# AQI_TRAIN_ON_STARTUP=1 rétablit l'entraînement au démarrage si le pickle manque.
+AQI_TRAIN_ON_STARTUP = os.environ.get('AQI_TRAIN_ON_STARTUP', '0') == '1'
+
+# Entraînement: arbres en parallèle sur tous les coeurs, CSV lu par blocs de TRAIN_CHUNK_ROWS lignes
+TRAIN_N_JOBS = int(os.environ.get('AQI_TRAIN_N_JOBS', '-1'))
+TRAIN_CHUNK_ROWS = int(os.environ.get('AQI_TRAIN_CHUNK_ROWS', '100000'))
+
+# État du chargement, exposé par /ready
+load_state = {'status': 'not_loaded', 'load_seconds': None, 'loaded_at': None, 'version': None, 'error': None}
+
+# Ordre des features attendu par le scaler et le modèle
+REQUIRED_FEATURES = ['co', 'no', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3']
+
+# Chemin d'inférence:
+#   'compiled' - normalisation numpy + forêt aplatie (CompiledForest)
+#   'numpy'    - normalisation numpy + RandomForestRegressor.predict
+#   'pandas'   - DataFrame + StandardScaler.transform + RandomForestRegressor.predict
+INFERENCE_BACKENDS = ('compiled', 'numpy', 'pandas')
+INFERENCE_BACKEND = os.environ.get('AQI_INFERENCE_BACKEND', 'compiled')
+
+# Cache des prédictions, indexé par le vecteur de features arrondi à AQI_CACHE_DECIMALS décimales:
+# deux relevés identiques à cette précision partagent la même prédiction. 0 entrée le désactive.
+AQI_CACHE_MAX_ENTRIES = int(os.environ.get('AQI_CACHE_MAX_ENTRIES', '10000'))
+AQI_CACHE_DECIMALS = int(os.environ.get('AQI_CACHE_DECIMALS', '2'))
+prediction_cache = LRUCache(max_entries=AQI_CACHE_MAX_ENTRIES) if AQI_CACHE_MAX_ENTRIES > 0 else None
+
+# Paramètres du scaler précalculés pour le chemin numpy
+feature_order = list(REQUIRED_FEATURES)
+scaler_mean = None
+scaler_scale = None
+
+# Validation et conversion des relevés, compilées pour l'ordre des features du modèle
+reading_schema = ReadingSchema(feature_order)
 
 def get_aqi_category(aqi_value):
     """Convertit une valeur AQI numérique en catégorie"""
-    for (min_val, max_val), category in AQI_CATEGORIES.items():
-        if min_val <= aqi_value <= max_val:
-            return category
-    return "UNKNOWN"
+    return aqi_categories.category(aqi_value)
+
+def load_training_data(csv_path, chunk_rows=None, max_rows=None, random_state=42):
+    """
+    Lit le CSV par blocs (seules les colonnes de features, en float32), calcule la cible
+    bloc par bloc et écarte les lignes incomplètes. Avec max_rows, garde un échantillon
+    uniforme de max_rows lignes (échantillonnage par réservoir), quelle que soit la taille du fichier.
+    Renvoie (X float32, y float64, nombre de lignes lues)
+    """
+    chunk_rows = chunk_rows or TRAIN_CHUNK_ROWS
+    rng = np.random.default_rng(random_state)
+    X_parts, y_parts, key_parts = [], [], []
+    kept = 0
+    n_read = 0
+
+    reader = pd.read_csv(
+        csv_path,
+        usecols=REQUIRED_FEATURES,
+        dtype={feature: np.float32 for feature in REQUIRED_FEATURES},
+        chunksize=chunk_rows
+    )
+    for chunk in reader:
+        n_read += len(chunk)
+        X_chunk = chunk[REQUIRED_FEATURES].to_numpy(dtype=np.float32)
+        # Cible: AQI estimé, maximum des sous-indices par polluant
+        y_chunk = aqi_categories.estimated_aqi(X_chunk, REQUIRED_FEATURES)
+
+        # Nettoyer les données
+        mask = ~(np.isnan(X_chunk).any(axis=1) | np.isnan(y_chunk))
+        X_parts.append(X_chunk[mask])
+        y_parts.append(y_chunk[mask])
+        kept += int(mask.sum())
+
+        if max_rows is not None:
+            # Réservoir: chaque ligne reçoit une clé aléatoire, on garde les max_rows plus petites
+            key_parts.append(rng.random(int(mask.sum())))
+            if kept > max_rows:
+                keys = np.concatenate(key_parts)
+                keep = np.sort(np.argpartition(keys, max_rows - 1)[:max_rows])
+                X_parts = [np.concatenate(X_parts)[keep]]
+                y_parts = [np.concatenate(y_parts)[keep]]
+                key_parts = [keys[keep]]
+                kept = max_rows
+
+    X = np.concatenate(X_parts) if X_parts else np.empty((0, len(REQUIRED_FEATURES)), dtype=np.float32)
+    y = np.concatenate(y_parts) if y_parts else np.empty(0)
+    return X, y, n_read
 
-def train_simple_model():
-    """Entraîne un modèle simple avec le dataset CSV"""
+def train_simple_model(n_jobs=None, chunk_rows=None, max_rows=None, max_samples=None):
+    """
+    Entraîne un modèle simple avec le dataset CSV
+    n_jobs: arbres entraînés en parallèle (défaut AQI_TRAIN_N_JOBS, -1 = tous les coeurs)
+    max_rows: échantillon maximal de lignes gardées en mémoire pour les très gros datasets
+    max_samples: part des lignes tirée pour chaque arbre (bootstrap), borne le coût par arbre
+    """
     logger.info("Training simple AQI model from dataset...")
     
     # Lire le dataset depuis le fichier CSV
-    csv_path = Path('air_pollution_data.csv')
+    csv_path = DATASET_PATH
     if not csv_path.exists():
         logger.error("Dataset CSV not found")
         return False
     
     try:
-        # Charger les données
-        df = pd.read_csv(csv_path)
-        logger.info(f"Loaded dataset with {len(df)} rows")
-        
-        # Préparer les features et target
-        feature_cols = ['co', 'no', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3']
-        X = df[feature_cols].copy()
-        
-        # Pour ce dataset, l'AQI semble être dans l'intervalle 1-5
-        # Convertissons-le vers une échelle 0-300 plus réaliste
-        # En analysant les données PM2.5, on peut faire une estimation
-        def estimate_realistic_aqi(row):
-            pm25 = row['pm2_5']
-            pm10 = row['pm10']
-            no2 = row['no2']
-            o3 = row['o3']
-            
-            # Formule simplifiée basée sur les principaux polluants
-            aqi_pm25 = min(300, max(0, pm25 * 2))  # PM2.5 contribue beaucoup
-            aqi_pm10 = min(300, max(0, pm10 * 1.5))
-            aqi_no2 = min(300, max(0, no2 * 2))
-            aqi_o3 = min(300, max(0, o3 * 1.2))
-            
-            # Prendre le maximum (comme dans le vrai calcul AQI)
-            return max(aqi_pm25, aqi_pm10, aqi_no2, aqi_o3)
-        
-        y = df.apply(estimate_realistic_aqi, axis=1)
-        
-        # Nettoyer les données
-        mask = ~(X.isnull().any(axis=1) | y.isnull())
-        X = X[mask]
-        y = y[mask]
+        # Charger les données et calculer la cible, par blocs
+        feature_cols = list(REQUIRED_FEATURES)
+        X, y, n_read = load_training_data(csv_path, chunk_rows=chunk_rows, max_rows=max_rows)
+        logger.info(f"Loaded dataset with {n_read} rows")
         
         logger.info(f"Training with {len(X)} clean samples")
         logger.info(f"AQI range: {y.min():.1f} - {y.max():.1f}")
@@ -82,11 +141,11 @@ def train_simple_model():
             X, y, test_size=0.2, random_state=42
         )
         
-        # Normaliser les features
+        # Normaliser les features (noms de colonnes conservés pour le chemin pandas)
         global scaler
         scaler = StandardScaler()
-        X_train_scaled = scaler.fit_transform(X_train)
-        X_test_scaled = scaler.transform(X_test)
+        X_train_scaled = scaler.fit_transform(pd.DataFrame(X_train, columns=feature_cols, copy=False))
+        X_test_scaled = scaler.transform(pd.DataFrame(X_test, columns=feature_cols, copy=False))
         
         # Entraîner le modèle
         global aqi_model
@@ -94,11 +153,17 @@ def train_simple_model():
             n_estimators=100,
             random_state=42,
             max_depth=15,
-            min_samples_split=5
+            min_samples_split=5,
+            max_samples=max_samples,
+            n_jobs=TRAIN_N_JOBS if n_jobs is None else n_jobs
         )
         
         aqi_model.fit(X_train_scaled, y_train)
         
+        # Prédiction séquentielle au service: avec n_jobs, sklearn somme les arbres dans
+        # un ordre non déterministe et les résultats ne seraient plus reproductibles
+        aqi_model.set_params(n_jobs=None)
+        
         # Évaluer le modèle
         train_score = aqi_model.score(X_train_scaled, y_train)
         test_score = aqi_model.score(X_test_scaled, y_test)
@@ -106,16 +171,40 @@ def train_simple_model():
         logger.info(f"Model training completed")
         logger.info(f"Train R²: {train_score:.3f}, Test R²: {test_score:.3f}")
         
+        # Version: date d'entraînement + empreinte du dataset
+        global model_metadata
+        trained_at = datetime.datetime.utcnow()
+        dataset_sha1 = _file_sha1(csv_path)
+        model_metadata = {
+            'version': f"{trained_at:%Y%m%d%H%M%S}-{dataset_sha1[:8]}",
+            'trained_at': trained_at.isoformat(),
+            'dataset': csv_path.name,
+            'dataset_sha1': dataset_sha1,
+            'n_samples': int(len(X)),
+            'n_rows_read': int(n_read),
+            'train_r2': float(train_score),
+            'test_r2': float(test_score),
+            'sklearn_version': sklearn.__version__
+        }
+        
         # Sauvegarder le modèle
         model_data = {
             'model': aqi_model,
             'scaler': scaler,
-            'feature_names': feature_cols
+            'feature_names': feature_cols,
+            'metadata': model_metadata
         }
         
-        MODEL_PATH.parent.mkdir(exist_ok=True)
+        MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
         with open(MODEL_PATH, 'wb') as f:
             pickle.dump(model_data, f)
+        # Manifeste lisible sans désérialiser le pickle
+        with open(get_manifest_path(), 'w') as f:
+            json.dump(model_metadata, f, indent=2)
+        
+        _prepare_numpy_inference(feature_cols)
+        _compile_forest()
+        invalidate_prediction_cache()
         
         logger.info(f"Model saved to {MODEL_PATH}")
         return True
@@ -124,103 +213,405 @@ def train_simple_model():
         logger.error(f"Error training model: {str(e)}")
         return False
 
-def initialize_aqi_model():
-    """Initialise le modèle AQI"""
-    global aqi_model, scaler
+def set_inference_backend(backend):
+    """Choisit le chemin d'inférence ('compiled', 'numpy' ou 'pandas')"""
+    global INFERENCE_BACKEND
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {INFERENCE_BACKENDS})")
+    INFERENCE_BACKEND = backend
+    # Le modèle plat ne contient que la forêt compilée: les autres chemins ont besoin du pickle
+    if backend != 'compiled' and compiled_forest is not None and aqi_model is None:
+        _load_pickle_model()
+    # Chaque chemin recalcule ses propres prédictions
+    invalidate_prediction_cache()
+
+def _prepare_numpy_inference(feature_names):
+    """
+    Précalcule moyenne/écart-type du scaler et l'ordre des features,
+    pour normaliser sans DataFrame ni vérification des noms de colonnes sklearn
+    """
+    global feature_order, scaler_mean, scaler_scale, reading_schema
+
+    feature_order = list(feature_names)
+    reading_schema = ReadingSchema(feature_order)
+    n_features = len(feature_order)
+
+    # Même arithmétique que StandardScaler.transform: (X - mean_) / scale_ en float64
+    mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+    scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+    scaler_mean = np.ascontiguousarray(mean, dtype=np.float64)
+    scaler_scale = np.ascontiguousarray(scale, dtype=np.float64)
+
+def invalidate_prediction_cache():
+    """Vide le cache des prédictions (à appeler dès que le modèle change)"""
+    if prediction_cache is not None:
+        prediction_cache.clear()
+
+def get_cache_stats():
+    if prediction_cache is None:
+        return {'enabled': False}
+    return {'enabled': True, 'decimals': AQI_CACHE_DECIMALS, **prediction_cache.stats()}
+
+def _cache_key(feature_values):
+    """Clé canonique: features dans l'ordre du modèle, arrondies à la précision configurée"""
+    return tuple(round(value, AQI_CACHE_DECIMALS) for value in feature_values)
+
+def _file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_manifest_path():
+    """Manifeste JSON (version, dataset, scores) écrit à côté de simple_model.pkl"""
+    return MODEL_PATH.with_suffix('.json')
+
+def get_load_state():
+    return dict(load_state)
+
+def get_flat_model_path():
+    """Modèle plat projetable en mémoire (forêt compilée + scaler), écrit à côté de simple_model.pkl"""
+    return MODEL_PATH.with_suffix('.bin')
+
+def export_flat_model(path=None):
+    """Écrit la forêt compilée, les paramètres du scaler et les métadonnées au format plat (model_format)"""
+    path = path or get_flat_model_path()
+    write_flat(
+        path,
+        {**compiled_forest.to_arrays(), 'scaler_mean': scaler_mean, 'scaler_scale': scaler_scale},
+        header={'max_depth': compiled_forest.max_depth, 'feature_names': feature_order, 'metadata': model_metadata}
+    )
+    logger.info(f"Flat model saved to {path} ({compiled_forest.n_estimators} trees, {compiled_forest.n_nodes} nodes)")
+
+def _flat_model_is_current():
+    flat_path = get_flat_model_path()
+    if not flat_path.exists():
+        return False
+    return not MODEL_PATH.exists() or flat_path.stat().st_mtime >= MODEL_PATH.stat().st_mtime
+
+def _load_flat_model():
+    """
+    Projette le modèle plat en mémoire, en lecture seule: ni désérialisation ni copie,
+    et les workers qui chargent le même fichier partagent ses pages
+    """
+    global aqi_model, scaler, compiled_forest, scaler_mean, scaler_scale, feature_order, model_metadata, reading_schema
+
+    arrays, header = read_flat(get_flat_model_path())
+    compiled_forest = CompiledForest.from_arrays(arrays, header['max_depth'])
+    scaler_mean = arrays['scaler_mean']
+    scaler_scale = arrays['scaler_scale']
+    feature_order = list(header['feature_names'])
+    reading_schema = ReadingSchema(feature_order)
+    model_metadata = header.get('metadata', {})
+    # Le modèle sklearn n'est chargé que si un chemin 'numpy' ou 'pandas' est choisi
+    aqi_model = None
+    scaler = None
+
+def _try_load_flat_model():
+    logger.info(f"Mapping flat AQI model from {get_flat_model_path()}")
+    try:
+        _load_flat_model()
+        return True
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not load flat model, falling back to {MODEL_PATH}: {str(e)}")
+        return False
+
+def _load_pickle_model(export=None):
+    """
+    Charge le modèle sklearn et le scaler depuis simple_model.pkl, puis compile la forêt
+    export: réécrire le modèle plat à côté du pickle (défaut: s'il manque ou n'est pas à jour)
+    """
+    global aqi_model, scaler, model_metadata
+
+    with open(MODEL_PATH, 'rb') as f:
+        model_data = pickle.load(f)
+
+    aqi_model = model_data['model']
+    scaler = model_data['scaler']
+    model_metadata = model_data.get('metadata', {})
+    _prepare_numpy_inference(model_data.get('feature_names', REQUIRED_FEATURES))
+    _compile_forest(export=not _flat_model_is_current() if export is None else export)
+
+def _compile_forest(export=True):
+    """Aplatit aqi_model et, si demandé, l'exporte au format plat pour les prochains démarrages"""
+    global compiled_forest
+
+    compiled_forest = CompiledForest.from_sklearn(aqi_model)
+    if not export:
+        return
+    try:
+        export_flat_model()
+    except OSError as e:
+        logger.warning(f"Could not save flat model to {get_flat_model_path()}: {str(e)}")
+
+def convert_pickle_model(output=None):
+    """Convertit simple_model.pkl au format plat; renvoie le chemin écrit (et seulement celui-là)"""
+    _load_pickle_model(export=False)
+    output = output or get_flat_model_path()
+    export_flat_model(output)
+    return output
+
+def _features_to_array(readings):
+    """Convertit une liste de relevés (dict) en matrice float64 contiguë, dans l'ordre du modèle"""
+    return np.array(
+        [[float(reading[feature]) for feature in feature_order] for reading in readings],
+        dtype=np.float64
+    )
+
+def _predict_matrix(X):
+    """Normalise puis prédit une matrice de features (une ligne par relevé)"""
+    with aqi_stage('scale'):
+        if INFERENCE_BACKEND == 'pandas':
+            X_scaled = scaler.transform(pd.DataFrame(X, columns=feature_order))
+        else:
+            X_scaled = (X - scaler_mean) / scaler_scale
+
+    with aqi_stage('predict'):
+        if INFERENCE_BACKEND == 'compiled':
+            return compiled_forest.predict(X_scaled)
+        return aqi_model.predict(X_scaled)
+
+def is_model_loaded():
+    return compiled_forest is not None
+
+def initialize_aqi_model(train_if_missing=None):
+    """
+    Initialise le modèle AQI à partir de l'artefact produit par train_aqi.py
+    Sans artefact, n'entraîne que si train_if_missing (défaut: AQI_TRAIN_ON_STARTUP)
+    """
+    if train_if_missing is None:
+        train_if_missing = AQI_TRAIN_ON_STARTUP
+    
+    start = time.perf_counter()
+    load_state.update(status='loading', error=None)
+    loaded = False
     
     try:
-        # Essayer de charger le modèle simple d'abord
-        if MODEL_PATH.exists():
-            logger.info(f"Loading simple AQI model from {MODEL_PATH}")
-            with open(MODEL_PATH, 'rb') as f:
-                model_data = pickle.load(f)
+        # Modèle plat à jour: projeté en mémoire, sans désérialiser le pickle
+        if INFERENCE_BACKEND == 'compiled' and _flat_model_is_current() and _try_load_flat_model():
+            invalidate_prediction_cache()
             
-            aqi_model = model_data['model']
-            scaler = model_data['scaler']
+            logger.info(f"Flat AQI model loaded successfully (version {model_metadata.get('version', 'unknown')})")
+            loaded = True
+        
+        # Sinon charger le modèle simple (et réexporter le modèle plat)
+        elif MODEL_PATH.exists():
+            logger.info(f"Loading simple AQI model from {MODEL_PATH}")
+            _load_pickle_model()
+            invalidate_prediction_cache()
             
-            logger.info("Simple AQI model loaded successfully")
-            return True
+            logger.info(f"Simple AQI model loaded successfully (version {model_metadata.get('version', 'unknown')})")
+            loaded = True
         
-        # Si pas de modèle simple, essayer d'entraîner
-        logger.info("No simple model found, training new model...")
-        if train_simple_model():
-            logger.info("Model training successful")
-            return True
+        elif train_if_missing:
+            # Si pas de modèle simple, essayer d'entraîner
+            logger.info("No simple model found, training new model...")
+            loaded = train_simple_model()
+            if loaded:
+                logger.info("Model training successful")
+            else:
+                load_state['error'] = "Model training failed"
         
-        return False
+        else:
+            load_state['error'] = f"Model artifact {MODEL_PATH} not found (run train_aqi.py)"
+            logger.error(load_state['error'])
         
     except Exception as e:
+        load_state['error'] = str(e)
         logger.error(f"Error initializing AQI model: {str(e)}")
-        return False
+    
+    load_state.update(
+        status='ready' if loaded else 'failed',
+        load_seconds=time.perf_counter() - start,
+        loaded_at=datetime.datetime.utcnow().isoformat(),
+        version=model_metadata.get('version') if loaded else None
+    )
+    return loaded
 
-def predict_aqi(pollution_data):
+def _score(prediction):
+    """Convertit la sortie brute du modèle en (AQI, catégorie)"""
+    aqi_value = float(prediction)
+
+    # S'assurer que l'AQI est dans une plage raisonnable
+    aqi_value = max(0, min(500, aqi_value))
+
+    # Obtenir la catégorie AQI
+    aqi_category = get_aqi_category(aqi_value)
+
+    return aqi_value, aqi_category
+
+def _build_result(scored, pollution_data, compact=False):
+    """
+    Construit la réponse de prédiction à partir de (AQI, catégorie)
+    compact: sans l'écho des valeurs d'entrée ni les champs constants
+    """
+    aqi_value, aqi_category = scored
+
+    if compact:
+        return {'predicted_aqi': round(aqi_value, 2), 'aqi_category': aqi_category, 'aqi_rounded': int(round(aqi_value))}
+    return {
+        'predicted_aqi': round(aqi_value, 2),
+        'aqi_category': aqi_category,
+        'aqi_rounded': int(round(aqi_value)),
+        'input_values': pollution_data,
+        'confidence': None,
+        'model_type': 'Simple Random Forest Model'
+    }
+
+def parse_reading(pollution_data):
+    """
+    Valide un relevé et le convertit en vecteur de floats dans l'ordre du modèle, en une passe
+    Renvoie (valeurs, []) ou (None, erreurs de validation)
+    """
+    return reading_schema.parse(pollution_data)
+
+def predict_aqi(pollution_data, values=None, compact=False):
     """
     Prédit l'AQI à partir des données de pollution
+    values: vecteur déjà validé par parse_reading (la validation n'est alors pas refaite)
+    compact: réponse sans l'écho des valeurs d'entrée
     """
     global aqi_model, scaler
     
-    if aqi_model is None:
+    if not is_model_loaded():
         raise Exception("AQI model not initialized. Call initialize_aqi_model() first.")
     
     try:
         # Validation des données d'entrée
-        required_features = ['co', 'no', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3']
-        
-        for feature in required_features:
-            if feature not in pollution_data:
-                raise ValueError(f"Missing required feature: {feature}")
-        
-        # Créer DataFrame avec l'ordre correct des colonnes
-        data_dict = {feature: [float(pollution_data[feature])] for feature in required_features}
-        df = pd.DataFrame(data_dict)
-        
-        # Prédiction avec normalisation
-        X_scaled = scaler.transform(df)
-        prediction = aqi_model.predict(X_scaled)
-        
-        aqi_value = float(prediction[0])
+        if values is None:
+            for feature in REQUIRED_FEATURES:
+                if feature not in pollution_data:
+                    raise ValueError(f"Missing required feature: {feature}")
+            values = [float(pollution_data[feature]) for feature in feature_order]
         
-        # S'assurer que l'AQI est dans une plage raisonnable
-        aqi_value = max(0, min(500, aqi_value))
+        key = None
+        scored = None
+        if prediction_cache is not None:
+            key = _cache_key(values)
+            scored = prediction_cache.get(key)
         
-        # Obtenir la catégorie AQI
-        aqi_category = get_aqi_category(aqi_value)
+        if scored is None:
+            if INFERENCE_BACKEND == 'pandas':
+                # Créer DataFrame avec l'ordre correct des colonnes
+                df = pd.DataFrame([values], columns=feature_order)
+                
+                # Prédiction avec normalisation
+                with aqi_stage('scale'):
+                    X_scaled = scaler.transform(df)
+                with aqi_stage('predict'):
+                    prediction = aqi_model.predict(X_scaled)
+            else:
+                # Chemins numpy/compiled: directement du vecteur vers un tableau contigu
+                prediction = _predict_matrix(np.array([values], dtype=np.float64))
+            
+            scored = _score(prediction[0])
+            if key is not None:
+                prediction_cache.put(key, scored)
         
-        result = {
-            'predicted_aqi': round(aqi_value, 2),
-            'aqi_category': aqi_category,
-            'aqi_rounded': int(round(aqi_value)),
-            'input_values': pollution_data,
-            'confidence': None,
-            'model_type': 'Simple Random Forest Model'
-        }
+        result = _build_result(scored, pollution_data, compact)
         
-        logger.info(f"AQI prediction successful: {aqi_value} ({aqi_category})")
+        logger.info(f"AQI prediction successful: {result['predicted_aqi']} ({result['aqi_category']})")
         return result
         
     except Exception as e:
         logger.error(f"Error in AQI prediction: {str(e)}")
         raise
 
+def predict_aqi_batch(readings, compact=False):
+    """
+    Prédit l'AQI pour une liste de relevés en un seul appel au scaler et au modèle.
+
+    Chaque relevé est validé individuellement: les relevés invalides sont
+    rapportés dans la liste de résultats (clé 'error') sans faire échouer le
+    reste du lot. Les résultats sont renvoyés dans l'ordre des relevés.
+    compact: résultats sans l'écho des valeurs d'entrée
+    """
+    global aqi_model, scaler
+
+    if not is_model_loaded():
+        raise Exception("AQI model not initialized. Call initialize_aqi_model() first.")
+
+    results = [None] * len(readings)
+    valid_indices = []
+    rows = []
+
+    for i, reading in enumerate(readings):
+        if not isinstance(reading, dict):
+            results[i] = {'index': i, 'error': 'Reading must be a JSON object'}
+            continue
+
+        values, validation_errors = reading_schema.parse(reading)
+        if validation_errors:
+            results[i] = {
+                'index': i,
+                'error': 'Invalid input data',
+                'validation_errors': validation_errors
+            }
+            continue
+
+        valid_indices.append(i)
+        rows.append(values)
+
+    if valid_indices:
+        X = np.array(rows, dtype=np.float64)
+        scored = [None] * len(valid_indices)
+        keys = None
+
+        if prediction_cache is not None:
+            keys = [_cache_key(row) for row in X.tolist()]
+            scored = [prediction_cache.get(key) for key in keys]
+
+        # Une seule matrice pour les relevés absents du cache: un appel scaler + un appel forêt
+        misses = [j for j, cached in enumerate(scored) if cached is None]
+        if misses:
+            aqi_values = np.clip(_predict_matrix(X[misses]), 0, 500)
+            labels = aqi_categories.categories(aqi_values)
+            for j, aqi_value, label in zip(misses, aqi_values.tolist(), labels):
+                scored[j] = (aqi_value, label)
+                if keys is not None:
+                    prediction_cache.put(keys[j], scored[j])
+
+        for i, reading_scored in zip(valid_indices, scored):
+            result = _build_result(reading_scored, readings[i], compact)
+            result['index'] = i
+            results[i] = result
+
+    logger.info(f"AQI batch prediction: {len(valid_indices)}/{len(readings)} readings scored")
+    return results
+
+def predict_aqi_matrix(X, feature_names=None):
+    """
+    Prédit l'AQI pour une matrice de relevés (colonnes dans l'ordre de feature_names, REQUIRED_FEATURES
+    par défaut), de façon vectorisée et sans passer par le cache. Les lignes que validate_pollution_data
+    rejetterait (valeur manquante, négative ou hors plage) reçoivent NaN et le code UNKNOWN.
+    Renvoie (AQI float64, codes de catégorie aqi_categories), alignés sur les lignes de X.
+    """
+    if not is_model_loaded():
+        raise Exception("AQI model not initialized. Call initialize_aqi_model() first.")
+
+    feature_names = list(feature_names or REQUIRED_FEATURES)
+    if feature_names != feature_order:
+        X = X[:, [feature_names.index(feature) for feature in feature_order]]
+    X = np.asarray(X, dtype=np.float64)
+    invalid = reading_schema.invalid_rows(X)
+
+    aqi_values = np.full(len(X), np.nan)
+    if not invalid.all():
+        aqi_values[~invalid] = np.clip(_predict_matrix(X[~invalid]), 0, 500)
+    return aqi_values, aqi_categories.category_codes(aqi_values)
+
+def predict_aqi_frame(df):
+    """
+    Prédit l'AQI pour un DataFrame de relevés (une colonne par feature), pour le scoring en masse
+    d'historiques. Les lignes invalides reçoivent NaN et une catégorie vide (voir predict_aqi_matrix).
+    Renvoie (AQI, catégories), alignés sur les lignes de df.
+    """
+    X = df[feature_order].to_numpy(dtype=np.float64)
+    aqi_values, codes = predict_aqi_matrix(X, feature_order)
+    categories = np.where(np.isnan(aqi_values), '', aqi_categories.CATEGORY_LABELS[codes])
+    return aqi_values, categories
+
 def validate_pollution_data(data):
-    """Valide les données de pollution"""
-    required_features = ['co', 'no', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3']
-    errors = []
-    
-    for feature in required_features:
-        if feature not in data:
-            errors.append(f"Missing feature: {feature}")
-        else:
-            try:
-                value = float(data[feature])
-                if value < 0:
-                    errors.append(f"Negative value for {feature}: {value}")
-                # Validation des plages raisonnables
-                if feature == 'co' and value > 10000:
-                    errors.append(f"CO value seems too high: {value}")
-                elif feature in ['pm2_5', 'pm10'] and value > 1000:
-                    errors.append(f"{feature} value seems too high: {value}")
-            except (ValueError, TypeError):
-                errors.append(f"Invalid numeric value for {feature}: {data[feature]}")
-    
-    return errors
+    """Valide les données de pollution (règles déclarées dans aqi_schema.FEATURE_RULES)"""
+    return reading_schema.errors(data)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Scoring en masse d'historiques de relevés (CSV ou Parquet) avec le modèle AQI, sans passer par HTTP
+Usage: python score_aqi.py air_pollution_data.csv scored.csv --chunk-rows 50000 --workers 4
+
+Le fichier est lu par blocs de --chunk-rows lignes; chaque bloc est prédit en un appel vectorisé
+et écrit aussitôt dans la sortie, avec les colonnes predicted_aqi et aqi_category ajoutées.
+La mémoire reste bornée quelle que soit la taille du fichier: au plus --workers * 2 blocs en vol.
+Avec --workers > 1, les blocs sont répartis sur un pool de processus; l'ordre des lignes est conservé.
+Les relevés invalides (valeur manquante, négative ou hors plage) reçoivent un AQI vide.
+Avec --sub-indices, ajoute aussi les sous-indices par polluant et le polluant dominant.
+Parquet (entrée ou sortie, selon l'extension .parquet) nécessite pyarrow.
+"""
+
+import argparse
+import collections
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import aqi_categories
+import predict_aqi
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 50000
+
+
+def _is_parquet(path):
+    return Path(path).suffix.lower() in ('.parquet', '.pq')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet files require pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def read_chunks(path, chunk_rows):
+    """Itère sur le fichier d'entrée par DataFrames d'au plus chunk_rows lignes"""
+    if _is_parquet(path):
+        pyarrow = _import_pyarrow()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+        return
+
+    dtype = {feature: np.float64 for feature in predict_aqi.REQUIRED_FEATURES}
+    yield from pd.read_csv(path, dtype=dtype, chunksize=chunk_rows)
+
+
+class ChunkWriter:
+    """Écrit les blocs scorés les uns après les autres dans un CSV ou un Parquet"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._parquet_writer = None
+        self._file = None
+
+    def write(self, chunk):
+        if _is_parquet(self.path):
+            pyarrow = _import_pyarrow()
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+            return
+
+        header = self._file is None
+        if header:
+            self._file = open(self.path, 'w', newline='')
+        chunk.to_csv(self._file, header=header, index=False)
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def score_chunk(chunk, with_sub_indices=False):
+    """Ajoute predicted_aqi et aqi_category (et les sous-indices) à un bloc de relevés"""
+    aqi_values, categories = predict_aqi.predict_aqi_frame(chunk)
+    scored = chunk.assign(predicted_aqi=np.round(aqi_values, 2), aqi_category=categories)
+    if with_sub_indices:
+        X = chunk[predict_aqi.REQUIRED_FEATURES].to_numpy(dtype=np.float64)
+        sub_indices = aqi_categories.sub_indices(X, predict_aqi.REQUIRED_FEATURES)
+        for i, pollutant in enumerate(aqi_categories.SUB_INDEX_FACTORS):
+            scored[f'sub_index_{pollutant}'] = np.round(sub_indices[:, i], 2)
+        scored['dominant_pollutant'] = aqi_categories.dominant_pollutants(X, predict_aqi.REQUIRED_FEATURES)
+    return scored
+
+
+def _init_worker(model_path, inference_backend):
+    """Dans chaque processus du pool: charge le modèle s'il n'a pas été hérité du parent (fork)"""
+    if not predict_aqi.is_model_loaded():
+        predict_aqi.MODEL_PATH = Path(model_path)
+        predict_aqi.INFERENCE_BACKEND = inference_backend
+        if not predict_aqi.initialize_aqi_model():
+            raise RuntimeError(f"Could not load AQI model {model_path}")
+
+
+def _score_in_pool(chunks, workers, with_sub_indices):
+    """Score les blocs dans un pool de processus, dans l'ordre, avec au plus workers * 2 blocs en vol"""
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(str(predict_aqi.MODEL_PATH), predict_aqi.INFERENCE_BACKEND)
+    ) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.submit(score_chunk, chunk, with_sub_indices))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def score_file(input_path, output_path, chunk_rows=DEFAULT_CHUNK_ROWS, workers=1, with_sub_indices=False):
+    """Score input_path bloc par bloc et écrit output_path; renvoie des statistiques du run"""
+    start = time.perf_counter()
+    chunks = read_chunks(input_path, chunk_rows)
+    if workers > 1:
+        scored_chunks = _score_in_pool(chunks, workers, with_sub_indices)
+    else:
+        scored_chunks = (score_chunk(chunk, with_sub_indices) for chunk in chunks)
+
+    n_rows = 0
+    n_scored = 0
+    with ChunkWriter(output_path) as writer:
+        for scored in scored_chunks:
+            writer.write(scored)
+            n_rows += len(scored)
+            n_scored += int(scored['predicted_aqi'].notna().sum())
+
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': n_rows,
+        'scored': n_scored,
+        'invalid': n_rows - n_scored,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(n_rows / elapsed) if elapsed else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='CSV ou Parquet de relevés (colonnes co, no, no2, o3, so2, pm2_5, pm10, nh3)')
+    parser.add_argument('output', help='Fichier de sortie (.csv ou .parquet)')
+    parser.add_argument('--model', default=str(predict_aqi.MODEL_PATH))
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=1, help='processus de scoring (1: dans le processus courant)')
+    parser.add_argument('--sub-indices', action='store_true', help='ajoute les sous-indices par polluant et le polluant dominant')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    predict_aqi.MODEL_PATH = Path(args.model)
+    if not predict_aqi.initialize_aqi_model():
+        logger.error(f"Could not load AQI model {predict_aqi.MODEL_PATH}")
+        return 1
+
+    stats = score_file(args.input, args.output, chunk_rows=args.chunk_rows, workers=args.workers,
+                       with_sub_indices=args.sub_indices)
+    logger.info(f"Scored {stats['scored']}/{stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_second']} rows/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
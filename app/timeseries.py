@@ -0,0 +1,494 @@
+import datetime
+import json
+import logging
+import math
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import predict_aqi
+from aqi_categories import CATEGORY_CODES, CATEGORY_LABELS, category_codes
+
+logger = logging.getLogger(__name__)
+
+# Historique chargé au démarrage (vide pour désactiver), puis complété par les appels à /predict-aqi
+# (voir AQI_HISTORY_RECORD)
+HISTORY_PATH = os.environ.get('AQI_HISTORY_PATH', str(predict_aqi.DATASET_PATH))
+
+# Format des dates du dataset (jour-mois-année)
+CSV_DATE_FORMAT = '%d-%m-%Y'
+
+# Catégories comptées par les agrégats, dans l'ordre des colonnes des compteurs cumulés
+CATEGORIES = list(CATEGORY_LABELS)
+
+# Fenêtres d'agrégation: '24h', '7d', '30d'...
+WINDOW_PATTERN = re.compile(r'^(\d+)([hd])$')
+WINDOW_UNITS = {'h': 3600, 'd': 86400}
+DEFAULT_WINDOWS = ('24h', '7d')
+
+INITIAL_CAPACITY = 64
+
+# Ajout à l'historique des relevés reçus par /predict-aqi. L'index est propre à chaque processus:
+# avec plusieurs workers, les relevés passent par AQI_HISTORY_JOURNAL, un fichier partagé où chaque
+# worker les écrit (une ligne JSON par relevé) et que chacun relit avant de répondre sur l'historique.
+# gunicorn.conf.py et python asgi.py en créent un. 'auto': historiser avec un journal ou un seul worker
+# (SERVER_WORKERS, exporté par gunicorn.conf.py, ou WEB_CONCURRENCY pour uvicorn); '1' / '0' pour forcer.
+AQI_HISTORY_RECORD = os.environ.get('AQI_HISTORY_RECORD', 'auto')
+AQI_HISTORY_JOURNAL = os.environ.get('AQI_HISTORY_JOURNAL', '')
+
+# Relevés datés au-delà de maintenant + AQI_HISTORY_MAX_FUTURE refusés: un seul relevé dans le futur
+# viderait les fenêtres par défaut (qui finissent au dernier relevé) et, avec une rétention, l'historique
+AQI_HISTORY_MAX_FUTURE = os.environ.get('AQI_HISTORY_MAX_FUTURE', '1d')
+
+# Rétention de l'index, pour que la mémoire reste bornée sous un trafic continu:
+#   AQI_HISTORY_MAX_POINTS    - relevés gardés par ville (0: sans limite)
+#   AQI_HISTORY_RETENTION     - relevés plus anciens que le dernier de la ville de plus de '90d'... (vide: sans limite)
+#   AQI_HISTORY_MAX_CITIES    - villes indexées; les relevés d'une ville en plus ne sont pas historisés
+AQI_HISTORY_MAX_POINTS = int(os.environ.get('AQI_HISTORY_MAX_POINTS', '100000'))
+AQI_HISTORY_RETENTION = os.environ.get('AQI_HISTORY_RETENTION', '')
+AQI_HISTORY_MAX_CITIES = int(os.environ.get('AQI_HISTORY_MAX_CITIES', '1000'))
+
+# Les relevés sont retirés par lots d'au moins 1/EVICTION_SLACK de la série: le décalage des
+# colonnes (O(n)) n'est pas payé à chaque ajout
+EVICTION_SLACK = 8
+
+# Dates représentables par datetime (années 1 à 9999): au-delà, format_timestamp échouerait
+MIN_TIMESTAMP = int(datetime.datetime(1, 1, 2, tzinfo=datetime.timezone.utc).timestamp())
+MAX_TIMESTAMP = int(datetime.datetime(9999, 12, 31, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def parse_window(window):
+    """Convertit '24h' / '7d' en secondes; ValueError si le format est invalide"""
+    match = WINDOW_PATTERN.match(window or '')
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid window '{window}' (expected e.g. 24h or 7d)")
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+
+def parse_timestamp(value):
+    """
+    Date ISO 8601 ('2020-12-01', '2020-12-01T08:00:00'), du dataset ('01-12-2020') ou secondes epoch
+    en secondes epoch UTC. ValueError si la date est invalide ou hors des années 1 à 9999.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if not math.isfinite(value) or not MIN_TIMESTAMP <= value <= MAX_TIMESTAMP:
+            raise ValueError(f"Invalid date: {value!r} (out of range)")
+        return int(value)
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid date: {value!r}")
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = datetime.datetime.strptime(value, CSV_DATE_FORMAT)
+        except ValueError:
+            raise ValueError(f"Invalid date '{value}' (expected ISO 8601 or DD-MM-YYYY)")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    timestamp = int(parsed.timestamp())
+    if not MIN_TIMESTAMP <= timestamp <= MAX_TIMESTAMP:
+        raise ValueError(f"Invalid date '{value}' (out of range)")
+    return timestamp
+
+
+def format_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(int(timestamp), tz=datetime.timezone.utc).isoformat()
+
+
+class CitySeries:
+    """
+    Relevés d'une ville en colonnes NumPy triées par date, avec des sommes cumulées de l'AQI
+    et des compteurs cumulés par catégorie.
+
+    Une fenêtre (début, fin] est trouvée par deux recherches dichotomiques (O(log n));
+    moyenne et comptes par catégorie sont des différences de cumuls (O(1)), le maximum
+    parcourt la fenêtre. Un relevé plus récent que le dernier est ajouté en O(1) amorti
+    (capacité doublée au besoin); un relevé antérieur est inséré à sa place et les cumuls
+    sont recalculés à partir de cette position.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        size = self.size
+        old = getattr(self, 'timestamps', None)
+        timestamps = np.empty(capacity, dtype=np.int64)
+        aqi = np.empty(capacity, dtype=np.float64)
+        categories = np.empty(capacity, dtype=np.int8)
+        features = np.empty((capacity, len(predict_aqi.REQUIRED_FEATURES)), dtype=np.float64)
+        # prefix[i] = cumul des i premiers relevés
+        aqi_prefix = np.zeros(capacity + 1, dtype=np.float64)
+        category_prefix = np.zeros((capacity + 1, len(CATEGORIES)), dtype=np.int64)
+
+        if old is not None:
+            timestamps[:size] = self.timestamps[:size]
+            aqi[:size] = self.aqi[:size]
+            categories[:size] = self.categories[:size]
+            features[:size] = self.features[:size]
+            aqi_prefix[:size + 1] = self.aqi_prefix[:size + 1]
+            category_prefix[:size + 1] = self.category_prefix[:size + 1]
+
+        self.timestamps, self.aqi, self.categories, self.features = timestamps, aqi, categories, features
+        self.aqi_prefix, self.category_prefix = aqi_prefix, category_prefix
+
+    def _reserve(self, extra):
+        if self.size + extra > len(self.timestamps):
+            self._allocate(max(2 * len(self.timestamps), self.size + extra))
+
+    def _update_prefix(self, start):
+        """Recalcule les cumuls à partir du relevé start"""
+        end = self.size
+        self.aqi_prefix[start + 1:end + 1] = self.aqi_prefix[start] + np.cumsum(self.aqi[start:end])
+        one_hot = np.zeros((end - start, len(CATEGORIES)), dtype=np.int64)
+        one_hot[np.arange(end - start), self.categories[start:end]] = 1
+        self.category_prefix[start + 1:end + 1] = self.category_prefix[start] + np.cumsum(one_hot, axis=0)
+
+    def extend(self, timestamps, aqi, categories, features):
+        """Ajoute un lot de relevés (dans n'importe quel ordre)"""
+        if len(timestamps) == 0:
+            return
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, aqi, categories, features = timestamps[order], aqi[order], categories[order], features[order]
+
+        self._reserve(len(timestamps))
+        if self.size and timestamps[0] < self.timestamps[self.size - 1]:
+            # Fusion avec l'existant, puis cumuls recalculés depuis le premier relevé déplacé
+            start = int(np.searchsorted(self.timestamps[:self.size], timestamps[0], side='right'))
+            merged = np.concatenate([self.timestamps[start:self.size], timestamps])
+            merge_order = np.argsort(merged, kind='stable')
+            end = self.size + len(timestamps)
+            self.timestamps[start:end] = merged[merge_order]
+            self.aqi[start:end] = np.concatenate([self.aqi[start:self.size], aqi])[merge_order]
+            self.categories[start:end] = np.concatenate([self.categories[start:self.size], categories])[merge_order]
+            self.features[start:end] = np.concatenate([self.features[start:self.size], features])[merge_order]
+        else:
+            start = self.size
+            end = start + len(timestamps)
+            self.timestamps[start:end] = timestamps
+            self.aqi[start:end] = aqi
+            self.categories[start:end] = categories
+            self.features[start:end] = features
+
+        self.size = end
+        self._update_prefix(start)
+
+    def evict(self, max_points=0, retention=0):
+        """
+        Retire les relevés les plus anciens au-delà de max_points, ou antérieurs de plus de retention
+        secondes au dernier relevé. Renvoie le nombre de relevés retirés.
+        """
+        slack = max(1, self.size // EVICTION_SLACK)
+        count = 0
+        if max_points and self.size >= max_points + max(1, max_points // EVICTION_SLACK):
+            count = self.size - max_points
+        if retention and self.size:
+            expired = int(np.searchsorted(self.timestamps[:self.size], self.last_timestamp - retention, side='right'))
+            if expired >= slack:
+                count = max(count, expired)
+        if count:
+            self._drop_front(count)
+        return count
+
+    def _drop_front(self, count):
+        """Décale les colonnes pour retirer les count premiers relevés; les cumuls repartent de zéro"""
+        end = self.size
+        size = end - count
+        self.timestamps[:size] = self.timestamps[count:end]
+        self.aqi[:size] = self.aqi[count:end]
+        self.categories[:size] = self.categories[count:end]
+        self.features[:size] = self.features[count:end]
+        self.aqi_prefix[:size + 1] = self.aqi_prefix[count:end + 1] - self.aqi_prefix[count]
+        self.category_prefix[:size + 1] = self.category_prefix[count:end + 1] - self.category_prefix[count]
+        self.size = size
+
+    def window(self, start, end):
+        """Indices [lo, hi) des relevés dans (start, end]"""
+        timestamps = self.timestamps[:self.size]
+        lo = int(np.searchsorted(timestamps, start, side='right'))
+        hi = int(np.searchsorted(timestamps, end, side='right'))
+        return lo, hi
+
+    def aggregate(self, start, end):
+        lo, hi = self.window(start, end)
+        count = hi - lo
+        counts = self.category_prefix[hi] - self.category_prefix[lo]
+        return {
+            'count': count,
+            'mean_aqi': round(float((self.aqi_prefix[hi] - self.aqi_prefix[lo]) / count), 2) if count else None,
+            'max_aqi': round(float(self.aqi[lo:hi].max()), 2) if count else None,
+            'categories': {category: int(n) for category, n in zip(CATEGORIES, counts) if n}
+        }
+
+    @property
+    def first_timestamp(self):
+        return int(self.timestamps[0]) if self.size else None
+
+    @property
+    def last_timestamp(self):
+        return int(self.timestamps[self.size - 1]) if self.size else None
+
+
+class TimeSeriesIndex:
+    """
+    Index en mémoire des relevés par ville (insensible à la casse), thread-safe.
+    Borné par max_points relevés par ville, une rétention (secondes) et max_cities villes (0: sans limite).
+    """
+
+    def __init__(self, max_points=None, retention=None, max_cities=None):
+        self.max_points = AQI_HISTORY_MAX_POINTS if max_points is None else max_points
+        self.retention = (parse_window(AQI_HISTORY_RETENTION) if AQI_HISTORY_RETENTION else 0) if retention is None else retention
+        self.max_cities = AQI_HISTORY_MAX_CITIES if max_cities is None else max_cities
+        self._series = {}
+        self._names = {}
+        self._evicted = 0
+        self._skipped = 0
+        self._lock = threading.Lock()
+
+    def _get_series(self, city, create=False):
+        key = city.strip().lower()
+        series = self._series.get(key)
+        if series is None and create and not (self.max_cities and len(self._series) >= self.max_cities):
+            series = self._series[key] = CitySeries()
+            self._names[key] = city.strip()
+        return series
+
+    def _extend(self, city, timestamps, aqi_values, codes, features):
+        series = self._get_series(city, create=True)
+        if series is None:
+            self._skipped += len(timestamps)
+            return
+        series.extend(timestamps, aqi_values, codes, features)
+        self._evicted += series.evict(self.max_points, self.retention)
+
+    def load_frame(self, df, aqi_values):
+        """Ajoute des relevés en masse: df avec les colonnes city, timestamp et les features"""
+        valid = ~np.isnan(aqi_values)
+        df = df[valid]
+        aqi_values = aqi_values[valid]
+        codes = category_codes(aqi_values)
+        timestamps = df['timestamp'].to_numpy(dtype=np.int64)
+        features = df[predict_aqi.REQUIRED_FEATURES].to_numpy(dtype=np.float64)
+
+        with self._lock:
+            for city, rows in df.groupby('city', sort=False).indices.items():
+                self._extend(city, timestamps[rows], aqi_values[rows], codes[rows], features[rows])
+        return int(valid.sum())
+
+    def append(self, city, timestamp, aqi_value, category, features):
+        with self._lock:
+            self._extend(
+                city,
+                np.array([timestamp], dtype=np.int64),
+                np.array([aqi_value], dtype=np.float64),
+                np.array([CATEGORY_CODES[category]], dtype=np.int8),
+                np.asarray(features, dtype=np.float64).reshape(1, -1)
+            )
+
+    def cities(self):
+        with self._lock:
+            return [
+                {
+                    'city': self._names[key],
+                    'count': series.size,
+                    'first': format_timestamp(series.first_timestamp),
+                    'last': format_timestamp(series.last_timestamp)
+                }
+                for key, series in sorted(self._series.items())
+            ]
+
+    def aggregate(self, city, windows, end=None):
+        """Agrégats glissants par fenêtre ('24h', '7d'...) se terminant à end (défaut: dernier relevé de la ville)"""
+        durations = {window: parse_window(window) for window in windows}
+        with self._lock:
+            series = self._get_series(city)
+            if series is None:
+                return None
+            end = series.last_timestamp if end is None else end
+            return {
+                'city': self._names[city.strip().lower()],
+                'end': format_timestamp(end),
+                'windows': {window: series.aggregate(end - duration, end) for window, duration in durations.items()}
+            }
+
+    def readings(self, city, start=None, end=None, limit=1000):
+        """Relevés de la ville dans (start, end], les plus récents en dernier, au plus limit"""
+        with self._lock:
+            series = self._get_series(city)
+            if series is None:
+                return None
+            lo, hi = series.window(
+                np.iinfo(np.int64).min if start is None else start,
+                np.iinfo(np.int64).max if end is None else end
+            )
+            lo = max(lo, hi - limit)
+            timestamps = series.timestamps[lo:hi].tolist()
+            aqi = series.aqi[lo:hi].tolist()
+            categories = series.categories[lo:hi].tolist()
+            features = series.features[lo:hi].tolist()
+
+        return [
+            {
+                'date': format_timestamp(timestamp),
+                'predicted_aqi': round(aqi_value, 2),
+                'aqi_category': CATEGORIES[category],
+                **dict(zip(predict_aqi.REQUIRED_FEATURES, values))
+            }
+            for timestamp, aqi_value, category, values in zip(timestamps, aqi, categories, features)
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cities': len(self._series),
+                'readings': sum(series.size for series in self._series.values()),
+                'evicted': self._evicted,
+                'skipped': self._skipped
+            }
+
+
+history_index = TimeSeriesIndex()
+history_loaded = False
+_history_lock = threading.Lock()
+# Position de lecture du journal; les lignes suivantes n'ont pas encore été ajoutées à history_index
+_journal_offset = 0
+_journal_lock = threading.Lock()
+
+
+def ensure_history_loaded():
+    """
+    Charge l'historique au premier appel, une seule fois; les appels concurrents attendent la fin du
+    chargement. Le CSV n'est pas re-scoré au démarrage du serveur, seulement à la première consultation.
+    Les relevés reçus par les autres workers sont ensuite lus dans le journal.
+    """
+    if not history_loaded:
+        with _history_lock:
+            if not history_loaded:
+                load_history()
+    sync_journal()
+
+
+def start_history_loading():
+    """Charge l'historique dans un thread, hors du démarrage et du chemin des requêtes de prédiction"""
+    if not history_loaded:
+        threading.Thread(target=ensure_history_loaded, name='history-loader', daemon=True).start()
+
+
+def load_history(path=None):
+    """
+    Charge l'historique (CSV du dataset: city, date, features) dans history_index,
+    scoré par le modèle AQI pour que l'historique et les nouveaux relevés partagent la même échelle.
+    """
+    global history_loaded
+    try:
+        return _load_history(path)
+    except Exception as e:
+        logger.error(f"Could not load AQI history: {e}")
+        return 0
+    finally:
+        # Pas de nouvel essai à chaque requête: l'index reste complété par les relevés reçus
+        history_loaded = True
+
+
+def _load_history(path):
+    path = path or HISTORY_PATH
+    if not path:
+        return 0
+    path = Path(path)
+    if not path.exists():
+        logger.warning(f"AQI history {path} not found, starting with an empty index")
+        return 0
+
+    df = pd.read_csv(path, usecols=['city', 'date'] + predict_aqi.REQUIRED_FEATURES)
+    dates = pd.to_datetime(df['date'], format=CSV_DATE_FORMAT, utc=True)
+    df['timestamp'] = (dates - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+    aqi_values, _ = predict_aqi.predict_aqi_frame(df)
+    loaded = history_index.load_frame(df, aqi_values)
+    logger.info(f"AQI history loaded: {loaded} readings for {len(history_index.cities())} cities")
+    return loaded
+
+
+def reading_timestamp(reading):
+    """
+    Date d'un relevé à historiser: None s'il ne porte pas de ville (ou n'est pas un objet),
+    maintenant s'il n'a pas de date. ValueError si la date est invalide ou trop loin dans le futur.
+    """
+    if not isinstance(reading, dict):
+        return None
+    city = reading.get('city')
+    if not isinstance(city, str) or not city.strip():
+        return None
+    now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    date = reading.get('date')
+    if date is None:
+        return now
+    timestamp = parse_timestamp(date)
+    if AQI_HISTORY_MAX_FUTURE and timestamp > now + parse_window(AQI_HISTORY_MAX_FUTURE):
+        raise ValueError(f"Invalid date '{date}' (more than {AQI_HISTORY_MAX_FUTURE} in the future)")
+    return timestamp
+
+
+def recording_enabled():
+    """True si les relevés reçus sont ajoutés à l'historique (voir AQI_HISTORY_RECORD)"""
+    if AQI_HISTORY_RECORD == 'auto':
+        return bool(AQI_HISTORY_JOURNAL) or int(os.environ.get('SERVER_WORKERS') or os.environ.get('WEB_CONCURRENCY') or '1') == 1
+    return AQI_HISTORY_RECORD == '1'
+
+
+def record_reading(reading, result, timestamp):
+    """
+    Ajoute à l'historique un relevé scoré par /predict-aqi (timestamp: voir reading_timestamp).
+    Avec un journal, le relevé y est écrit et rejoint l'index de chaque worker à sa prochaine
+    lecture (sync_journal). Renvoie False sans rien ajouter si l'enregistrement est désactivé.
+    """
+    if not recording_enabled():
+        return False
+    city = reading['city']
+    features = [float(reading[feature]) for feature in predict_aqi.REQUIRED_FEATURES]
+    if AQI_HISTORY_JOURNAL:
+        _write_journal(city, timestamp, result['predicted_aqi'], result['aqi_category'], features)
+    else:
+        history_index.append(city, timestamp, result['predicted_aqi'], result['aqi_category'], features)
+    return True
+
+
+def _write_journal(city, timestamp, aqi_value, category, features):
+    line = json.dumps({'city': city, 'timestamp': timestamp, 'aqi': aqi_value, 'category': category, 'features': features})
+    # Un seul write() en O_APPEND: les lignes de workers concurrents ne s'entremêlent pas
+    fd = os.open(AQI_HISTORY_JOURNAL, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (line + '\n').encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+def sync_journal():
+    """Ajoute à history_index les relevés écrits dans le journal depuis la dernière lecture; renvoie leur nombre"""
+    global _journal_offset
+    if not AQI_HISTORY_JOURNAL:
+        return 0
+    with _journal_lock:
+        try:
+            with open(AQI_HISTORY_JOURNAL, 'rb') as f:
+                f.seek(_journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        # Une ligne en cours d'écriture sera lue à la prochaine synchronisation
+        complete = data[:data.rfind(b'\n') + 1]
+        _journal_offset += len(complete)
+        count = 0
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+                history_index.append(entry['city'], entry['timestamp'], entry['aqi'], entry['category'], entry['features'])
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Skipping invalid AQI history journal line: {e}")
+                continue
+            count += 1
+        return count
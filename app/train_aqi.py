@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Entraînement hors ligne du modèle AQI (à lancer pendant le build de l'image, pas au démarrage du serveur)
+Usage: python train_aqi.py --dataset air_pollution_data.csv --output aqi_model/simple_model.pkl
+
+Produit simple_model.pkl, le modèle plat simple_model.bin (forêt compilée, voir model_format) et le manifeste
+simple_model.json (version, empreinte du dataset, scores).
+Le CSV est lu par blocs et les arbres sont entraînés en parallèle (--n-jobs); pour un dataset
+plus grand que la mémoire, --max-rows garde un échantillon uniforme des lignes.
+"""
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+import predict_aqi
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default=str(predict_aqi.DATASET_PATH))
+    parser.add_argument('--output', default=str(predict_aqi.MODEL_PATH))
+    parser.add_argument('--n-jobs', type=int, default=None, help='arbres entraînés en parallèle (défaut: AQI_TRAIN_N_JOBS, -1 = tous les coeurs)')
+    parser.add_argument('--chunk-rows', type=int, default=None, help='lignes lues par bloc (défaut: AQI_TRAIN_CHUNK_ROWS)')
+    parser.add_argument('--max-rows', type=int, default=None, help='échantillon maximal de lignes gardées en mémoire')
+    parser.add_argument('--max-samples', type=float, default=None, help='part des lignes tirée pour chaque arbre (0-1)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    predict_aqi.DATASET_PATH = Path(args.dataset)
+    predict_aqi.MODEL_PATH = Path(args.output)
+
+    if not predict_aqi.train_simple_model(n_jobs=args.n_jobs, chunk_rows=args.chunk_rows,
+                                          max_rows=args.max_rows, max_samples=args.max_samples):
+        return 1
+
+    print(json.dumps(predict_aqi.model_metadata, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark des catégories AQI et des sous-indices par polluant, sur des tableaux d'un million de lignes
+Usage: python benchmarks/aqi_category_bench.py --rows 1000000
+
+  catégories   - ancienne boucle sur le dict AQI_CATEGORIES valeur par valeur,
+                 contre np.searchsorted sur les bornes (aqi_categories.categories)
+  sous-indices - ancienne fonction ligne par ligne via DataFrame.apply (mesurée sur --apply-rows lignes),
+                 contre le calcul vectorisé sur toute la matrice (aqi_categories.estimated_aqi)
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+
+import aqi_categories
+from predict_aqi import REQUIRED_FEATURES
+
+# Ancien mapping, avec ses trous entre bornes entières (50.5 -> UNKNOWN)
+OLD_AQI_CATEGORIES = {
+    (0, 50): "GOOD",
+    (51, 100): "MODERATE",
+    (101, 150): "UNHEALTHY_SENSITIVE_GROUP",
+    (151, 200): "UNHEALTHY",
+    (201, 300): "VERY_UNHEALTHY",
+    (301, float('inf')): "SEVERE"
+}
+
+
+def old_get_aqi_category(aqi_value):
+    for (min_val, max_val), category in OLD_AQI_CATEGORIES.items():
+        if min_val <= aqi_value <= max_val:
+            return category
+    return "UNKNOWN"
+
+
+def old_estimate_realistic_aqi(row):
+    return max(
+        min(300, max(0, row['pm2_5'] * 2)),
+        min(300, max(0, row['pm10'] * 1.5)),
+        min(300, max(0, row['no2'] * 2)),
+        min(300, max(0, row['o3'] * 1.2))
+    )
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def report(name, rows, seconds, baseline_rate=None):
+    rate = rows / seconds
+    speedup = f"{rate / baseline_rate:>8.0f}x" if baseline_rate else f"{'':>9}"
+    print(f"{name:>28} {rows:>9} {seconds * 1000:>9.1f}ms {rate:>13,.0f} {speedup}")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--apply-rows', type=int, default=100_000)
+    parser.add_argument('--dataset', default=str(ROOT_DIR / 'air_pollution_data.csv'))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 500, args.rows)
+
+    # Relevés tirés du dataset, avec un bruit multiplicatif
+    df = pd.read_csv(args.dataset)[REQUIRED_FEATURES].dropna()
+    X = df.to_numpy()[rng.integers(0, len(df), args.rows)] * rng.uniform(0.9, 1.1, (args.rows, len(REQUIRED_FEATURES)))
+
+    print(f"{'':>28} {'lignes':>9} {'temps':>11} {'lignes/s':>13} {'gain':>9}")
+    _, seconds = timed(lambda: [old_get_aqi_category(value) for value in values.tolist()])
+    baseline = report('catégories (boucle dict)', args.rows, seconds)
+    labels, seconds = timed(aqi_categories.categories, values)
+    report('catégories (searchsorted)', args.rows, seconds, baseline)
+
+    subset = pd.DataFrame(X[:args.apply_rows], columns=REQUIRED_FEATURES)
+    old_aqi, seconds = timed(lambda: subset.apply(old_estimate_realistic_aqi, axis=1))
+    baseline = report('sous-indices (apply)', args.apply_rows, seconds)
+    new_aqi, seconds = timed(aqi_categories.estimated_aqi, X, REQUIRED_FEATURES)
+    report('sous-indices (vectorisé)', args.rows, seconds, baseline)
+
+    assert np.array_equal(old_aqi.to_numpy(), new_aqi[:args.apply_rows])
+    gaps = sum(1 for value in values[:100_000].tolist() if old_get_aqi_category(value) == 'UNKNOWN')
+    print(f"\nAncien mapping: {gaps} valeurs sur 100000 tombaient entre deux catégories (UNKNOWN)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Coût CPU par requête de /predict-aqi: validation, encodage JSON, réponse compacte et formats binaires
+Usage: python benchmarks/aqi_request_bench.py --repeat 10
+
+  validation - ancienne boucle validate_pollution_data + vérification répétée dans predict_aqi
+               + conversion dict -> matrice, contre le schéma compilé (parse_reading), par relevé
+  encodage   - réponse d'un lot (jsonify), par encodeur et avec ou sans réponse compacte, par relevé
+  requêtes   - /predict-aqi et /predict-aqi/batch via le client de test Flask, pour chaque
+               encodeur (JSON_ENCODER flask ou fast) avec et sans ?compact=1; temps CPU du processus
+               (time.process_time) par requête et taille de la réponse
+  formats    - /predict-aqi/batch de --wire-rows relevés en JSON, JSON compact, lignes float32 packées
+               (application/octet-stream), et MessagePack / Arrow IPC si msgpack / pyarrow sont installés
+
+Chaque mesure est le minimum sur --repeat passes: sur une machine partagée, la moyenne est trop bruitée.
+
+Le cache des prédictions est désactivé: chaque requête passe par le modèle.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+
+os.environ.setdefault('AQI_HISTORY_PATH', '')
+
+import encoding
+import predict_aqi
+
+DATASET_PATH = ROOT_DIR / 'air_pollution_data.csv'
+
+
+def old_validate_pollution_data(data):
+    """Ancienne validation, chaîne de try/float/if par feature"""
+    errors = []
+    for feature in predict_aqi.REQUIRED_FEATURES:
+        if feature not in data:
+            errors.append(f"Missing feature: {feature}")
+        else:
+            try:
+                value = float(data[feature])
+                if value < 0:
+                    errors.append(f"Negative value for {feature}: {value}")
+                if feature == 'co' and value > 10000:
+                    errors.append(f"CO value seems too high: {value}")
+                elif feature in ['pm2_5', 'pm10'] and value > 1000:
+                    errors.append(f"{feature} value seems too high: {value}")
+            except (ValueError, TypeError):
+                errors.append(f"Invalid numeric value for {feature}: {data[feature]}")
+    return errors
+
+
+def old_validate_and_convert(data):
+    """Ancien chemin complet avant le modèle: validation, nouvelle vérification, conversion"""
+    if old_validate_pollution_data(data):
+        return None
+    for feature in predict_aqi.REQUIRED_FEATURES:
+        if feature not in data:
+            raise ValueError(f"Missing required feature: {feature}")
+    return predict_aqi._features_to_array([data])
+
+
+def new_validate_and_convert(data):
+    values, errors = predict_aqi.parse_reading(data)
+    if errors:
+        return None
+    return np.array([values], dtype=np.float64)
+
+
+def cpu_per_call(fn, items, repeat):
+    """Meilleur temps CPU par élément sur repeat passes (µs)"""
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        for item in items:
+            fn(item)
+        elapsed = (time.process_time() - start) / len(items)
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=str(ROOT_DIR / 'app' / 'aqi_model' / 'simple_model.pkl'))
+    parser.add_argument('--requests', type=int, default=200, help='requêtes /predict-aqi par passe')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--wire-rows', type=int, default=5000, help='relevés par requête pour la comparaison des formats')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    predict_aqi.MODEL_PATH = Path(args.model)
+    predict_aqi.DATASET_PATH = DATASET_PATH
+    if not predict_aqi.initialize_aqi_model(train_if_missing=True):
+        raise SystemExit(f"Could not load AQI model {args.model}")
+    predict_aqi.prediction_cache = None
+
+    df = pd.read_csv(DATASET_PATH, usecols=predict_aqi.REQUIRED_FEATURES).dropna()
+    readings = df.head(max(args.requests, args.batch_size, args.wire_rows)).to_dict(orient='records')
+
+    print("validation + conversion, par relevé:")
+    old_us = cpu_per_call(old_validate_and_convert, readings, args.repeat)
+    new_us = cpu_per_call(new_validate_and_convert, readings, args.repeat)
+    print(f"  ancienne boucle   {old_us:>8.1f} µs")
+    print(f"  schéma compilé    {new_us:>8.1f} µs  ({old_us / new_us:.1f}x)")
+
+    import app as app_module
+    app_module.models_loaded.set()
+    client = app_module.app.test_client()
+    batch = readings[:args.batch_size]
+
+    print(f"\nencodage de la réponse d'un lot de {len(batch)}, par relevé:")
+    for compact in (False, True):
+        payload = {'count': len(batch), 'results': predict_aqi.predict_aqi_batch(batch, compact=compact)}
+        timings = []
+        for encoder in ('flask', 'fast'):
+            encoding.install_json_provider(app_module.app, encoder)
+            with app_module.app.app_context():
+                timings.append(cpu_per_call(lambda _: app_module.app.json.response(payload), range(5), args.repeat) / len(batch))
+        print(f"  compact={'oui' if compact else 'non':<4} flask {timings[0]:>6.2f} µs   fast {timings[1]:>6.2f} µs")
+
+    print(f"\n{'encodeur':<8} {'compact':>8} {'CPU /predict-aqi':>18} {'octets':>8} {'CPU batch /relevé':>18} {'octets':>9}")
+    for encoder in ('flask', 'fast'):
+        encoding.install_json_provider(app_module.app, encoder)
+        for compact in (False, True):
+            query = '?compact=1' if compact else '?compact=0'
+            single = lambda reading: client.post('/predict-aqi' + query, json=reading)
+            single(readings[0])
+            single_us = cpu_per_call(single, readings[:args.requests], args.repeat)
+            single_bytes = len(single(readings[0]).data)
+
+            batch_call = lambda _: client.post('/predict-aqi/batch' + query, json=batch)
+            batch_us = cpu_per_call(batch_call, range(2), args.repeat) / len(batch)
+            batch_bytes = len(batch_call(None).data)
+            print(f"{encoder:<8} {'oui' if compact else 'non':>8} {single_us:>15.0f} µs {single_bytes:>8} {batch_us:>15.1f} µs {batch_bytes:>9}")
+    if encoding.orjson is None:
+        print("(orjson non installé: l'encodeur fast utilise json.JSONEncoder compact)")
+
+    wire = readings[:args.wire_rows]
+    X = np.array([[reading[feature] for feature in predict_aqi.REQUIRED_FEATURES] for reading in wire], dtype='<f4')
+    bodies = {
+        'json': ('application/json', json.dumps(wire).encode(), ''),
+        'json compact (fast)': ('application/json', json.dumps(wire).encode(), '?compact=1'),
+        'octet-stream float32': (encoding.OCTET_STREAM, X.tobytes(), ''),
+    }
+    try:
+        bodies['msgpack compact'] = (encoding.MSGPACK_TYPES[0], encoding.msgpack_dumps(wire), '?compact=1')
+    except encoding.UnsupportedFormat:
+        pass
+    try:
+        bodies['arrow ipc'] = (encoding.ARROW_STREAM_TYPES[0], encoding.arrow_write_columns(
+            {feature: X[:, i] for i, feature in enumerate(predict_aqi.REQUIRED_FEATURES)}), '')
+    except encoding.UnsupportedFormat:
+        pass
+
+    print(f"\n/predict-aqi/batch, {len(wire)} relevés par requête:")
+    print(f"{'format':<22} {'CPU /relevé':>12} {'requête':>10} {'réponse':>10}")
+    for name, (content_type, body, query) in bodies.items():
+        encoding.install_json_provider(app_module.app, 'fast' if 'fast' in name else 'flask')
+        call = lambda _: client.post('/predict-aqi/batch' + query, data=body, content_type=content_type)
+        response = call(None)
+        assert response.status_code == 200, response.data[:200]
+        cpu_us = cpu_per_call(call, range(1), args.repeat) / len(wire)
+        print(f"{name:<22} {cpu_us:>9.2f} µs {len(body):>10} {len(response.data):>10}")
+
+    X64 = X.astype(np.float64)
+    score_us = cpu_per_call(lambda _: predict_aqi.predict_aqi_matrix(X64), range(1), args.repeat) / len(wire)
+    print(f"{'(scoring seul)':<22} {score_us:>9.2f} µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Suite de benchmarks reproductible: micro-benchmarks des étapes critiques et test de charge des routes Flask
+Usage: python benchmarks/bench_suite.py --output results.json
+       python benchmarks/bench_suite.py --output new.json --compare results.json --tolerance 0.15
+
+Tout tourne en processus, sans serveur ni modèle téléchargé:
+  - le modèle d'images est un modèle TFLite de substitution généré hors ligne (stub_model.py),
+    à la taille d'entrée du vrai modèle (--input-size);
+  - le modèle AQI est entraîné sur air_pollution_data.csv dans un répertoire temporaire
+    (ou --aqi-model pour réutiliser un artefact de train_aqi.py).
+
+micro: Preprocessor.preprocess (standard et rapide), Predictor.predict, les mêmes étapes pour une
+       image déjà à la taille du modèle (raw_pixels, predict_arrays), predict_aqi (cache désactivé),
+       predict_aqi_batch, validate_pollution_data et parse_reading; médiane et p95 par appel.
+load:  des threads clients (--concurrency, un test_client Flask chacun) envoient --requests requêtes
+       par scénario (/predict-aqi, /predict-aqi/batch, /image, /image/raw); p50/p95/p99 et req/s.
+
+Les résultats (et l'environnement: commit, versions, CPU) sont écrits en JSON. Avec --compare, chaque
+mesure est confrontée au fichier de référence: un écart défavorable au-delà de --tolerance est une
+régression, et le script sort avec le code 1 (utilisable tel quel en CI).
+"""
+
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import PIL.Image
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+sys.path.insert(0, str(ROOT_DIR / 'benchmarks'))
+
+# Pas d'historique par ville pour le test de charge: il ne fait que ralentir le chargement
+os.environ.setdefault('AQI_HISTORY_PATH', '')
+
+import predict
+import predict_aqi
+from predict import Predictor, Preprocessor
+from preprocess_bench import synthetic_jpeg
+from stub_model import LABELS, write_stub_model
+
+DATASET_PATH = ROOT_DIR / 'air_pollution_data.csv'
+
+# Mesures comparées avec --compare, et le sens dans lequel elles s'améliorent
+# (micro: la médiane seule, le p95 de quelques échantillons est trop bruité)
+COMPARED_METRICS = {
+    'micro': {'median_us': 'lower'},
+    'load': {'p50_ms': 'lower', 'p95_ms': 'lower', 'p99_ms': 'lower', 'requests_per_second': 'higher'},
+}
+
+
+def environment():
+    """Ce qui rend deux fichiers de résultats comparables (ou pas)"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pillow': PIL.__version__,
+    }
+
+
+def prepare_models(work_dir, input_size, aqi_model=None):
+    """Modèle d'images de substitution et modèle AQI, chargés dans predict et predict_aqi"""
+    model_path, labels_path = write_stub_model(Path(work_dir) / 'model.tflite', Path(work_dir) / 'labels.txt',
+                                               input_size=input_size, labels=LABELS)
+    predict.MODEL_PATH = model_path
+    predict.LABELS_PATH = labels_path
+    # Pas de manifeste: le cvexport.manifest du répertoire courant décrit le vrai modèle
+    predict.MANIFEST_PATH = Path(work_dir) / 'cvexport.manifest'
+
+    predict_aqi.MODEL_PATH = Path(aqi_model) if aqi_model else Path(work_dir) / 'aqi_model' / 'simple_model.pkl'
+    predict_aqi.DATASET_PATH = DATASET_PATH
+    if not predict_aqi.initialize_aqi_model(train_if_missing=aqi_model is None):
+        raise RuntimeError(f"Could not load AQI model {predict_aqi.MODEL_PATH}")
+
+
+def load_readings(n):
+    """n relevés réels du dataset, au format JSON de /predict-aqi"""
+    df = pd.read_csv(DATASET_PATH, usecols=predict_aqi.REQUIRED_FEATURES).dropna()
+    return df.head(n).to_dict(orient='records')
+
+
+def time_call(fn, repeat, number):
+    """repeat échantillons de number appels chacun (après un appel de préchauffage); temps par appel"""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    samples = np.array(samples) * 1e6
+    median = float(np.median(samples))
+    return {
+        'median_us': round(median, 2),
+        'p95_us': round(float(np.percentile(samples, 95)), 2),
+        'min_us': round(float(samples.min()), 2),
+        'ops_per_second': round(1e6 / median, 1),
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def run_micro(input_size, repeat, readings):
+    jpeg = synthetic_jpeg(1280, 720)
+    standard = Preprocessor(input_size, is_bgr=False)
+    fast = Preprocessor(input_size, is_bgr=False, fast=True)
+    predictor = Predictor(predict.MODEL_PATH, predict.LABELS_PATH)
+    image = PIL.Image.open(io.BytesIO(jpeg))
+    image.load()
+    raw = raw_frame(jpeg, input_size)
+
+    reading = readings[0]
+    batch = readings[:100]
+
+    # Le cache masquerait l'inférence: on mesure le chemin complet
+    cache, predict_aqi.prediction_cache = predict_aqi.prediction_cache, None
+    try:
+        cases = {
+            'preprocess_standard': (lambda: standard.preprocess(PIL.Image.open(io.BytesIO(jpeg))), 5),
+            'preprocess_fast': (lambda: fast.preprocess(PIL.Image.open(io.BytesIO(jpeg))), 5),
+            'predictor_predict': (lambda: predictor.predict(image), 5),
+            'raw_pixels': (lambda: predictor.raw_pixels(raw), 200),
+            'predictor_predict_raw': (lambda: predictor.predict_arrays([predictor.raw_pixels(raw)]), 5),
+            'predict_aqi': (lambda: predict_aqi.predict_aqi(reading), 200),
+            'predict_aqi_batch_100': (lambda: predict_aqi.predict_aqi_batch(batch), 20),
+            'validate_pollution_data': (lambda: predict_aqi.validate_pollution_data(reading), 2000),
+            'parse_reading': (lambda: predict_aqi.parse_reading(reading), 2000),
+        }
+        results = {}
+        for name, (fn, number) in cases.items():
+            results[name] = time_call(fn, repeat, number)
+            print(f"  {name:<26} {results[name]['median_us']:>12.1f} µs  (p95 {results[name]['p95_us']:.1f})")
+    finally:
+        predict_aqi.prediction_cache = cache
+    return results
+
+
+def raw_frame(jpeg, input_size):
+    """Pixels RGB uint8 bruts d'une image ramenée à la taille du modèle, comme les envoie un client /image/raw"""
+    image = PIL.Image.open(io.BytesIO(jpeg)).convert('RGB').resize((input_size, input_size), PIL.Image.BILINEAR)
+    return np.asarray(image).tobytes()
+
+
+def load_scenarios(readings, image_count, input_size):
+    """(route, kwargs du test_client) par scénario; les images sont distinctes pour ne pas toucher le cache"""
+    images = [synthetic_jpeg(1280, 720, seed=seed) for seed in range(image_count)]
+    raw_images = [raw_frame(jpeg, input_size) for jpeg in images]
+    return {
+        'predict-aqi': lambda i: ('/predict-aqi', {'json': readings[i % len(readings)]}),
+        'predict-aqi-batch-100': lambda i: ('/predict-aqi/batch', {'json': readings[:100]}),
+        'image': lambda i: ('/image', {'data': images[i % len(images)], 'content_type': 'application/octet-stream'}),
+        'image-raw': lambda i: ('/image/raw', {'data': raw_images[i % len(raw_images)], 'content_type': 'application/octet-stream'}),
+    }
+
+
+def run_load_scenario(flask_app, make_request, concurrency, requests):
+    """concurrency threads se partagent requests requêtes; latences de bout en bout côté client"""
+    latencies = []
+    errors = [0]
+    next_index = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        test_client = flask_app.test_client()
+        local = []
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                break
+            path, kwargs = make_request(i)
+            start = time.perf_counter()
+            response = test_client.post(path, **kwargs)
+            local.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors[0],
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'max_ms': round(float(latencies.max()), 3),
+    }
+
+
+def run_load(concurrency, requests, readings, use_cache, input_size):
+    if not use_cache:
+        predict.IMAGE_CACHE_MAX_BYTES = 0
+        predict_aqi.prediction_cache = None
+
+    import app as app_module
+    app_module._load_models_once()
+
+    results = {}
+    for name, make_request in load_scenarios(readings, image_count=min(requests, 32), input_size=input_size).items():
+        run_load_scenario(app_module.app, make_request, concurrency, min(requests, 2 * concurrency))  # Préchauffage
+        results[name] = run_load_scenario(app_module.app, make_request, concurrency, requests)
+        r = results[name]
+        print(f"  {name:<24} {r['requests_per_second']:>8.1f} req/s  p50 {r['p50_ms']:.2f} ms  "
+              f"p95 {r['p95_ms']:.2f} ms  p99 {r['p99_ms']:.2f} ms  erreurs {r['errors']}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Liste des régressions: (section, cas, mesure, référence, actuel, écart relatif défavorable)"""
+    regressions = []
+    for section, metrics in COMPARED_METRICS.items():
+        for case, current in results.get(section, {}).items():
+            reference = baseline.get(section, {}).get(case)
+            if reference is None:
+                continue
+            for metric, better in metrics.items():
+                old, new = reference.get(metric), current.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old if better == 'lower' else (old - new) / old
+                status = 'REGRESSION' if change > tolerance else 'ok'
+                print(f"  {section}/{case:<26} {metric:<20} {old:>12} -> {new:<12} {change:+7.1%}  {status}")
+                if change > tolerance:
+                    regressions.append((section, case, metric, old, new, round(change, 4)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suites', nargs='+', choices=['micro', 'load'], default=['micro', 'load'])
+    parser.add_argument('--output', default=None, help='fichier JSON des résultats')
+    parser.add_argument('--compare', default=None, help='fichier JSON de référence')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='écart défavorable toléré (0.15: 15%%)')
+    parser.add_argument('--input-size', type=int, default=300, help='taille d\'entrée du modèle de substitution')
+    parser.add_argument('--aqi-model', default=None, help='artefact AQI existant (sinon entraîné à la volée)')
+    parser.add_argument('--repeat', type=int, default=15, help='échantillons par micro-benchmark')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads clients du test de charge')
+    parser.add_argument('--requests', type=int, default=400, help='requêtes par scénario de charge')
+    parser.add_argument('--cache', action='store_true', help='garde les caches de prédiction pendant le test de charge')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = {'environment': environment(), 'parameters': vars(args)}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.perf_counter()
+        prepare_models(work_dir, args.input_size, args.aqi_model)
+        print(f"Modèles prêts en {time.perf_counter() - start:.1f}s (substitution {args.input_size}x{args.input_size})")
+        readings = load_readings(1000)
+
+        if 'micro' in args.suites:
+            print("micro:")
+            results['micro'] = run_micro(args.input_size, args.repeat, readings)
+        if 'load' in args.suites:
+            print(f"load ({args.concurrency} clients, {args.requests} requêtes par scénario):")
+            results['load'] = run_load(args.concurrency, args.requests, readings, args.cache, args.input_size)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"Résultats écrits dans {args.output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        print(f"Comparaison avec {args.compare} (commit {baseline.get('environment', {}).get('commit')}, tolérance {args.tolerance:.0%}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} régression(s)")
+            return 1
+        print("Aucune régression")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
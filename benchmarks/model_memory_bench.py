@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Mémoire par worker du modèle AQI: pickle (modèle sklearn désérialisé) vs modèle plat projeté en mémoire
+Usage: python benchmarks/model_memory_bench.py --workers 4
+
+Lance N processus qui chargent le modèle puis prédisent tout le dataset (toutes les pages du modèle
+sont touchées), et mesure pendant qu'ils sont tous vivants:
+  rss  - mémoire résidente du processus, pages partagées comprises
+  pss  - part proportionnelle (une page partagée par N processus compte pour 1/N), Linux uniquement
+Les deux chiffres sont donnés en delta par rapport au processus juste après les imports.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT_DIR / 'app'
+
+WORKER_SNIPPET = """
+import json, sys, time
+import pandas as pd
+import predict_aqi
+
+def memory_kb():
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if parts[0] in ('Rss:', 'Pss:'):
+                    fields[parts[0][:-1].lower()] = int(parts[1])
+    except OSError:
+        import resource
+        fields['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return fields
+
+readings = pd.read_csv(sys.argv[1])[predict_aqi.REQUIRED_FEATURES].dropna().to_dict(orient='records')
+before = memory_kb()
+start = time.perf_counter()
+assert predict_aqi.initialize_aqi_model()
+load_s = time.perf_counter() - start
+predict_aqi.predict_aqi_batch(readings)
+print(json.dumps({'load_s': load_s, 'before': before}), flush=True)
+sys.stdin.read()
+"""
+
+
+def read_smaps_rollup(pid):
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if parts[0] in ('Rss:', 'Pss:'):
+                    fields[parts[0][:-1].lower()] = int(parts[1])
+    except OSError:
+        pass
+    return fields
+
+
+def measure(mode, workers, model_path, dataset):
+    env = {**os.environ, 'AQI_MODEL_PATH': str(model_path), 'AQI_CACHE_MAX_ENTRIES': '0'}
+    # Avant: le chemin 'numpy' désérialise le pickle (modèle sklearn complet) dans chaque worker
+    env['AQI_INFERENCE_BACKEND'] = 'compiled' if mode == 'flat' else 'numpy'
+
+    processes = [
+        subprocess.Popen([sys.executable, '-c', WORKER_SNIPPET, dataset], cwd=APP_DIR, env=env,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    try:
+        reports = [json.loads(process.stdout.readline()) for process in processes]
+        # Tous les workers sont chargés et vivants: les pages partagées sont réparties entre eux
+        after = [read_smaps_rollup(process.pid) for process in processes]
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+
+    rows = []
+    for report, memory in zip(reports, after):
+        rows.append({
+            'load_s': report['load_s'],
+            'rss_mb': (memory.get('rss', 0) - report['before'].get('rss', 0)) / 1024,
+            'pss_mb': (memory.get('pss', 0) - report['before'].get('pss', 0)) / 1024,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--dataset', default=str(ROOT_DIR / 'air_pollution_data.csv'))
+    parser.add_argument('--model', default=None, help='simple_model.pkl existant (défaut: entraîné dans un répertoire temporaire)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = Path(args.model) if args.model else Path(tmp_dir) / 'simple_model.pkl'
+        if not model_path.exists():
+            subprocess.run([sys.executable, 'train_aqi.py', '--dataset', args.dataset, '--output', str(model_path)],
+                           cwd=APP_DIR, capture_output=True, check=True)
+        subprocess.run([sys.executable, 'convert_aqi_model.py', '--model', str(model_path)],
+                       cwd=APP_DIR, capture_output=True, check=True)
+        print(f"pickle: {model_path.stat().st_size / 1e6:.1f} MB, modèle plat: {model_path.with_suffix('.bin').stat().st_size / 1e6:.1f} MB")
+
+        print(f"{'mode':>7} {'workers':>8} {'chargement':>11} {'rss/worker':>11} {'pss/worker':>11} {'pss total':>10}")
+        for mode in ('pickle', 'flat'):
+            rows = measure(mode, args.workers, model_path, args.dataset)
+            print(f"{mode:>7} {args.workers:>8} "
+                  f"{1000 * statistics.median(row['load_s'] for row in rows):>9.1f}ms "
+                  f"{statistics.mean(row['rss_mb'] for row in rows):>9.1f}MB "
+                  f"{statistics.mean(row['pss_mb'] for row in rows):>9.1f}MB "
+                  f"{sum(row['pss_mb'] for row in rows):>8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Test de charge du PredictorPool: débit d'inférence en fonction du nombre d'interpréteurs
+Usage: python benchmarks/predictor_pool_load.py --model app/model.tflite --sizes 1 2 4 --num-threads 1
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+
+from predict import PredictorPool
+
+
+def run_load(pool, input_array, clients, duration):
+    """Lance `clients` threads qui appellent le pool en boucle pendant `duration` secondes"""
+    counts = [0] * clients
+    stop = threading.Event()
+
+    def client(i):
+        while not stop.is_set():
+            pool.predict_arrays([input_array])
+            counts[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return sum(counts) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default=str(ROOT_DIR / 'app' / 'model.tflite'))
+    parser.add_argument('--labels', default=str(ROOT_DIR / 'app' / 'labels.txt'))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--num-threads', type=int, default=1, help='Threads intra-op par interpréteur')
+    parser.add_argument('--clients', type=int, default=None, help='Threads clients (défaut: 2 x taille du pool)')
+    parser.add_argument('--duration', type=float, default=5.0, help='Durée de chaque palier en secondes')
+    args = parser.parse_args()
+
+    print(f"CPU disponibles: {os.cpu_count()}")
+    print(f"{'pool':>6} {'clients':>8} {'req/s':>10} {'speedup':>8}")
+
+    baseline = None
+    for size in sorted(set(args.sizes)):
+        pool = PredictorPool(Path(args.model), Path(args.labels), size, num_threads=args.num_threads)
+        input_array = np.random.rand(pool.input_size, pool.input_size, 3).astype(np.float32) * 255
+        clients = args.clients or 2 * size
+
+        pool.predict_arrays([input_array])  # Préchauffage
+        throughput = run_load(pool, input_array, clients, args.duration)
+        baseline = baseline or throughput
+        print(f"{size:>6} {clients:>8} {throughput:>10.1f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark du prétraitement d'images: pipeline standard vs mode rapide (décodage JPEG réduit)
+Usage: python benchmarks/preprocess_bench.py --input-size 300 --repeat 20
+"""
+
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import PIL.Image
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+
+from predict import Preprocessor
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def synthetic_jpeg(width, height, orientation=None, seed=0):
+    """JPEG synthétique avec un contenu lisse (plus réaliste qu'un bruit pur) et une orientation EXIF optionnelle"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.stack([
+        127 + 100 * np.sin(x / 97.0),
+        127 + 100 * np.cos(y / 61.0),
+        127 + 100 * np.sin((x + y) / 143.0)
+    ], axis=-1)
+    pixels += rng.normal(0, 3, pixels.shape)
+    image = PIL.Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    exif = PIL.Image.Exif()
+    if orientation is not None:
+        exif[EXIF_ORIENTATION_TAG] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def time_preprocess(preprocessor, data, repeat):
+    out = np.empty((preprocessor._input_size, preprocessor._input_size, 3), dtype=np.float32)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        preprocessor.preprocess_into(PIL.Image.open(io.BytesIO(data)), out)
+        timings.append(time.perf_counter() - start)
+    return 1000.0 * float(np.median(timings)), out.copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--input-size', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    images = [('image/image.jpg', (ROOT_DIR / 'image' / 'image.jpg').read_bytes())]
+    for width, height, orientation in [(1280, 720, None), (1920, 1080, None), (4032, 3024, None), (4032, 3024, 6)]:
+        label = f'synthetic {width}x{height}' + (f' (EXIF {orientation})' if orientation else '')
+        images.append((label, synthetic_jpeg(width, height, orientation)))
+
+    standard = Preprocessor(args.input_size, is_bgr=False)
+    fast = Preprocessor(args.input_size, is_bgr=False, fast=True)
+
+    print(f"{'image':<34} {'KB':>6} {'standard ms':>12} {'fast ms':>9} {'speedup':>8} {'mean |diff|':>12}")
+    for label, data in images:
+        standard_ms, standard_out = time_preprocess(standard, data, args.repeat)
+        fast_ms, fast_out = time_preprocess(fast, data, args.repeat)
+        diff = float(np.abs(standard_out - fast_out).mean())
+        print(f"{label:<34} {len(data) // 1024:>6} {standard_ms:>12.2f} {fast_ms:>9.2f} {standard_ms / fast_ms:>7.1f}x {diff:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Latence de /predict-aqi avec et sans évaluation en ombre d'un modèle AQI secondaire
+Usage: python benchmarks/shadow_bench.py --requests 2000 --repeat 5
+
+Le modèle principal est l'artefact de train_aqi.py (forêt compilée); le secondaire est une autre
+RandomForest, entraînée ici sur un échantillon du dataset et notée par sklearn, bien plus lente:
+le cas défavorable d'un candidat A/B coûteux.
+
+Pour chaque mode (ombre désactivée, 10 % et 100 % des relevés), --concurrency threads clients
+(un test_client Flask chacun) envoient --requests relevés distincts à /predict-aqi, cache des
+prédictions désactivé; p50/p95/p99 côté client, médiane sur --repeat passes où les trois modes
+alternent. La file d'ombre est vidée après chaque passe, hors mesure. Le temps CPU des threads d'ombre est pris sur le même
+processus: sur une machine à un coeur, il se voit dans le débit, pas dans la latence de la réponse.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+sys.path.insert(0, str(ROOT_DIR / 'benchmarks'))
+
+os.environ.setdefault('AQI_HISTORY_PATH', '')
+
+import aqi_shadow
+import predict_aqi
+from bench_suite import load_readings, run_load_scenario
+
+DATASET_PATH = ROOT_DIR / 'air_pollution_data.csv'
+
+
+def train_secondary(path, max_rows, seed=1):
+    """Candidat A/B: une RandomForest plus petite, entraînée sur max_rows lignes"""
+    X, y, _ = predict_aqi.load_training_data(DATASET_PATH, max_rows=max_rows, random_state=seed)
+    scaler = StandardScaler().fit(X)
+    model = RandomForestRegressor(n_estimators=50, max_depth=12, random_state=seed, n_jobs=1)
+    model.fit(scaler.transform(X), y)
+    joblib.dump({'model': model, 'scaler': scaler, 'feature_names': predict_aqi.REQUIRED_FEATURES}, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=str(ROOT_DIR / 'app' / 'aqi_model' / 'simple_model.pkl'))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--train-rows', type=int, default=20000, help='lignes du modèle secondaire')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    predict_aqi.MODEL_PATH = Path(args.model)
+    predict_aqi.DATASET_PATH = DATASET_PATH
+    if not predict_aqi.initialize_aqi_model(train_if_missing=True):
+        raise SystemExit(f"Could not load AQI model {args.model}")
+    predict_aqi.prediction_cache = None
+
+    import app as app_module
+    app_module.models_loaded.set()
+    readings = load_readings(args.requests)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        secondary = aqi_shadow.load_secondary_model(train_secondary(Path(work_dir) / 'candidate.pkl', args.train_rows))
+
+    modes = {'sans ombre': 0.0, 'ombre 10 %': 0.1, 'ombre 100 %': 1.0}
+    scorers = {
+        name: aqi_shadow.ShadowScorer(
+            secondary, sample_rate=sample_rate, queue_size=aqi_shadow.AQI_SHADOW_QUEUE_SIZE,
+            batch_size=aqi_shadow.AQI_SHADOW_BATCH_SIZE, max_wait_ms=aqi_shadow.AQI_SHADOW_MAX_WAIT_MS,
+            nice=aqi_shadow.AQI_SHADOW_NICE, seed=0
+        ) if sample_rate > 0 else None
+        for name, sample_rate in modes.items()
+    }
+    make_request = lambda i: ('/predict-aqi', {'json': readings[i % len(readings)]})
+    run_load_scenario(app_module.app, make_request, args.concurrency, min(args.requests, 200))  # Préchauffage
+
+    # Modes alternés à chaque passe: la dérive de la machine touche les trois modes de la même façon
+    runs = {name: [] for name in modes}
+    for _ in range(args.repeat):
+        for name, scorer in scorers.items():
+            aqi_shadow.shadow_scorer = scorer
+            runs[name].append(run_load_scenario(app_module.app, make_request, args.concurrency, args.requests))
+            if scorer is not None:
+                scorer.drain(timeout=120)
+    aqi_shadow.shadow_scorer = None
+
+    print(f"/predict-aqi, {args.requests} requêtes, {args.concurrency} clients, médiane sur {args.repeat} passes")
+    print(f"{'mode':<14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'notés':>7} {'abandonnés':>11}")
+    reports = {}
+    for name, scorer in scorers.items():
+        summary = {key: float(np.median([run[key] for run in runs[name]])) for key in ('requests_per_second', 'p50_ms', 'p95_ms', 'p99_ms')}
+        scored = dropped = 0
+        if scorer is not None:
+            reports[name] = scorer.report()
+            scored = reports[name]['readings']['scored']
+            dropped = reports[name]['readings']['dropped']
+            scorer.close()
+        print(f"{name:<14} {summary['requests_per_second']:>8.0f} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} "
+              f"{summary['p99_ms']:>8.2f} {scored:>7} {dropped:>11}")
+
+    report = reports['ombre 100 %']
+    disagreement = report['disagreement']
+    print(f"\nécart |AQI {secondary.name} - AQI principal| sur {disagreement['readings']} relevés: "
+          f"moyenne {disagreement['mean_abs_difference']:.2f}, p95 {disagreement['abs_difference_quantiles']['p95']:.2f}, "
+          f"catégories identiques {disagreement['category_agreement']:.1%}")
+    for model_name, latency in report['latency'].items():
+        print(f"  {model_name:<16} {latency['role']:<8} p50 {latency['p50_us']:>9.1f} µs/relevé  p99 {latency['p99_us']:>9.1f} µs/relevé")
+
+
+if __name__ == '__main__':
+    main()
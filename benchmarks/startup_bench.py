@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark du démarrage à froid: temps avant d'accepter du trafic et avant d'être prêt (/ready)
+Usage: python benchmarks/startup_bench.py --repeat 3
+
+Chaque mesure lance un nouveau processus Python dans app/ (import de l'application + chargement
+des modèles), pour trois scénarios:
+  artifact   - modèle AQI produit hors ligne par train_aqi.py, chargé au démarrage
+  background - même artefact, chargé dans un thread (MODEL_LOADING=background)
+  train      - pas d'artefact, entraînement au démarrage (AQI_TRAIN_ON_STARTUP=1, ancien comportement)
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT_DIR / 'app'
+
+STARTUP_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.start_model_loading()
+accepting = time.perf_counter()
+app.models_loaded.wait()
+ready = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'accepting_s': accepting - start,
+    'ready_s': ready - start,
+    'aqi_status': app.get_aqi_load_state()['status'],
+}))
+"""
+
+
+def run_startup(env):
+    result = subprocess.run(
+        [sys.executable, '-c', STARTUP_SNIPPET],
+        cwd=APP_DIR, env={**os.environ, **env}, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dataset', default=str(ROOT_DIR / 'air_pollution_data.csv'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        artifact = Path(tmp_dir) / 'artifact' / 'simple_model.pkl'
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, 'train_aqi.py', '--dataset', args.dataset, '--output', str(artifact)],
+            cwd=APP_DIR, capture_output=True, check=True
+        )
+        print(f"Entraînement hors ligne (train_aqi.py): {time.perf_counter() - start:.2f}s")
+
+        scenarios = {
+            'artifact': lambda i: {'AQI_MODEL_PATH': str(artifact), 'MODEL_LOADING': 'eager'},
+            'background': lambda i: {'AQI_MODEL_PATH': str(artifact), 'MODEL_LOADING': 'background'},
+            'train': lambda i: {
+                'AQI_MODEL_PATH': str(Path(tmp_dir) / f'train-{i}' / 'simple_model.pkl'),
+                'AQI_DATASET_PATH': args.dataset,
+                'AQI_TRAIN_ON_STARTUP': '1',
+                'MODEL_LOADING': 'eager'
+            },
+        }
+
+        print(f"{'scénario':>10} {'import':>8} {'accepte':>8} {'prêt':>8} {'AQI':>7}")
+        for name, make_env in scenarios.items():
+            runs = [run_startup(make_env(i)) for i in range(args.repeat)]
+            median = {key: statistics.median(run[key] for run in runs) for key in ('import_s', 'accepting_s', 'ready_s')}
+            print(f"{name:>10} {median['import_s']:>7.2f}s {median['accepting_s']:>7.2f}s {median['ready_s']:>7.2f}s {runs[-1]['aqi_status']:>7}")
+
+
+if __name__ == '__main__':
+    main()
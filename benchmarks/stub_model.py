@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Génère hors ligne un modèle TFLite de substitution, sans TensorFlow (flatbuffers uniquement)
+Usage: python benchmarks/stub_model.py --output /tmp/stub.tflite --input-size 300 --conv-layers 2
+
+Même interface que le modèle exporté par CustomVision: une entrée float32 [1, taille, taille, 3]
+(pixels 0-255), une sortie float32 [1, nombre de labels] (softmax). Le graphe:
+  CONV_2D 3x3 stride 2 + ReLU (--conv-layers fois) -> AVERAGE_POOL_2D global -> FULLY_CONNECTED -> SOFTMAX
+Les poids sont tirés d'une graine fixe: deux générations donnent le même fichier, octet pour octet.
+La dimension de lot est redimensionnable (resize_tensor_input), comme pour le micro-batching.
+"""
+
+import argparse
+import math
+from pathlib import Path
+
+import flatbuffers
+import numpy as np
+
+LABELS = ('GOOD', 'MODERATE', 'SEVERE', 'UNHEALTHY', 'UNHEALTHY_SENSITIVE_GROUP', 'VERY_UNHEALTHY')
+
+# Valeurs du schéma TFLite (tensorflow/lite/schema/schema.fbs)
+SCHEMA_VERSION = 3
+FILE_IDENTIFIER = b'TFL3'
+TENSOR_FLOAT32 = 0
+OP_AVERAGE_POOL_2D = 1
+OP_CONV_2D = 3
+OP_FULLY_CONNECTED = 9
+OP_SOFTMAX = 25
+OPTIONS_CONV_2D = 1
+OPTIONS_POOL_2D = 5
+OPTIONS_FULLY_CONNECTED = 8
+OPTIONS_SOFTMAX = 9
+PADDING_SAME = 0
+PADDING_VALID = 1
+ACTIVATION_NONE = 0
+ACTIVATION_RELU = 1
+
+
+def _int_vector(builder, values, prepend=None, element_size=4):
+    prepend = prepend or builder.PrependInt32
+    builder.StartVector(element_size, len(values), element_size)
+    for value in reversed(values):
+        prepend(value)
+    return builder.EndVector()
+
+
+def _offset_vector(builder, offsets):
+    builder.StartVector(4, len(offsets), 4)
+    for offset in reversed(offsets):
+        builder.PrependUOffsetTRelative(offset)
+    return builder.EndVector()
+
+
+def _table(builder, num_fields, fields):
+    """fields: liste de (slot, méthode Prepend*Slot, valeur, défaut) ou (slot, 'offset', offset)"""
+    builder.StartObject(num_fields)
+    for field in fields:
+        if field[1] == 'offset':
+            builder.PrependUOffsetTRelativeSlot(field[0], field[2], 0)
+        else:
+            slot, prepend, value, default = field
+            prepend(slot, value, default)
+    return builder.EndObject()
+
+
+class _Graph:
+    """Tenseurs, buffers et opérateurs du sous-graphe unique, avant sérialisation"""
+
+    def __init__(self):
+        self.buffers = [b'']  # buffer 0: vide, partagé par toutes les activations
+        self.tensors = []
+        self.operators = []
+        self.opcodes = []
+
+    def tensor(self, name, shape, data=None):
+        buffer = 0
+        if data is not None:
+            self.buffers.append(np.ascontiguousarray(data, dtype='<f4').tobytes())
+            buffer = len(self.buffers) - 1
+        self.tensors.append((name, list(shape), buffer))
+        return len(self.tensors) - 1
+
+    def operator(self, opcode, inputs, outputs, options_type, options):
+        if opcode not in self.opcodes:
+            self.opcodes.append(opcode)
+        self.operators.append((self.opcodes.index(opcode), inputs, outputs, options_type, options))
+
+
+def build_model(input_size=224, num_labels=len(LABELS), conv_layers=1, channels=16, seed=0):
+    """Renvoie les octets d'un modèle .tflite de substitution"""
+    rng = np.random.default_rng(seed)
+    graph = _Graph()
+
+    size = input_size
+    in_channels = 3
+    current = graph.tensor('input', [1, size, size, in_channels])
+    model_input = current
+
+    for layer in range(conv_layers):
+        # Pixels 0-255 en entrée: poids petits pour garder les activations raisonnables
+        scale = 1.0 / (255.0 * 9 * in_channels) if layer == 0 else 1.0 / (9 * in_channels)
+        weights = graph.tensor(f'conv{layer}/weights', [channels, 3, 3, in_channels],
+                               rng.normal(0, scale, (channels, 3, 3, in_channels)))
+        bias = graph.tensor(f'conv{layer}/bias', [channels], rng.normal(0, 0.01, channels))
+        size = math.ceil(size / 2)
+        output = graph.tensor(f'conv{layer}/output', [1, size, size, channels])
+        graph.operator(OP_CONV_2D, [current, weights, bias], [output], OPTIONS_CONV_2D, [
+            (0, 'Int8', PADDING_SAME, 0), (1, 'Int32', 2, 0), (2, 'Int32', 2, 0), (3, 'Int8', ACTIVATION_RELU, 0),
+            (4, 'Int32', 1, 1), (5, 'Int32', 1, 1)
+        ])
+        current = output
+        in_channels = channels
+
+    pooled = graph.tensor('pool/output', [1, 1, 1, in_channels])
+    graph.operator(OP_AVERAGE_POOL_2D, [current], [pooled], OPTIONS_POOL_2D, [
+        (0, 'Int8', PADDING_VALID, 0), (1, 'Int32', size, 0), (2, 'Int32', size, 0),
+        (3, 'Int32', size, 0), (4, 'Int32', size, 0), (5, 'Int8', ACTIVATION_NONE, 0)
+    ])
+
+    pixel_scale = 1.0 if conv_layers else 1.0 / 255.0
+    fc_weights = graph.tensor('logits/weights', [num_labels, in_channels], rng.normal(0, 4.0 * pixel_scale, (num_labels, in_channels)))
+    fc_bias = graph.tensor('logits/bias', [num_labels], rng.normal(0, 0.1, num_labels))
+    logits = graph.tensor('logits/output', [1, num_labels])
+    graph.operator(OP_FULLY_CONNECTED, [pooled, fc_weights, fc_bias], [logits], OPTIONS_FULLY_CONNECTED, [
+        (0, 'Int8', ACTIVATION_NONE, 0)
+    ])
+
+    probabilities = graph.tensor('probabilities', [1, num_labels])
+    graph.operator(OP_SOFTMAX, [logits], [probabilities], OPTIONS_SOFTMAX, [(0, 'Float32', 1.0, 0.0)])
+
+    return _serialize(graph, model_input, probabilities)
+
+
+def _serialize(graph, model_input, model_output):
+    builder = flatbuffers.Builder(1024)
+
+    buffers = []
+    for data in graph.buffers:
+        fields = []
+        if data:
+            builder.StartVector(1, len(data), 16)
+            builder.head = builder.head - len(data)
+            builder.Bytes[builder.head:builder.head + len(data)] = data
+            fields.append((0, 'offset', builder.EndVector()))
+        buffers.append(_table(builder, 1, fields))
+
+    tensors = []
+    for name, shape, buffer in graph.tensors:
+        name_offset = builder.CreateString(name)
+        shape_offset = _int_vector(builder, shape)
+        tensors.append(_table(builder, 4, [
+            (0, 'offset', shape_offset),
+            (1, builder.PrependInt8Slot, TENSOR_FLOAT32, 0),
+            (2, builder.PrependUint32Slot, buffer, 0),
+            (3, 'offset', name_offset)
+        ]))
+
+    operators = []
+    for opcode_index, inputs, outputs, options_type, options in graph.operators:
+        options_offset = _table(builder, len(options), [
+            (slot, getattr(builder, f'Prepend{kind}Slot'), value, default) for slot, kind, value, default in options
+        ])
+        inputs_offset = _int_vector(builder, inputs)
+        outputs_offset = _int_vector(builder, outputs)
+        operators.append(_table(builder, 5, [
+            (0, builder.PrependUint32Slot, opcode_index, 0),
+            (1, 'offset', inputs_offset),
+            (2, 'offset', outputs_offset),
+            (3, builder.PrependUint8Slot, options_type, 0),
+            (4, 'offset', options_offset)
+        ]))
+
+    subgraph = _table(builder, 5, [
+        (0, 'offset', _offset_vector(builder, tensors)),
+        (1, 'offset', _int_vector(builder, [model_input])),
+        (2, 'offset', _int_vector(builder, [model_output])),
+        (3, 'offset', _offset_vector(builder, operators)),
+        (4, 'offset', builder.CreateString('main'))
+    ])
+
+    opcodes = [
+        _table(builder, 4, [
+            (0, builder.PrependInt8Slot, opcode, 0),
+            (2, builder.PrependInt32Slot, 1, 1),
+            (3, builder.PrependInt32Slot, opcode, 0)
+        ])
+        for opcode in graph.opcodes
+    ]
+
+    description = builder.CreateString('Stub model for benchmarks (benchmarks/stub_model.py)')
+    model = _table(builder, 5, [
+        (0, builder.PrependUint32Slot, SCHEMA_VERSION, 0),
+        (1, 'offset', _offset_vector(builder, opcodes)),
+        (2, 'offset', _offset_vector(builder, [subgraph])),
+        (3, 'offset', description),
+        (4, 'offset', _offset_vector(builder, buffers))
+    ])
+    builder.Finish(model, file_identifier=FILE_IDENTIFIER)
+    return bytes(builder.Output())
+
+
+def write_stub_model(model_path, labels_path=None, input_size=224, labels=LABELS, conv_layers=1, channels=16, seed=0):
+    """Écrit le modèle (et labels.txt si labels_path) et renvoie leurs chemins"""
+    model_path = Path(model_path)
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    model_path.write_bytes(build_model(input_size, len(labels), conv_layers, channels, seed))
+    if labels_path is not None:
+        labels_path = Path(labels_path)
+        labels_path.write_text('\n'.join(labels))
+    return model_path, labels_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', required=True, help='fichier .tflite à écrire')
+    parser.add_argument('--labels', default=None, help='labels.txt à écrire à côté (optionnel)')
+    parser.add_argument('--input-size', type=int, default=224)
+    parser.add_argument('--conv-layers', type=int, default=1)
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    model_path, _ = write_stub_model(args.output, args.labels, args.input_size, LABELS, args.conv_layers, args.channels, args.seed)
+    print(f"{model_path} ({model_path.stat().st_size} bytes)")
+
+
+if __name__ == '__main__':
+    main()
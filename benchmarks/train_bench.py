@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'entraînement du modèle AQI: débit (lignes/s) et pic de mémoire
+Usage: python benchmarks/train_bench.py --scale 10 --n-jobs -1
+
+Construit un dataset synthétique de --scale fois le CSV fourni (lignes répétées avec un bruit
+multiplicatif) puis, chacun dans un nouveau processus:
+  baseline - ancien chemin: CSV lu d'un bloc en float64, cible par DataFrame.apply ligne par ligne,
+             forêt entraînée sur un seul coeur (fit et scores R², sans l'écriture des artefacts)
+  pipeline - train_simple_model: lecture par blocs en float32, cible vectorisée, arbres en parallèle
+Le pic de mémoire est le RSS maximal du processus (ru_maxrss), imports compris.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT_DIR / 'app'
+
+BASELINE_SNIPPET = """
+import json, resource, sys, time
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+import predict_aqi
+
+def estimate_realistic_aqi(row):
+    return max(
+        min(300, max(0, row['pm2_5'] * 2)),
+        min(300, max(0, row['pm10'] * 1.5)),
+        min(300, max(0, row['no2'] * 2)),
+        min(300, max(0, row['o3'] * 1.2))
+    )
+
+timings = {}
+start = time.perf_counter()
+df = pd.read_csv(sys.argv[1])
+X = df[predict_aqi.REQUIRED_FEATURES].copy()
+y = df.apply(estimate_realistic_aqi, axis=1)
+mask = ~(X.isnull().any(axis=1) | y.isnull())
+X, y = X[mask], y[mask]
+timings['prepare_s'] = time.perf_counter() - start
+
+start = time.perf_counter()
+X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+scaler = StandardScaler()
+model = RandomForestRegressor(n_estimators=100, random_state=42, max_depth=15, min_samples_split=5)
+model.fit(scaler.fit_transform(X_train), y_train)
+model.score(scaler.transform(X_train), y_train), model.score(scaler.transform(X_test), y_test)
+timings['fit_s'] = time.perf_counter() - start
+
+print(json.dumps({**timings, 'rows': len(df), 'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+PIPELINE_SNIPPET = """
+import json, resource, sys, time
+from pathlib import Path
+import predict_aqi
+
+timings = {}
+start = time.perf_counter()
+X, y, n_read = predict_aqi.load_training_data(Path(sys.argv[1]), max_rows=json.loads(sys.argv[3]))
+timings['prepare_s'] = time.perf_counter() - start
+
+# Données déjà chargées: train_simple_model ne mesure plus que la normalisation, le fit et l'export
+predict_aqi.load_training_data = lambda *args, **kwargs: (X, y, n_read)
+predict_aqi.MODEL_PATH = Path(sys.argv[2])
+predict_aqi.DATASET_PATH = Path(sys.argv[1])
+start = time.perf_counter()
+assert predict_aqi.train_simple_model(n_jobs=int(sys.argv[4]), max_samples=json.loads(sys.argv[5]))
+timings['fit_s'] = time.perf_counter() - start
+
+print(json.dumps({**timings, 'rows': n_read, 'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+
+def synthesize_dataset(source, scale, path, seed=0):
+    """Répète le dataset fourni scale fois, avec un bruit multiplicatif de +/-5% sur les polluants"""
+    df = pd.read_csv(source)
+    rng = np.random.default_rng(seed)
+    numeric = df.select_dtypes('number').columns
+    with open(path, 'w') as f:
+        for i in range(scale):
+            copy = df.copy()
+            if i:
+                copy[numeric] = copy[numeric] * rng.uniform(0.95, 1.05, size=(len(df), len(numeric)))
+            copy.to_csv(f, header=(i == 0), index=False)
+
+
+def run(snippet, args):
+    result = subprocess.run([sys.executable, '-c', snippet, *args], cwd=APP_DIR,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default=str(ROOT_DIR / 'air_pollution_data.csv'))
+    parser.add_argument('--scale', type=int, default=10, help='taille du dataset synthétique, en multiples du CSV fourni')
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--max-rows', type=int, default=None)
+    parser.add_argument('--max-samples', type=float, default=None)
+    args = parser.parse_args()
+
+    print(f"CPU disponibles: {len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dataset = Path(tmp_dir) / 'train.csv'
+        synthesize_dataset(args.dataset, args.scale, dataset)
+        print(f"Dataset synthétique: {dataset.stat().st_size / 1e6:.1f} MB")
+
+        results = {
+            'baseline': run(BASELINE_SNIPPET, [str(dataset)]),
+            'pipeline': run(PIPELINE_SNIPPET, [str(dataset), str(Path(tmp_dir) / 'model' / 'simple_model.pkl'),
+                                               json.dumps(args.max_rows), str(args.n_jobs), json.dumps(args.max_samples)]),
+        }
+
+    print(f"{'chemin':>9} {'lignes':>9} {'lecture+cible':>14} {'fit':>8} {'total':>8} {'lignes/s':>10} {'pic RSS':>9}")
+    for name, result in results.items():
+        total = result['prepare_s'] + result['fit_s']
+        print(f"{name:>9} {result['rows']:>9} {result['prepare_s']:>13.2f}s "
+              f"{result['fit_s']:>7.2f}s {total:>7.2f}s {result['rows'] / total:>10.0f} "
+              f"{result['peak_rss_kb'] / 1024:>7.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
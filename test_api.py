@@ -42,6 +42,23 @@ def test_models_info():
         print(f"❌ Erreur lors du test /models/info: {e}")
         return False
 
+def test_readiness():
+    """Test de l'endpoint de disponibilité des modèles"""
+    try:
+        response = requests.get(f"{API_BASE_URL}/ready")
+        data = response.json()
+        aqi_state = data['models']['aqi_predictor']
+        if response.status_code == 200 and data['ready']:
+            print("✅ Endpoint /ready: modèles chargés")
+            print(f"   Modèle AQI: {aqi_state['status']} (version {aqi_state['version']}, {aqi_state['load_seconds']:.2f}s)")
+            return True
+        else:
+            print(f"❌ Modèles non prêts (status: {response.status_code})")
+            return False
+    except Exception as e:
+        print(f"❌ Erreur lors du test /ready: {e}")
+        return False
+
 def test_aqi_prediction():
     """Test de l'endpoint de prédiction AQI"""
     # Données de test réalistes
@@ -109,6 +126,77 @@ def test_aqi_validation():
         print(f"❌ Erreur lors du test de validation: {e}")
         return False
 
+def test_aqi_batch_prediction():
+    """Test de l'endpoint de prédiction AQI par lot"""
+    valid_reading = {
+        "co": 1.2,
+        "no": 15.5,
+        "no2": 25.3,
+        "o3": 45.2,
+        "so2": 8.1,
+        "pm2_5": 35.7,
+        "pm10": 55.2,
+        "nh3": 12.4
+    }
+    # Un relevé invalide ne doit pas faire échouer le lot
+    batch = [valid_reading, {"co": 1.2}, valid_reading]
+
+    try:
+        response = requests.post(
+            f"{API_BASE_URL}/predict-aqi/batch",
+            headers={"Content-Type": "application/json"},
+            json=batch
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            if data['succeeded'] == 2 and data['failed'] == 1 and 'error' in data['results'][1]:
+                print("✅ Prédiction AQI par lot fonctionne")
+                print(f"   {data['succeeded']}/{data['count']} relevés prédits")
+                return True
+            print(f"❌ Résultats du lot inattendus: {data}")
+            return False
+        else:
+            print(f"❌ Erreur prédiction AQI par lot (status: {response.status_code})")
+            return False
+    except Exception as e:
+        print(f"❌ Erreur lors du test AQI par lot: {e}")
+        return False
+
+def test_aqi_history():
+    """Test de l'historique par ville: un relevé prédit est ajouté, puis agrégé"""
+    reading = {
+        "co": 1.2,
+        "no": 15.5,
+        "no2": 25.3,
+        "o3": 45.2,
+        "so2": 8.1,
+        "pm2_5": 35.7,
+        "pm10": 55.2,
+        "nh3": 12.4,
+        "city": "Test City",
+        "date": "2030-01-01"
+    }
+
+    try:
+        requests.post(f"{API_BASE_URL}/predict-aqi", json=reading)
+        response = requests.get(f"{API_BASE_URL}/aqi/history/Test City/aggregate", params={"window": ["24h", "7d"]})
+
+        if response.status_code == 200:
+            data = response.json()
+            if data['windows']['24h']['count'] >= 1:
+                print("✅ Historique AQI par ville fonctionne")
+                print(f"   Moyenne 7j: {data['windows']['7d']['mean_aqi']}, max: {data['windows']['7d']['max_aqi']}")
+                return True
+            print(f"❌ Agrégats inattendus: {data}")
+            return False
+        else:
+            print(f"❌ Erreur historique AQI (status: {response.status_code})")
+            return False
+    except Exception as e:
+        print(f"❌ Erreur lors du test historique AQI: {e}")
+        return False
+
 def test_image_endpoint():
     """Test basique de l'endpoint image (sans fichier réel)"""
     try:
@@ -126,6 +214,29 @@ def test_image_endpoint():
         print(f"❌ Erreur lors du test image: {e}")
         return False
 
+def test_image_batch_endpoint():
+    """Test de l'endpoint image par lot avec plusieurs fichiers imageData"""
+    try:
+        with open("image/image.jpg", "rb") as f:
+            image_bytes = f.read()
+
+        files = [("imageData", (f"image_{i}.jpg", image_bytes, "image/jpeg")) for i in range(3)]
+        response = requests.post(f"{API_BASE_URL}/image/batch", files=files)
+
+        if response.status_code == 200:
+            data = response.json()
+            if data['count'] == 3 and all('predictions' in result for result in data['results']):
+                print("✅ Classification d'images par lot fonctionne")
+                return True
+            print(f"❌ Résultats du lot inattendus: {data}")
+            return False
+        else:
+            print(f"❌ Erreur classification par lot (status: {response.status_code})")
+            return False
+    except Exception as e:
+        print(f"❌ Erreur lors du test image par lot: {e}")
+        return False
+
 def run_all_tests():
     """Lance tous les tests"""
     print("🔍 Test du système dual de prédiction AQI")
@@ -134,9 +245,13 @@ def run_all_tests():
     tests = [
         ("Santé du serveur", test_server_health),
         ("Informations modèles", test_models_info),
+        ("Disponibilité des modèles", test_readiness),
         ("Prédiction AQI", test_aqi_prediction),
         ("Validation AQI", test_aqi_validation),
-        ("Endpoint Images", test_image_endpoint)
+        ("Prédiction AQI par lot", test_aqi_batch_prediction),
+        ("Historique AQI", test_aqi_history),
+        ("Endpoint Images", test_image_endpoint),
+        ("Images par lot", test_image_batch_endpoint)
     ]
     
     results = []
@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+"""
+Tests du modèle AQI en processus (sans serveur)
+Usage: python -m pytest test_aqi_model.py
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+
+import predict_aqi
+from compiled_forest import CompiledForest
+from model_format import read_flat
+
+DATASET_PATH = ROOT_DIR / 'air_pollution_data.csv'
+
+
+@pytest.fixture(scope='module')
+def aqi_model(tmp_path_factory):
+    """Entraîne le modèle une fois pour le module, dans un répertoire temporaire"""
+    predict_aqi.MODEL_PATH = tmp_path_factory.mktemp('aqi_model') / 'simple_model.pkl'
+    predict_aqi.DATASET_PATH = DATASET_PATH
+    assert predict_aqi.initialize_aqi_model(train_if_missing=True)
+    yield predict_aqi
+    predict_aqi.set_inference_backend('compiled')
+
+
+@pytest.fixture(scope='module')
+def readings():
+    """Tous les relevés du dataset, au format JSON de /predict-aqi"""
+    df = pd.read_csv(DATASET_PATH)
+    df = df[predict_aqi.REQUIRED_FEATURES].dropna()
+    return df.to_dict(orient='records')
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'compiled'])
+def test_backends_match_pandas_on_dataset(aqi_model, readings, backend):
+    """Les chemins d'inférence rapides donnent les mêmes prédictions que pandas sur tout le dataset"""
+    aqi_model.set_inference_backend('pandas')
+    expected = aqi_model.predict_aqi_batch(readings)
+
+    aqi_model.set_inference_backend(backend)
+    actual = aqi_model.predict_aqi_batch(readings)
+
+    assert actual == expected
+    assert sum(1 for result in actual if 'predicted_aqi' in result) > len(readings) // 2
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'compiled'])
+def test_backends_match_pandas_single_reading(aqi_model, readings, backend):
+    """Parité du chemin une-ligne de predict_aqi() sur un échantillon de relevés"""
+    for reading in readings[::250]:
+        aqi_model.set_inference_backend('pandas')
+        expected = aqi_model.predict_aqi(reading)
+        aqi_model.set_inference_backend(backend)
+        actual = aqi_model.predict_aqi(reading)
+        assert actual == expected
+
+
+def test_numpy_scaling_matches_scaler(aqi_model, readings):
+    """La normalisation précalculée reproduit StandardScaler.transform bit à bit"""
+    X = aqi_model._features_to_array(readings)
+    expected = aqi_model.scaler.transform(pd.DataFrame(X, columns=aqi_model.feature_order))
+    actual = (X - aqi_model.scaler_mean) / aqi_model.scaler_scale
+    assert np.array_equal(actual, expected)
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'compiled'])
+def test_backends_match_pandas_raw_predictions(aqi_model, readings, backend):
+    """Parité des sorties brutes du modèle, avant arrondi"""
+    X = aqi_model._features_to_array(readings)
+    aqi_model.set_inference_backend('pandas')
+    expected = aqi_model._predict_matrix(X)
+    aqi_model.set_inference_backend(backend)
+    actual = aqi_model._predict_matrix(X)
+    assert np.array_equal(actual, expected)
+
+
+def test_compiled_forest_matches_sklearn(aqi_model, readings):
+    """La forêt aplatie reproduit exactement aqi_model.predict, ligne seule et lot"""
+    X_scaled = aqi_model.scaler.transform(
+        pd.DataFrame(aqi_model._features_to_array(readings), columns=aqi_model.feature_order)
+    )
+    forest = CompiledForest.from_sklearn(aqi_model.aqi_model)
+    assert np.array_equal(forest.predict(X_scaled), aqi_model.aqi_model.predict(X_scaled))
+    assert np.array_equal(forest.predict(X_scaled[:1]), aqi_model.aqi_model.predict(X_scaled[:1]))
+
+
+def test_flat_model_saved_next_to_model(aqi_model):
+    """Le modèle plat est écrit à côté du pickle et contient forêt, scaler et métadonnées"""
+    flat_path = aqi_model.get_flat_model_path()
+    assert flat_path.parent == aqi_model.MODEL_PATH.parent
+    arrays, header = read_flat(flat_path)
+    assert np.array_equal(arrays['children'], aqi_model.compiled_forest.children)
+    assert np.array_equal(arrays['scaler_mean'], aqi_model.scaler.mean_)
+    assert header['feature_names'] == aqi_model.feature_order
+    assert header['metadata']['version'] == aqi_model.model_metadata['version']
+
+
+def test_flat_model_mapped_without_unpickling(aqi_model, readings, monkeypatch):
+    """Le chemin compilé projette le modèle plat en lecture seule, sans pickle.load, avec les mêmes prédictions"""
+    expected = aqi_model.predict_aqi_batch(readings[:500])
+
+    def no_unpickling(f):
+        raise AssertionError('pickle should not be loaded for the compiled backend')
+
+    monkeypatch.setattr(aqi_model.pickle, 'load', no_unpickling)
+    assert aqi_model.initialize_aqi_model()
+    assert aqi_model.aqi_model is None
+    forest = aqi_model.compiled_forest
+    assert isinstance(forest.threshold.base, np.memmap)
+    assert not forest.threshold.flags.writeable
+    assert aqi_model.predict_aqi_batch(readings[:500]) == expected
+
+    # Les autres chemins rechargent le modèle sklearn à la demande
+    monkeypatch.undo()
+    aqi_model.set_inference_backend('numpy')
+    assert aqi_model.aqi_model is not None
+    assert aqi_model.predict_aqi_batch(readings[:500]) == expected
+    aqi_model.set_inference_backend('compiled')
+
+
+def test_convert_pickle_model(aqi_model, tmp_path):
+    """Le convertisseur produit un modèle plat identique à celui exporté à l'entraînement, sans toucher ce dernier"""
+    exported, _ = read_flat(aqi_model.get_flat_model_path())
+    exported = {name: np.array(values) for name, values in exported.items()}
+    aqi_model.get_flat_model_path().unlink()
+    try:
+        output = aqi_model.convert_pickle_model(tmp_path / 'converted.bin')
+        assert not aqi_model.get_flat_model_path().exists()
+    finally:
+        aqi_model.export_flat_model()
+    converted, _ = read_flat(output)
+    assert converted.keys() == exported.keys()
+    assert all(np.array_equal(converted[name], exported[name]) for name in converted)
+
+
+def test_prediction_cache_hit_skips_model(aqi_model, readings, monkeypatch):
+    """Un relevé identique à la précision des capteurs est servi depuis le cache"""
+    aqi_model.invalidate_prediction_cache()
+    first = aqi_model.predict_aqi(readings[0])
+
+    def no_inference(X):
+        raise AssertionError('model should be skipped on a cache hit')
+
+    monkeypatch.setattr(aqi_model, '_predict_matrix', no_inference)
+    jittered = {feature: value + 1e-6 for feature, value in readings[0].items()}
+    second = aqi_model.predict_aqi(jittered)
+    assert second['predicted_aqi'] == first['predicted_aqi']
+    assert second['input_values'] == jittered
+    assert aqi_model.predict_aqi_batch([readings[0], jittered])[1]['predicted_aqi'] == first['predicted_aqi']
+    assert aqi_model.get_cache_stats()['hits'] == 3
+
+
+def test_prediction_cache_invalidated_on_reload(aqi_model, readings):
+    """Recharger le modèle vide le cache des prédictions"""
+    aqi_model.predict_aqi_batch(readings[:50])
+    assert aqi_model.get_cache_stats()['entries'] > 0
+    assert aqi_model.initialize_aqi_model()
+    assert aqi_model.get_cache_stats()['entries'] == 0
+
+
+def test_vectorized_target_matches_row_formula():
+    """La cible vectorisée reproduit la formule ligne par ligne d'origine"""
+    X, y, _ = predict_aqi.load_training_data(DATASET_PATH)
+    features = predict_aqi.REQUIRED_FEATURES
+    for row, target in zip(X[:500], y[:500]):
+        values = dict(zip(features, row.astype(np.float64)))
+        expected = max(
+            min(300, max(0, values['pm2_5'] * 2)),
+            min(300, max(0, values['pm10'] * 1.5)),
+            min(300, max(0, values['no2'] * 2)),
+            min(300, max(0, values['o3'] * 1.2))
+        )
+        assert target == expected
+
+
+def test_chunked_loading_matches_single_chunk():
+    """La lecture par blocs et l'échantillonnage ne dépendent pas de la taille des blocs"""
+    X_full, y_full, n_read = predict_aqi.load_training_data(DATASET_PATH)
+    X_chunked, y_chunked, _ = predict_aqi.load_training_data(DATASET_PATH, chunk_rows=97)
+    assert X_chunked.dtype == np.float32
+    np.testing.assert_array_equal(X_chunked, X_full)
+    np.testing.assert_array_equal(y_chunked, y_full)
+    assert n_read >= len(X_full)
+
+    X_sample, y_sample, _ = predict_aqi.load_training_data(DATASET_PATH, chunk_rows=97, max_rows=200)
+    assert X_sample.shape == (200, len(predict_aqi.REQUIRED_FEATURES))
+    assert len(y_sample) == 200
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_score_file_matches_batch_predictions(aqi_model, tmp_path, workers):
+    """Le scoring en masse par blocs donne les mêmes AQI que /predict-aqi/batch, dans l'ordre des lignes"""
+    import score_aqi
+
+    df = pd.read_csv(DATASET_PATH).head(1000)
+    df.loc[3, 'pm10'] = None
+    df.loc[7, 'co'] = -1.0
+    input_path = tmp_path / 'history.csv'
+    output_path = tmp_path / f'scored-{workers}.csv'
+    df.to_csv(input_path, index=False)
+
+    stats = score_aqi.score_file(input_path, output_path, chunk_rows=128, workers=workers)
+    assert stats['rows'] == 1000
+    assert stats['invalid'] == 2
+
+    scored = pd.read_csv(output_path)
+    assert list(scored.columns) == list(df.columns) + ['predicted_aqi', 'aqi_category']
+    assert list(scored['city']) == list(df['city'])
+    assert scored.loc[[3, 7], 'predicted_aqi'].isna().all()
+
+    valid = scored.drop(index=[3, 7])
+    results = aqi_model.predict_aqi_batch(valid[aqi_model.REQUIRED_FEATURES].to_dict(orient='records'))
+    assert [r['predicted_aqi'] for r in results] == list(valid['predicted_aqi'])
+    assert [r['aqi_category'] for r in results] == list(valid['aqi_category'])
+
+
+def test_history_aggregates_match_full_scan(aqi_model):
+    """Les agrégats de l'index par ville sont ceux d'un parcours complet du dataset"""
+    import timeseries
+
+    index = timeseries.TimeSeriesIndex()
+    df = pd.read_csv(DATASET_PATH)
+    df['timestamp'] = pd.to_datetime(df['date'], format=timeseries.CSV_DATE_FORMAT, utc=True)
+    df['timestamp'] = (df['timestamp'] - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+    aqi_values, categories = aqi_model.predict_aqi_frame(df)
+    index.load_frame(df, aqi_values)
+    df = df.assign(predicted_aqi=aqi_values, aqi_category=categories).dropna(subset=['predicted_aqi'])
+
+    city = df['city'].iloc[0]
+    city_rows = df[df['city'] == city]
+    end = int(city_rows['timestamp'].quantile(0.5))
+    aggregates = index.aggregate(city, ['24h', '7d', '30d'], end=end)
+
+    for window, seconds in (('24h', 86400), ('7d', 7 * 86400), ('30d', 30 * 86400)):
+        in_window = city_rows[(city_rows['timestamp'] > end - seconds) & (city_rows['timestamp'] <= end)]
+        result = aggregates['windows'][window]
+        assert result['count'] == len(in_window)
+        assert result['mean_aqi'] == pytest.approx(round(in_window['predicted_aqi'].mean(), 2), abs=0.01)
+        assert result['max_aqi'] == round(in_window['predicted_aqi'].max(), 2)
+        assert result['categories'] == in_window['aqi_category'].value_counts().to_dict()
+
+
+def test_history_out_of_order_appends():
+    """Un relevé antérieur est inséré à sa place et les cumuls restent justes"""
+    import timeseries
+
+    index = timeseries.TimeSeriesIndex()
+    features = [1.0] * len(predict_aqi.REQUIRED_FEATURES)
+    day = 86400
+    for i, aqi_value in [(0, 10.0), (2, 30.0), (3, 160.0), (1, 20.0)]:
+        index.append('Paris', i * day, aqi_value, predict_aqi.get_aqi_category(aqi_value), features)
+
+    readings = index.readings('paris')
+    assert [r['predicted_aqi'] for r in readings] == [10.0, 20.0, 30.0, 160.0]
+
+    aggregates = index.aggregate('Paris', ['2d', '7d'], end=3 * day)
+    assert aggregates['windows']['2d'] == {
+        'count': 2, 'mean_aqi': 95.0, 'max_aqi': 160.0, 'categories': {'GOOD': 1, 'UNHEALTHY': 1}
+    }
+    assert aggregates['windows']['7d']['count'] == 4
+    assert index.aggregate('Lyon', ['24h']) is None
+    with pytest.raises(ValueError):
+        timeseries.parse_window('1w')
+
+
+def test_history_retention_evicts_oldest_points():
+    """Rétention et nombre maximum de relevés: les plus anciens sont retirés, les agrégats restent justes"""
+    import timeseries
+
+    features = [1.0] * len(predict_aqi.REQUIRED_FEATURES)
+    day = 86400
+    index = timeseries.TimeSeriesIndex(max_points=16, retention=0, max_cities=2)
+    for i in range(40):
+        aqi_value = float(i % 7 * 40)
+        index.append('Paris', i * day, aqi_value, predict_aqi.get_aqi_category(aqi_value), features)
+    index.append('Lyon', 0, 10.0, 'GOOD', features)
+    index.append('Nice', 0, 10.0, 'GOOD', features)
+
+    readings = index.readings('Paris')
+    assert 16 <= len(readings) < 16 + 16 // timeseries.EVICTION_SLACK + 1
+    assert readings[-1]['date'] == timeseries.format_timestamp(39 * day)
+    stats = index.stats()
+    assert stats['readings'] == len(readings) + 1 and stats['evicted'] == 40 - len(readings)
+    assert stats['skipped'] == 1 and index.readings('Nice') is None
+
+    # Mêmes agrégats qu'un index construit avec les seuls relevés restants
+    expected = timeseries.TimeSeriesIndex(max_points=0)
+    for reading in readings:
+        expected.append('Paris', timeseries.parse_timestamp(reading['date']), reading['predicted_aqi'], reading['aqi_category'], features)
+    windows = ['3d', '10d', '60d']
+    assert index.aggregate('Paris', windows) == expected.aggregate('Paris', windows)
+
+    index = timeseries.TimeSeriesIndex(max_points=0, retention=10 * day)
+    for i in range(100):
+        index.append('Paris', i * day, 10.0, 'GOOD', features)
+    first = timeseries.parse_timestamp(index.readings('Paris')[0]['date'])
+    assert 99 * day - first < 10 * day + 100 * day // timeseries.EVICTION_SLACK
+    assert index.aggregate('Paris', ['10d'])['windows']['10d']['count'] == 10
+
+
+def test_history_loaded_on_first_history_request(aqi_model, monkeypatch, tmp_path):
+    """L'historique n'est pas scoré avec les modèles, seulement à la première consultation"""
+    import app as flask_module
+    import timeseries
+
+    history_path = tmp_path / 'history.csv'
+    pd.read_csv(DATASET_PATH).head(100).to_csv(history_path, index=False)
+    monkeypatch.setattr(timeseries, 'HISTORY_PATH', str(history_path))
+    monkeypatch.setattr(timeseries, 'history_index', timeseries.TimeSeriesIndex())
+    monkeypatch.setattr(timeseries, 'history_loaded', False)
+    monkeypatch.setattr(timeseries, 'start_history_loading', lambda: None)
+    monkeypatch.setattr(flask_module, 'initialize', lambda: None)
+    monkeypatch.setattr(flask_module.aqi_shadow, 'initialize_shadow', lambda: None)
+
+    assert flask_module.initialize_models()
+    assert timeseries.history_index.stats()['readings'] == 0
+
+    monkeypatch.setattr(flask_module, 'ensure_models_loaded', lambda: True)
+    response = flask_module.app.test_client().get('/aqi/history')
+    assert sum(city['count'] for city in response.get_json()['cities']) == 100
+    assert timeseries.history_loaded
+
+
+def test_history_rejects_out_of_range_dates(aqi_model, readings, monkeypatch):
+    """Date énorme, infinie ou entière qui déborde: erreur 400 du seul relevé, l'historique reste lisible"""
+    import app as flask_module
+    import timeseries
+
+    for date in (1e15, float('inf'), 2 ** 70, '0001-01-01T00:00:00+14:00'):
+        with pytest.raises(ValueError):
+            timeseries.parse_timestamp(date)
+
+    monkeypatch.setattr(flask_module, 'ensure_models_loaded', lambda: True)
+    client = flask_module.app.test_client()
+    reading = {**readings[0], 'city': 'Out Of Range'}
+
+    response = client.post('/predict-aqi', json={**reading, 'date': 1e15})
+    assert response.status_code == 400
+    assert 'out of range' in response.get_json()['validation_errors'][0]
+    assert client.post('/predict-aqi', json=[reading]).status_code == 400
+    assert client.post('/predict-aqi', json=5).status_code == 400
+
+    body = '[%s, %s, %s]' % (
+        json.dumps({**reading, 'date': 2 ** 70}),
+        json.dumps({**reading, 'date': float('inf')}),
+        json.dumps({**reading, 'date': '2020-12-01'})
+    )
+    response = client.post('/predict-aqi/batch', data=body, content_type='application/json')
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result.get('error') for result in results] == ['Invalid input data', 'Invalid input data', None]
+
+    assert client.get('/aqi/history').status_code == 200
+    history = client.get('/aqi/history/Out Of Range').get_json()
+    assert [r['date'] for r in history['readings']] == ['2020-12-01T00:00:00+00:00']
+
+    # Date dans le futur: refusée, elle viderait les fenêtres qui finissent au dernier relevé
+    response = client.post('/predict-aqi', json={**reading, 'date': '2999-01-01'})
+    assert response.status_code == 400 and 'future' in response.get_json()['validation_errors'][0]
+
+    # Plusieurs workers sans journal: les relevés reçus ne sont pas historisés, et la réponse le dit
+    monkeypatch.setattr(timeseries, 'AQI_HISTORY_JOURNAL', '')
+    monkeypatch.setenv('SERVER_WORKERS', '2')
+    assert client.get('/aqi/history').get_json()['recording'] is False
+    response = client.post('/predict-aqi', json={**reading, 'date': '2020-12-02'})
+    assert response.status_code == 200 and response.get_json()['history_recorded'] is False
+    assert client.get('/aqi/history/Out Of Range').get_json()['count'] == 1
+
+
+def test_history_journal_shares_readings_between_workers(aqi_model, readings, monkeypatch, tmp_path):
+    """AQI_HISTORY_JOURNAL: un relevé reçu par un worker apparaît dans l'index des autres"""
+    import app as flask_module
+    import timeseries
+
+    journal = tmp_path / 'readings.jsonl'
+    monkeypatch.setattr(timeseries, 'AQI_HISTORY_JOURNAL', str(journal))
+    monkeypatch.setattr(timeseries, 'history_index', timeseries.TimeSeriesIndex())
+    monkeypatch.setattr(timeseries, 'history_loaded', True)
+    monkeypatch.setattr(timeseries, '_journal_offset', 0)
+    monkeypatch.setattr(flask_module, 'ensure_models_loaded', lambda: True)
+    monkeypatch.setenv('SERVER_WORKERS', '2')
+    client = flask_module.app.test_client()
+
+    response = client.post('/predict-aqi', json={**readings[0], 'city': 'Test City', 'date': '2020-12-01'})
+    assert response.get_json()['history_recorded'] is True
+    assert client.get('/aqi/history/Test City/aggregate').get_json()['windows']['24h']['count'] == 1
+
+    # Un autre worker: son index part du CSV et lit tout le journal, sauf une ligne en cours d'écriture
+    monkeypatch.setattr(timeseries, 'history_index', timeseries.TimeSeriesIndex())
+    monkeypatch.setattr(timeseries, '_journal_offset', 0)
+    with open(journal, 'a') as f:
+        f.write('{"city": "Test City", "timestamp"')
+    assert timeseries.sync_journal() == 1
+    assert timeseries.history_index.readings('Test City')[0]['predicted_aqi'] == response.get_json()['predicted_aqi']
+    with open(journal, 'a') as f:
+        f.write(': 1606867200, "aqi": 42.0, "category": "GOOD", "features": [1, 2, 3, 4, 5, 6, 7, 8]}\n')
+    assert timeseries.sync_journal() == 1
+    assert timeseries.history_index.stats()['readings'] == 2
+
+
+def test_failed_model_loading_retried_with_backoff(monkeypatch):
+    """Un chargement en arrière-plan qui échoue est retenté: /ready passe à 200 sans redémarrer"""
+    import threading
+    import time
+    import app as flask_module
+
+    failures = iter([RuntimeError('model.tflite not found'), RuntimeError('model.tflite not found')])
+
+    def initialize_models():
+        error = next(failures, None)
+        if error is not None:
+            raise error
+
+    monkeypatch.setattr(flask_module, 'initialize_models', initialize_models)
+    monkeypatch.setattr(flask_module, 'models_loaded', threading.Event())
+    monkeypatch.setattr(flask_module, 'model_load', {'attempts': 0, 'retry_at': None})
+    monkeypatch.setattr(flask_module, 'MODEL_LOADING', 'lazy')
+    monkeypatch.setattr(flask_module, 'MODEL_LOAD_BACKOFF', 0.05)
+    monkeypatch.setattr(flask_module, 'get_load_state', lambda: {'status': 'ready'})
+    monkeypatch.setattr(flask_module, 'get_aqi_load_state', lambda: {'status': 'ready'})
+
+    # Lazy: 503 pendant le délai de reprise, sans nouvelle tentative à chaque requête
+    assert not flask_module.ensure_models_loaded()
+    assert not flask_module.ensure_models_loaded()
+    assert flask_module.model_load['attempts'] == 1
+    time.sleep(0.06)
+    assert not flask_module.ensure_models_loaded()
+    assert flask_module.model_load['attempts'] == 2
+
+    monkeypatch.setattr(flask_module, 'MODEL_LOADING', 'background')
+    client = flask_module.app.test_client()
+    response = client.get('/ready')
+    assert response.status_code == 503 and response.get_json()['next_retry_seconds'] <= 0.1
+    flask_module._load_models_in_background()
+    response = client.get('/ready')
+    assert response.status_code == 200 and response.get_json()['load_attempts'] == 3
+
+    # Tentatives épuisées: plus de reprise planifiée
+    monkeypatch.setattr(flask_module, 'models_loaded', threading.Event())
+    monkeypatch.setattr(flask_module, 'model_load', {'attempts': 0, 'retry_at': None})
+    monkeypatch.setattr(flask_module, 'MODEL_LOAD_RETRIES', 0)
+    failures = iter([RuntimeError('model.tflite not found')])
+    flask_module._load_models_in_background()
+    assert flask_module.model_load == {'attempts': 1, 'retry_at': None}
+    assert not flask_module.models_loaded.is_set()
+
+
+def test_failed_aqi_model_loading_not_ready_and_retried(monkeypatch):
+    """Modèle AQI introuvable: /ready reste à 503 et le chargement est retenté, sans recharger le modèle d'images"""
+    import threading
+    import app as flask_module
+
+    aqi_state = {'status': 'failed', 'error': 'Model artifact /nonexistent not found (run train_aqi.py)'}
+    aqi_loads = iter([False, True])
+    image_loads = []
+
+    def initialize_aqi_model():
+        loaded = next(aqi_loads)
+        aqi_state.update(status='ready' if loaded else 'failed')
+        return loaded
+
+    monkeypatch.setattr(flask_module, 'initialize', lambda: image_loads.append(1))
+    monkeypatch.setattr(flask_module, 'get_load_state', lambda: {'status': 'ready' if image_loads else 'not_loaded'})
+    monkeypatch.setattr(flask_module, 'initialize_aqi_model', initialize_aqi_model)
+    monkeypatch.setattr(flask_module, 'is_aqi_model_loaded', lambda: False)
+    monkeypatch.setattr(flask_module, 'get_aqi_load_state', lambda: dict(aqi_state))
+    monkeypatch.setattr(flask_module.aqi_shadow, 'initialize_shadow', lambda: None)
+    monkeypatch.setattr(flask_module.timeseries, 'start_history_loading', lambda: None)
+    monkeypatch.setattr(flask_module, 'models_loaded', threading.Event())
+    monkeypatch.setattr(flask_module, 'model_load', {'attempts': 0, 'retry_at': None})
+    monkeypatch.setattr(flask_module, 'MODEL_LOADING', 'background')
+    monkeypatch.setattr(flask_module, 'MODEL_LOAD_BACKOFF', 0.01)
+
+    client = flask_module.app.test_client()
+    assert not flask_module._load_models_once(raise_errors=False)
+    response = client.get('/ready')
+    assert response.status_code == 503 and response.get_json()['models']['aqi_predictor']['status'] == 'failed'
+    assert flask_module.model_load['retry_at'] is not None
+
+    flask_module._load_models_in_background()
+    assert client.get('/ready').status_code == 200
+    assert flask_module.model_load['attempts'] == 2 and len(image_loads) == 1
+
+
+def test_aqi_categories_breakpoints():
+    """Catégories vectorisées et scalaires identiques, sans trou entre les bornes entières"""
+    import aqi_categories
+
+    values = [0, 12.3, 50, 50.5, 51, 100, 100.01, 150.5, 200, 250, 300, 300.5, 499, -1, float('nan')]
+    expected = [
+        'GOOD', 'GOOD', 'GOOD', 'MODERATE', 'MODERATE', 'MODERATE', 'UNHEALTHY_SENSITIVE_GROUP',
+        'UNHEALTHY', 'UNHEALTHY', 'VERY_UNHEALTHY', 'VERY_UNHEALTHY', 'SEVERE', 'SEVERE', 'UNKNOWN', 'UNKNOWN'
+    ]
+    assert list(aqi_categories.categories(values)) == expected
+    assert [predict_aqi.get_aqi_category(value) for value in values] == expected
+
+
+def test_aqi_sub_indices():
+    import aqi_categories
+
+    features = predict_aqi.REQUIRED_FEATURES
+    X = np.zeros((2, len(features)))
+    X[0, features.index('pm2_5')] = 40.0
+    X[0, features.index('o3')] = 500.0
+    X[1, features.index('no2')] = 30.0
+    X[1, features.index('pm10')] = -5.0
+
+    sub_indices = aqi_categories.sub_indices(X, features)
+    np.testing.assert_array_equal(sub_indices, [[80.0, 0.0, 0.0, 300.0], [0.0, 0.0, 60.0, 0.0]])
+    np.testing.assert_array_equal(aqi_categories.estimated_aqi(X, features), [300.0, 60.0])
+    assert list(aqi_categories.dominant_pollutants(X, features)) == ['o3', 'no2']
+
+
+def test_reading_schema_parses_and_rejects_like_validation():
+    """Le schéma compilé donne le vecteur dans l'ordre du modèle et les mêmes messages qu'avant"""
+    from aqi_schema import ReadingSchema
+
+    schema = ReadingSchema(['pm10', 'co', 'no', 'no2', 'o3', 'so2', 'pm2_5', 'nh3'])
+    reading = {'co': '200.5', 'no': 1, 'no2': 2, 'o3': 3, 'so2': 4, 'pm2_5': 5, 'pm10': 6, 'nh3': 7, 'city': 'Delhi'}
+    assert schema.parse(reading) == ([6.0, 200.5, 1.0, 2.0, 3.0, 4.0, 5.0, 7.0], [])
+
+    bad = dict(reading, co=10001, no=-1, pm2_5='abc', pm10=1500)
+    del bad['nh3']
+    values, errors = schema.parse(bad)
+    assert values is None
+    assert errors == [
+        'pm10 value seems too high: 1500.0',
+        'CO value seems too high: 10001.0',
+        'Negative value for no: -1.0',
+        'Invalid numeric value for pm2_5: abc',
+        'Missing feature: nh3',
+    ]
+
+    # NaN et infini rejetés comme par invalid_rows, avec un message par feature
+    assert schema.parse(dict(reading, co=float('nan'), nh3=float('inf'))) == (None, [
+        'Invalid numeric value for co: nan',
+        'Invalid numeric value for nh3: inf',
+    ])
+
+    X = np.array([
+        schema.parse(reading)[0], [6, 200.5, -1, 2, 3, 4, 5, 7], [6, np.nan, 1, 2, 3, 4, 5, 7],
+        [1001, 0, 0, 0, 0, 0, 0, 0], [6, 200.5, 1, 2, 3, 4, 5, np.inf]
+    ])
+    assert list(schema.invalid_rows(X)) == [False, True, True, True, True]
+
+
+def test_compact_results_and_fast_json_provider(aqi_model, readings):
+    """Réponse compacte sans écho des entrées; l'encodeur rapide produit le même JSON que Flask"""
+    import flask
+    from encoding import FastJSONProvider
+
+    full = aqi_model.predict_aqi_batch(readings[:20])
+    compact = aqi_model.predict_aqi_batch(readings[:20], compact=True)
+    assert [set(result) for result in compact] == [{'predicted_aqi', 'aqi_category', 'aqi_rounded', 'index'}] * 20
+    assert [result['predicted_aqi'] for result in compact] == [result['predicted_aqi'] for result in full]
+
+    values, errors = aqi_model.parse_reading(readings[0])
+    assert errors == []
+    assert aqi_model.predict_aqi(readings[0], values=values, compact=True) == {
+        key: full[0][key] for key in ('predicted_aqi', 'aqi_category', 'aqi_rounded')
+    }
+
+    app = flask.Flask(__name__)
+    # Clés entières comme batch_size_counts de /stats
+    payload = {'count': 20, 'results': full, 'value': np.float64(1.5), 'batch_size_counts': {1: 3, 8: 1}}
+    with app.app_context():
+        expected = json.loads(app.json.response({**payload, 'value': 1.5}).get_data())
+        app.json = FastJSONProvider(app)
+        response = app.json.response(payload)
+        assert response.mimetype == 'application/json'
+        assert json.loads(response.get_data()) == expected
+        assert json.loads(app.json.dumps(payload)) == expected
+        assert app.json.loads(b'{"co": 1.5}') == {'co': 1.5}
+
+
+def test_octet_stream_rows_match_json_predictions(aqi_model, readings, monkeypatch):
+    """Lignes float32 packées: mêmes prédictions que le JSON des mêmes valeurs, réponse en float32"""
+    import app as flask_module
+    from aqi_categories import CATEGORY_CODES, UNKNOWN_CODE
+
+    monkeypatch.setattr(flask_module, 'ensure_models_loaded', lambda: True)
+    # Le cache (clés arrondies) renverrait les prédictions des valeurs float64 d'origine
+    monkeypatch.setattr(aqi_model, 'prediction_cache', None)
+    client = flask_module.app.test_client()
+
+    X = np.array([[reading[feature] for feature in predict_aqi.REQUIRED_FEATURES] for reading in readings[:50]], dtype='<f4')
+    X[3, 0] = -1.0
+    response = client.post('/predict-aqi/batch', data=X.tobytes(), content_type='application/octet-stream')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    assert response.headers['X-AQI-Invalid-Readings'] == '1'
+    rows = np.frombuffer(response.data, dtype='<f4').reshape(-1, 2)
+
+    as_json = [dict(zip(predict_aqi.REQUIRED_FEATURES, row)) for row in X.astype(float).tolist()]
+    expected = client.post('/predict-aqi/batch', json=as_json).get_json()['results']
+    for row, result in zip(rows, expected):
+        if 'error' in result:
+            assert np.isnan(row[0]) and row[1] == UNKNOWN_CODE
+        else:
+            assert row[0] == pytest.approx(result['predicted_aqi'], abs=0.01)
+            assert row[1] == CATEGORY_CODES[result['aqi_category']]
+
+    single = client.post('/predict-aqi', data=X[:1].tobytes(), content_type='application/octet-stream')
+    assert np.frombuffer(single.data, dtype='<f4').tolist() == rows[0].tolist()
+    assert client.post('/predict-aqi', data=X.tobytes(), content_type='application/octet-stream').status_code == 400
+    assert client.post('/predict-aqi/batch', data=b'\0' * 33, content_type='application/octet-stream').status_code == 400
+
+
+def test_training_writes_versioned_manifest(aqi_model):
+    """L'artefact entraîné porte sa version, aussi écrite dans le manifeste JSON"""
+    manifest = json.loads(aqi_model.get_manifest_path().read_text())
+    assert manifest['version'] == aqi_model.model_metadata['version']
+    assert manifest['version'].endswith(manifest['dataset_sha1'][:8])
+    assert aqi_model.get_load_state()['status'] == 'ready'
+
+
+def test_missing_artifact_not_trained_on_startup(aqi_model, tmp_path, monkeypatch):
+    """Sans artefact, le démarrage échoue vite au lieu d'entraîner la forêt"""
+    monkeypatch.setattr(aqi_model, 'MODEL_PATH', tmp_path / 'simple_model.pkl')
+    assert not aqi_model.initialize_aqi_model()
+    assert not aqi_model.MODEL_PATH.exists()
+    state = aqi_model.get_load_state()
+    assert state['status'] == 'failed'
+    assert 'train_aqi.py' in state['error']
+
+
+def test_unknown_backend_rejected():
+    with pytest.raises(ValueError):
+        predict_aqi.set_inference_backend('onnx')
+
+
+def test_shadow_scorer_reports_disagreement_and_drops_when_full(aqi_model, readings, monkeypatch):
+    """Ombre: même modèle en secondaire -> écart nul; file pleine -> relevé abandonné sans attendre"""
+    import threading
+    import app as flask_module
+    import aqi_shadow
+
+    monkeypatch.setattr(flask_module, 'ensure_models_loaded', lambda: True)
+    monkeypatch.setattr(aqi_model, 'prediction_cache', None)
+    secondary = aqi_shadow.load_secondary_model(predict_aqi.MODEL_PATH, name='same_model')
+    scorer = aqi_shadow.ShadowScorer(secondary, sample_rate=1.0, batch_size=16, max_wait_ms=5, seed=0)
+    monkeypatch.setattr(aqi_shadow, 'shadow_scorer', scorer)
+    client = flask_module.app.test_client()
+    try:
+        for reading in readings[:40]:
+            assert client.post('/predict-aqi', json=reading).status_code == 200
+        assert scorer.drain()
+        report = client.get('/aqi/shadow').get_json()
+    finally:
+        scorer.close()
+    assert report['readings'] == {'sampled': 40, 'scored': 40, 'dropped': 0, 'failed': 0}
+    assert report['disagreement']['mean_abs_difference'] < 0.01
+    assert report['disagreement']['category_agreement'] == 1
+    assert report['latency']['same_model']['samples'] > 0
+
+    # Secondaire bloqué: la file (1 place) se remplit, submit rend la main au lieu d'attendre
+    release = threading.Event()
+
+    class BlockedModel:
+        name = 'blocked'
+
+        def predict(self, X):
+            release.wait()
+            return np.zeros(len(X))
+
+    blocked = aqi_shadow.ShadowScorer(BlockedModel(), sample_rate=1.0, queue_size=1, batch_size=1, max_wait_ms=0)
+    values, _ = predict_aqi.parse_reading(readings[0])
+    try:
+        outcomes = [blocked.submit(values, predict_aqi.reading_schema.feature_names, 10.0, 0.001) for _ in range(5)]
+        assert not all(outcomes)
+        assert blocked.report()['readings']['dropped'] >= 1
+    finally:
+        release.set()
+        blocked.close()
@@ -0,0 +1,789 @@
+#!/usr/bin/env python3
+"""
+Tests du pipeline de classification d'images en processus (sans serveur)
+Usage: python -m pytest test_predict.py
+"""
+
+import asyncio
+import http.server
+import io
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import PIL.Image
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+
+from batching import MicroBatcher
+from cache import LRUCache
+from fetch import AsyncHTTPFetcher, FetchError, FetchTimeout, HTTPFetcher, ResponseTooLarge
+from predict import Preprocessor
+
+
+@pytest.fixture
+def stub_model(tmp_path):
+    """Modèle de substitution des benchmarks (mêmes entrées et sorties que le modèle CustomVision) et ses labels"""
+    sys.path.insert(0, str(ROOT_DIR / 'benchmarks'))
+    from stub_model import write_stub_model
+
+    return write_stub_model(tmp_path / 'stub' / 'model.tflite', tmp_path / 'stub' / 'labels.txt')
+
+
+@pytest.fixture
+def served_stub_model(stub_model, monkeypatch):
+    """predict.initialize() charge le modèle de substitution, sans manifeste"""
+    import predict
+
+    model_path, labels_path = stub_model
+    monkeypatch.setattr(predict, 'MODEL_PATH', model_path)
+    monkeypatch.setattr(predict, 'LABELS_PATH', labels_path)
+    monkeypatch.setattr(predict, 'MANIFEST_PATH', model_path.parent / 'cvexport.manifest')
+    return stub_model
+
+
+def test_micro_batcher_coalesces_concurrent_items():
+    """Les soumissions concurrentes partagent un même lot et reçoivent leur propre résultat"""
+    batch_sizes = []
+
+    def process_batch(items):
+        batch_sizes.append(len(items))
+        # Les soumissions suivantes s'accumulent pendant le traitement du premier lot
+        time.sleep(0.02)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait_ms=50)
+    results = {}
+
+    def submit(i):
+        results[i] = batcher.submit(i)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {i: i * 2 for i in range(8)}
+    assert max(batch_sizes) <= 4
+    assert len(batch_sizes) < 8
+
+    stats = batcher.stats()
+    assert stats['items'] == 8
+    assert stats['batches'] == len(batch_sizes)
+
+
+def test_micro_batcher_respects_max_wait():
+    """Un élément seul, sans autre requête en file, est traité sans attendre max_wait_ms"""
+    batcher = MicroBatcher(lambda items: items, max_batch_size=8, max_wait_ms=500)
+    start = time.perf_counter()
+    assert batcher.submit('alone') == 'alone'
+    assert time.perf_counter() - start < 0.25
+    batcher.close()
+
+
+def test_micro_batcher_propagates_errors():
+    """Une erreur de traitement est renvoyée à chaque requête du lot"""
+    def process_batch(items):
+        raise RuntimeError('interpreter failed')
+
+    batcher = MicroBatcher(process_batch, max_batch_size=2, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        batcher.submit(1)
+    batcher.close()
+
+
+def test_predictor_pool_concurrent_predictions_match(stub_model):
+    """Des inférences concurrentes sur le pool donnent les mêmes sorties qu'un Predictor seul"""
+    from predict import Predictor, PredictorPool
+
+    predictor = Predictor(*stub_model)
+    pool = PredictorPool(*stub_model, size=3, num_threads=1)
+    rng = np.random.default_rng(0)
+    input_arrays = [
+        rng.random((pool.input_size, pool.input_size, 3), dtype=np.float32) * 255
+        for _ in range(12)
+    ]
+    expected = [predictor.predict_arrays([input_array])[0] for input_array in input_arrays]
+
+    results = [None] * len(input_arrays)
+
+    def predict(i):
+        results[i] = pool.predict_arrays([input_arrays[i]])[0]
+
+    threads = [threading.Thread(target=predict, args=(i,)) for i in range(len(input_arrays))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert np.allclose(results, expected, atol=1e-6)
+    assert pool.stats() == {'size': 3, 'available': 3}
+
+
+def _jpeg_bytes(width, height, orientation=None):
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) % 256], axis=-1).astype(np.uint8)
+    exif = PIL.Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(pixels).save(buffer, 'JPEG', quality=95, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('width,height,orientation', [
+    (224, 224, None),
+    (1600, 1200, None),
+    (1200, 1600, None),
+    (1600, 1200, 6),
+    (1600, 1200, 3),
+])
+def test_fast_preprocessing_close_to_standard(width, height, orientation):
+    """Le mode rapide (draft JPEG + resize(box)) reste proche du pipeline standard, EXIF compris"""
+    data = _jpeg_bytes(width, height, orientation)
+    standard = Preprocessor(300, is_bgr=False).preprocess(PIL.Image.open(io.BytesIO(data)))
+    fast = Preprocessor(300, is_bgr=False, fast=True).preprocess(PIL.Image.open(io.BytesIO(data)))
+
+    assert fast.shape == standard.shape == (300, 300, 3)
+    assert fast.dtype == np.float32
+    assert np.abs(fast - standard).mean() < 2.0
+
+
+def test_preprocess_into_writes_preallocated_buffer():
+    """preprocess_into remplit le tableau fourni, sans en allouer un autre"""
+    out = np.zeros((300, 300, 3), dtype=np.float32)
+    image = PIL.Image.open(io.BytesIO(_jpeg_bytes(640, 480)))
+    result = Preprocessor(300, is_bgr=False, fast=True).preprocess_into(image, out)
+    assert result is out
+    assert out.any()
+
+
+def _allocation_peak_per_call(fn, repeat=10):
+    """Pic de mémoire Python allouée (tracemalloc) pendant un appel, en régime établi"""
+    tracemalloc.start()
+    try:
+        for _ in range(3):
+            fn()  # Préchauffage: interpréteurs et buffers déjà alloués
+        peaks = []
+        for _ in range(repeat):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        return sorted(peaks)[len(peaks) // 2]
+    finally:
+        tracemalloc.stop()
+
+
+def _copying_predict_batch(predictor, images):
+    """Ancien chemin: un tableau float32 par image, empilé puis copié par set_tensor/get_tensor"""
+    input_arrays = np.stack([predictor.preprocess(image) for image in images])
+    interpreter = predictor._get_interpreter(len(images))
+    interpreter.set_tensor(predictor._input_index, input_arrays)
+    interpreter.invoke()
+    return interpreter.get_tensor(predictor._output_index).tolist()
+
+
+@pytest.mark.parametrize('batch_size', [1, 4])
+def test_zero_copy_tensor_writes_reduce_allocations(stub_model, batch_size):
+    """Écrire directement dans le tenseur d'entrée évite l'allocation du tableau float32 par image"""
+    from predict import Predictor
+
+    predictor = Predictor(*stub_model)
+    data = _jpeg_bytes(640, 480)
+    input_bytes = predictor.input_size * predictor.input_size * 3 * 4
+
+    def open_images():
+        return [PIL.Image.open(io.BytesIO(data)) for _ in range(batch_size)]
+
+    if batch_size == 1:
+        zero_copy = lambda: predictor.predict(open_images()[0])
+    else:
+        zero_copy = lambda: predictor.predict_batch(open_images())
+    copying = lambda: _copying_predict_batch(predictor, open_images())
+
+    if predictor._get_interpreter(batch_size) is None:
+        pytest.skip('model does not support batching')
+    assert np.allclose(zero_copy(), copying(), atol=1e-6)
+
+    zero_copy_peak = _allocation_peak_per_call(zero_copy)
+    copying_peak = _allocation_peak_per_call(copying)
+    assert copying_peak - zero_copy_peak >= batch_size * input_bytes
+
+
+def test_micro_batched_images_preprocessed_into_tensor(stub_model, monkeypatch):
+    """Chemin servi par défaut (micro-batching): l'image est prétraitée dans son emplacement du tenseur"""
+    import predict
+
+    monkeypatch.setattr(predict, 'MICRO_BATCHING', True)
+    served = predict.ServedModel(*stub_model)
+    data = _jpeg_bytes(640, 480)
+    input_bytes = served.predictor.input_size * served.predictor.input_size * 3 * 4
+    zero_copy = lambda: predict._predict_outputs(served, PIL.Image.open(io.BytesIO(data)))
+    copying = lambda: served.batcher.submit(served.predictor.preprocess(PIL.Image.open(io.BytesIO(data))))
+    try:
+        assert np.allclose(zero_copy(), copying(), atol=1e-6)
+        # Marge: tracemalloc compte aussi les allocations des threads d'arrière-plan des autres tests
+        assert _allocation_peak_per_call(copying) - _allocation_peak_per_call(zero_copy) >= 0.9 * input_bytes
+    finally:
+        served.close()
+
+
+def test_metrics_render_prometheus_text():
+    """Histogramme cumulatif, compteurs étiquetés et échappement au format texte Prometheus"""
+    import metrics
+
+    registry = metrics.Registry()
+    histogram = metrics.Histogram('stage_seconds', 'Stage latency', ('stage',), buckets=(0.01, 0.1), registry=registry)
+    counter = metrics.Counter('requests_total', 'Requests', ('route',), registry=registry)
+    for value in (0.005, 0.05, 0.05, 3.0):
+        histogram.labels('invoke').observe(value)
+    counter.labels('/a"b').inc()
+
+    lines = registry.render().splitlines()
+    assert '# TYPE stage_seconds histogram' in lines
+    assert 'stage_seconds_bucket{stage="invoke",le="0.01"} 1' in lines
+    assert 'stage_seconds_bucket{stage="invoke",le="0.1"} 3' in lines
+    assert 'stage_seconds_bucket{stage="invoke",le="+Inf"} 4' in lines
+    assert 'stage_seconds_count{stage="invoke"} 4' in lines
+    assert 'requests_total{route="/a\\"b"} 1.0' in lines
+
+
+def test_metrics_merged_across_worker_processes(tmp_path):
+    """METRICS_MULTIPROC_DIR: compteurs et histogrammes additionnés, jauges des seuls workers en vie"""
+    import subprocess
+    import metrics
+
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    for pid, requests, in_progress, ready in ((os.getpid(), 2, 1, 1), (exited.pid, 3, 5, 0)):
+        registry = metrics.Registry()
+        counter = metrics.Counter('requests_total', 'Requests', ('route',), registry=registry)
+        histogram = metrics.Histogram('stage_seconds', 'Stage latency', buckets=(0.1,), registry=registry)
+        gauge = metrics.Gauge('in_progress', 'In progress', multiprocess_mode='sum', registry=registry)
+        ready_gauge = metrics.Gauge('ready', 'Ready', multiprocess_mode='min', registry=registry)
+        load_gauge = metrics.Gauge('load_seconds', 'Load', registry=registry)
+        counter.labels('/image').inc(requests)
+        for _ in range(requests):
+            histogram.observe(0.05)
+        gauge.set(in_progress)
+        ready_gauge.set(ready)
+        load_gauge.set(1.5)
+        metrics.write_snapshot(tmp_path, registry, pid)
+    (tmp_path / 'metrics-123.json.tmp').write_text('{')
+
+    lines = registry.render_merged(metrics.read_snapshots(tmp_path)).splitlines()
+    assert 'requests_total{route="/image"} 5.0' in lines
+    assert 'stage_seconds_bucket{le="0.1"} 5' in lines and 'stage_seconds_count 5' in lines
+    # Le worker arrêté ne compte plus dans les jauges
+    assert 'in_progress 1.0' in lines and 'ready 1.0' in lines
+    assert [line for line in lines if line.startswith('load_seconds')] == [f'load_seconds{{pid="{os.getpid()}"}} 1.5']
+
+    metrics.clear_snapshots(tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_preprocess_records_stage_timings():
+    """Chaque étape du prétraitement est chronométrée dans image_stage_duration_seconds"""
+    import metrics
+
+    stages = ('exif', 'decode', 'resize', 'tensor_write')
+    before = {stage: metrics.IMAGE_STAGE_SECONDS.labels(stage).count for stage in stages}
+    for fast in (False, True):
+        Preprocessor(224, is_bgr=False, fast=fast).preprocess(PIL.Image.open(io.BytesIO(_jpeg_bytes(640, 480))))
+    assert all(metrics.IMAGE_STAGE_SECONDS.labels(stage).count >= before[stage] + 2 for stage in stages)
+
+
+def test_stub_model_loads_and_batches(tmp_path):
+    """Le modèle de substitution des benchmarks est déterministe et se charge comme le vrai modèle"""
+    sys.path.insert(0, str(ROOT_DIR / 'benchmarks'))
+    from predict import Predictor
+    from stub_model import LABELS, build_model, write_stub_model
+
+    model_path, labels_path = write_stub_model(tmp_path / 'model.tflite', tmp_path / 'labels.txt', input_size=64)
+    assert model_path.read_bytes() == build_model(input_size=64)
+
+    predictor = Predictor(model_path, labels_path)
+    assert predictor.input_size == 64
+    assert list(predictor.labels) == list(LABELS)
+
+    images = [PIL.Image.open(io.BytesIO(_jpeg_bytes(320, 240))) for _ in range(3)]
+    single = predictor.predict(images[0])
+    batch = predictor.predict_batch(images)
+    assert len(single) == len(LABELS)
+    assert sum(single) == pytest.approx(1.0, abs=1e-5)
+    assert np.allclose(batch, [single] * 3, atol=1e-6)
+
+
+def test_raw_input_skips_preprocessing_and_validates_shape(tmp_path):
+    """Pixels bruts ou PNG à la taille du modèle: même prédiction que /image, toute autre taille refusée"""
+    sys.path.insert(0, str(ROOT_DIR / 'benchmarks'))
+    from predict import InputShapeError, Predictor
+    from stub_model import write_stub_model
+
+    model_path, labels_path = write_stub_model(tmp_path / 'model.tflite', tmp_path / 'labels.txt', input_size=64)
+    predictor = Predictor(model_path, labels_path)
+    assert predictor.input_shape == (64, 64, 3)
+
+    pixels = np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    image = PIL.Image.fromarray(pixels)
+    png = io.BytesIO()
+    image.save(png, format='PNG')
+
+    expected = predictor.predict(image)
+    for data in (pixels.tobytes(), png.getvalue()):
+        raw = predictor.raw_pixels(data)
+        assert raw.shape == (64, 64, 3) and raw.dtype == np.uint8
+        assert np.allclose(predictor.predict_arrays([raw])[0], expected, atol=1e-6)
+
+    small = io.BytesIO()
+    image.resize((32, 32)).save(small, format='PNG')
+    for data in (pixels.tobytes()[:-1], small.getvalue()):
+        with pytest.raises(InputShapeError):
+            predictor.raw_pixels(data)
+
+
+def _write_export(directory, seed, iteration_id, sha1=None):
+    """Export Custom Vision de substitution: modèle, labels et cvexport.manifest avec ModelFileSHA1"""
+    sys.path.insert(0, str(ROOT_DIR / 'benchmarks'))
+    from model_registry import file_sha1
+    from stub_model import write_stub_model
+
+    directory.mkdir(exist_ok=True)
+    model_path, _ = write_stub_model(directory / 'model.tflite', directory / 'labels.txt', input_size=32, seed=seed)
+    manifest = {'IterationId': iteration_id, 'ModelFileName': 'model.tflite', 'LabelFileName': 'labels.txt',
+                'ModelFileSHA1': sha1 or file_sha1(model_path)}
+    (directory / 'cvexport.manifest').write_text(json.dumps(manifest))
+
+
+def test_model_registry_routes_reloads_and_verifies_checksum(tmp_path):
+    """Routage par publishedName, rechargement atomique sans couper les requêtes en cours, SHA1 vérifié"""
+    from model_registry import ModelChecksumError, ModelRegistry, UnknownModel, source_from_directory
+    from predict import Predictor
+
+    class Served:
+        def __init__(self, model_path, labels_path):
+            self.predictor = Predictor(model_path, labels_path)
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    image = PIL.Image.open(io.BytesIO(_jpeg_bytes(64, 64)))
+    _write_export(tmp_path / 'v1', seed=0, iteration_id='iteration-1')
+    _write_export(tmp_path / 'v2', seed=1, iteration_id='iteration-2')
+    registry = ModelRegistry(Served, 'v1', strict=True)
+    assert {version.name for version in registry.load_directory(tmp_path)} == {'v1', 'v2'}
+
+    with registry.acquire('v1') as v1, registry.acquire('iteration-2') as v2:
+        assert v2.name == 'v2'
+        assert not np.allclose(v1.served.predictor.predict(image), v2.served.predictor.predict(image))
+    with pytest.raises(UnknownModel):
+        with registry.acquire('v3'):
+            pass
+
+    # Nouvelle itération publiée sous v1 pendant qu'une requête utilise l'ancienne
+    with registry.acquire('v1') as old:
+        expected = old.served.predictor.predict(image)
+        time.sleep(0.01)
+        _write_export(tmp_path / 'v1', seed=2, iteration_id='iteration-3')
+        (new,) = registry.scan()
+        assert registry.get('v1') is new and new.iteration_id == 'iteration-3'
+        assert not old.served.closed
+        assert old.served.predictor.predict(image) == expected
+    assert old.served.closed
+
+    # Un fichier qui ne correspond pas au manifeste n'est pas publié: la version en place continue de servir
+    time.sleep(0.01)
+    _write_export(tmp_path / 'v1', seed=4, iteration_id='iteration-4', sha1='0' * 40)
+    assert registry.scan() == []
+    assert registry.get('v1') is new and not new.served.closed
+    assert 'SHA1' in registry.info()['errors']['v1']
+    with pytest.raises(ModelChecksumError):
+        registry.reload('v1')
+    registry.close()
+    assert new.served.closed
+
+    # En mode warn, l'écart est journalisé et le modèle chargé quand même
+    lenient = ModelRegistry(Served, 'v1', verify_sha1='warn')
+    loaded = lenient.load(source_from_directory('v1', tmp_path / 'v1'))
+    assert loaded.iteration_id == 'iteration-4' and lenient.info()['errors'] == {}
+    lenient.close()
+
+
+def test_lru_cache_evicts_least_recently_used_within_budget():
+    """Le budget mémoire évince l'entrée la moins récemment utilisée"""
+    cache = LRUCache(max_bytes=300, sizeof=lambda key, value: 100)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('c', 3)
+    assert cache.get('a') == 1  # 'a' devient la plus récente
+    cache.put('d', 4)
+
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == [1, 3, 4]
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] == 300
+    assert stats['hits'] == 4 and stats['misses'] == 1
+
+
+def test_lru_cache_expires_entries_after_ttl():
+    """Une entrée plus ancienne que le TTL est une absence et disparaît du cache"""
+    now = [0.0]
+    cache = LRUCache(ttl_seconds=10, clock=lambda: now[0])
+    cache.put('frame', [0.1, 0.9])
+    now[0] = 5.0
+    assert cache.get('frame') == [0.1, 0.9]
+    now[0] = 20.0
+    assert cache.get('frame') is None
+    assert len(cache) == 0
+    assert cache.stats()['expirations'] == 1
+
+
+def test_prediction_cache_hit_skips_inference(served_stub_model, monkeypatch):
+    """Une image déjà vue est servie depuis le cache, avec un horodatage 'created' neuf"""
+    import predict
+
+    predict.initialize()
+    data = _jpeg_bytes(640, 480)
+
+    first = predict.predict_image_bytes(data)
+
+    def no_inference(served, pil_image):
+        raise AssertionError('inference should be skipped on a cache hit')
+
+    monkeypatch.setattr(predict, '_predict_outputs', no_inference)
+    time.sleep(0.001)
+    second = predict.predict_image_bytes(data)
+
+    assert second['predictions'] == first['predictions']
+    assert second['created'] != first['created']
+    assert predict.get_cache_stats()['hits'] == 1
+
+
+@pytest.mark.parametrize('micro_batching', [False, True])
+def test_image_batch_reports_truncated_images_per_item(served_stub_model, monkeypatch, micro_batching):
+    """Une image tronquée n'échoue qu'au décodage des pixels: seule son entrée du lot est en erreur"""
+    import predict
+
+    monkeypatch.setattr(predict, 'MICRO_BATCHING', micro_batching)
+    predict.initialize()
+    data = _jpeg_bytes(640, 480)
+    truncated = data[:len(data) // 2]
+    PIL.Image.open(io.BytesIO(truncated))
+
+    results = predict.predict_image_bytes_batch([data, truncated, data])
+    assert 'error' in results[1]
+    assert results[0]['predictions'] == results[2]['predictions'] == predict.predict_image_bytes(data)['predictions']
+    assert 'error' in predict.predict_image_bytes_batch([truncated])[0]
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serveur HTTP local: /image.jpg, /truncated.jpg, /slow, /large, /stream (sans Content-Length), /drip (un octet
+    toutes les 0,1 s), /missing. ETag "v1", 304 si If-None-Match correspond.
+    """
+    protocol_version = 'HTTP/1.1'
+    routes = {}
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.headers.get('If-None-Match') == '"v1"' and self.path in self.routes:
+            self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            return
+        if self.path == '/drip':
+            self.send_response(200)
+            self.send_header('Content-Length', '20')
+            self.end_headers()
+            for _ in range(20):
+                time.sleep(0.1)
+                self.wfile.write(b'x')
+                self.wfile.flush()
+            return
+        route = self.routes.get(self.path)
+        if route is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body, delay, chunked = route
+        time.sleep(delay)
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(body), 1024):
+                chunk = body[start:start + 1024]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_server():
+    _StandInHandler.routes = {
+        '/image.jpg': (_jpeg_bytes(320, 240), 0, False),
+        '/truncated.jpg': (_jpeg_bytes(320, 240)[:2000], 0, False),
+        '/slow': (b'late', 1.0, False),
+        '/slow-0': (b'a', 0.2, False),
+        '/slow-1': (b'b', 0.2, False),
+        '/slow-2': (b'c', 0.2, False),
+        '/slow-3': (b'd', 0.2, False),
+        '/large': (b'x' * 100000, 0, False),
+        '/stream': (b'x' * 100000, 0, True),
+    }
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    server.daemon_threads = True
+    server.connections = set()
+    server.not_modified = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetcher_reuses_keep_alive_connection(stand_in_server):
+    """Les requêtes successives vers un même hôte réutilisent la connexion"""
+    server, base_url = stand_in_server
+    fetcher = HTTPFetcher()
+    bodies = [fetcher.fetch(f'{base_url}/image.jpg') for _ in range(3)]
+    fetcher.close()
+
+    assert bodies[0] == bodies[2] == _StandInHandler.routes['/image.jpg'][0]
+    assert len(server.connections) == 1
+    assert fetcher.stats()['connections_reused'] == 2
+
+
+@pytest.mark.parametrize('path', ['/large', '/stream'])
+def test_fetcher_enforces_byte_cap(stand_in_server, path):
+    """Une réponse au-delà du plafond est rejetée, avec ou sans Content-Length"""
+    _, base_url = stand_in_server
+    fetcher = HTTPFetcher(max_bytes=50000)
+    with pytest.raises(ResponseTooLarge):
+        fetcher.fetch(f'{base_url}{path}')
+    assert len(HTTPFetcher(max_bytes=100000).fetch(f'{base_url}{path}')) == 100000
+
+
+def test_fetcher_read_timeout(stand_in_server):
+    """Un hôte lent est abandonné après read_timeout"""
+    _, base_url = stand_in_server
+    fetcher = HTTPFetcher(read_timeout=0.2)
+    start = time.perf_counter()
+    with pytest.raises(FetchTimeout):
+        fetcher.fetch(f'{base_url}/slow')
+    assert time.perf_counter() - start < 0.9
+
+
+def test_fetchers_enforce_download_deadline(stand_in_server):
+    """Un hôte qui envoie un octet à la fois sous read_timeout est coupé à total_timeout"""
+    _, base_url = stand_in_server
+    start = time.perf_counter()
+    with pytest.raises(FetchTimeout):
+        HTTPFetcher(read_timeout=0.5, total_timeout=0.4).fetch(f'{base_url}/drip')
+    with pytest.raises(FetchTimeout):
+        asyncio.run(AsyncHTTPFetcher(read_timeout=0.5, total_timeout=0.4).fetch(f'{base_url}/drip'))
+    assert time.perf_counter() - start < 1.6
+
+
+def test_fetcher_conditional_get_keeps_connection(stand_in_server):
+    """If-None-Match: 304 sans corps, la connexion keep-alive est réutilisée"""
+    server, base_url = stand_in_server
+    fetcher = HTTPFetcher()
+    assert fetcher.fetch(f'{base_url}/image.jpg')
+    with fetcher.open(f'{base_url}/image.jpg', {'If-None-Match': '"v1"'}) as response:
+        assert response.status == 304
+        assert response.read() == b''
+    assert fetcher.fetch(f'{base_url}/image.jpg')
+    fetcher.close()
+    assert fetcher.stats()['connections_reused'] == 2
+    assert server.not_modified == 1 and len(server.connections) == 1
+
+
+def test_fetcher_fetches_concurrently(stand_in_server):
+    """fetch_many télécharge en parallèle et renvoie les erreurs à leur place"""
+    _, base_url = stand_in_server
+    fetcher = HTTPFetcher(workers=4)
+    urls = [f'{base_url}/slow-{i}' for i in range(4)] + [f'{base_url}/missing']
+    start = time.perf_counter()
+    results = fetcher.fetch_many(fetcher.fetch, urls)
+    elapsed = time.perf_counter() - start
+    fetcher.close()
+
+    assert results[:4] == [b'a', b'b', b'c', b'd']
+    assert isinstance(results[4], FetchError)
+    assert elapsed < 0.6
+
+
+def test_fetchers_reject_unsafe_urls(stand_in_server):
+    """Espaces, caractères de contrôle et non-ASCII: URL refusée avant toute connexion"""
+    server, base_url = stand_in_server
+    urls = [f'{base_url}/image.jpg HTTP/1.1', f'{base_url}/image.jpg\r\nX-Injected: 1', f'{base_url}/\u00e9t\u00e9.jpg']
+    for url in urls:
+        with pytest.raises(FetchError, match='Unsupported URL'):
+            HTTPFetcher().fetch(url)
+        with pytest.raises(FetchError, match='Unsupported URL'):
+            asyncio.run(AsyncHTTPFetcher().fetch(url))
+    assert not server.connections
+
+
+def test_async_fetcher_reuses_connection_and_enforces_cap(stand_in_server):
+    """Variante asyncio: connexion keep-alive réutilisée, plafond appliqué avec ou sans Content-Length"""
+    server, base_url = stand_in_server
+
+    async def scenario():
+        fetcher = AsyncHTTPFetcher(max_bytes=50000)
+        bodies = [await fetcher.fetch(f'{base_url}/image.jpg') for _ in range(3)]
+        stats = fetcher.stats()
+        for path in ('/large', '/stream'):
+            with pytest.raises(ResponseTooLarge):
+                await fetcher.fetch(f'{base_url}{path}')
+        fetcher.close()
+        return bodies, stats
+
+    bodies, stats = asyncio.run(scenario())
+    assert bodies[0] == bodies[2] == _StandInHandler.routes['/image.jpg'][0]
+    assert stats['connections_reused'] == 2
+    assert len(asyncio.run(AsyncHTTPFetcher(max_bytes=100000).fetch(f'{base_url}/stream'))) == 100000
+
+
+def test_async_fetcher_concurrency_and_timeout(stand_in_server):
+    """Variante asyncio: téléchargements concurrents, hôte lent abandonné après read_timeout"""
+    _, base_url = stand_in_server
+
+    async def scenario():
+        fetcher = AsyncHTTPFetcher(read_timeout=0.5)
+        urls = [f'{base_url}/slow-{i}' for i in range(4)] + [f'{base_url}/missing', f'{base_url}/slow']
+        start = time.perf_counter()
+        results = await fetcher.fetch_many(fetcher.fetch, urls)
+        elapsed = time.perf_counter() - start
+        fetcher.close()
+        return results, elapsed
+
+    results, elapsed = asyncio.run(scenario())
+    assert results[:4] == [b'a', b'b', b'c', b'd']
+    assert isinstance(results[4], FetchError)
+    assert isinstance(results[5], FetchTimeout)
+    assert elapsed < 0.9
+
+
+def test_predict_url_batch_reports_errors_per_url(stand_in_server, served_stub_model):
+    """/url/batch: une URL en erreur ne fait pas échouer les autres"""
+    import predict
+
+    server, base_url = stand_in_server
+    predict.initialize()
+
+    results = predict.predict_url_batch([f'{base_url}/image.jpg', f'{base_url}/missing', f'{base_url}/large', f'{base_url}/truncated.jpg'])
+    assert results[0]['predictions'] == predict.predict_url(f'{base_url}/image.jpg')['predictions']
+    assert 'error' in results[1]
+    assert 'error' in results[2]
+    assert 'error' in results[3]
+    # Déjà classée: GET conditionnel, 304 sans corps
+    assert server.not_modified == 1
+
+
+def test_asgi_serves_url_routes_and_delegates_to_flask(stand_in_server, served_stub_model, monkeypatch):
+    """asgi.app: /url et /url/batch sur la boucle asyncio, les autres routes via l'application Flask"""
+    import app as flask_module
+    import asgi
+    import predict
+
+    _, base_url = stand_in_server
+    monkeypatch.setattr(flask_module, 'initialize_models', predict.initialize)
+
+    async def request(method, path, payload=None):
+        messages = []
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': [(b'content-type', b'application/json')]}
+        await asgi.app(scope, receive, send)
+        return messages[0]['status'], messages[1]['body']
+
+    async def scenario():
+        lifespan = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        started = asyncio.Event()
+
+        async def receive():
+            message = next(lifespan)
+            if message['type'] == 'lifespan.shutdown':
+                await started.wait()
+            return message
+
+        async def send(message):
+            if message['type'] == 'lifespan.startup.complete':
+                started.set()
+
+        lifespan_task = asyncio.create_task(asgi.app({'type': 'lifespan'}, receive, send))
+        await started.wait()
+        responses = [
+            await request('POST', '/url', {'url': f'{base_url}/image.jpg'}),
+            await request('POST', '/url/batch', {'urls': [f'{base_url}/image.jpg', f'{base_url}/missing']}),
+            await request('GET', '/models/info'),
+        ]
+        await lifespan_task
+        return responses
+
+    (url_status, url_body), (batch_status, batch_body), (info_status, info_body) = asyncio.run(scenario())
+    assert url_status == batch_status == info_status == 200
+    batch = json.loads(batch_body)
+    assert batch['results'][0]['predictions'] == json.loads(url_body)['predictions']
+    assert 'error' in batch['results'][1]
+    assert 'aqi_predictor' in json.loads(info_body)['models']
+
+
+def test_asgi_rejects_oversized_bodies():
+    """asgi.app: corps au-delà de MAX_CONTENT_LENGTH refusé en 413, annoncé ou non par Content-Length"""
+    import app as flask_module
+    import asgi
+
+    limit = flask_module.app.config['MAX_CONTENT_LENGTH']
+
+    async def request(chunks, headers):
+        messages = []
+        received = []
+        pending = list(chunks)
+
+        async def receive():
+            chunk = pending.pop(0)
+            received.append(chunk)
+            return {'type': 'http.request', 'body': chunk, 'more_body': bool(pending)}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/predict-aqi', 'query_string': b'', 'headers': headers}
+        await asgi.app(scope, receive, send)
+        return messages[0]['status'], len(received)
+
+    chunk = b'x' * (limit // 4)
+    declared = [(b'content-length', str(limit + 1).encode())]
+    assert asyncio.run(request([chunk] * 5, declared)) == (413, 0)
+    # Sans Content-Length: la lecture s'arrête au premier morceau qui dépasse
+    assert asyncio.run(request([chunk] * 8, [])) == (413, 5)